@@ -0,0 +1,50 @@
+# batch_retrieval.py
+import time
+import numpy as np
+from tqdm import tqdm
+from llama_index.core import Settings
+from llama_index.core.schema import QueryBundle
+
+from flat_vector_store import FlatVectorStore
+from multi_index_retriever import embed_queries
+
+# --- 1. CONFIGURATION ---
+# Questions per embedding forward pass
+EMBED_BATCH_SIZE = 64
+
+
+# --- 2. BATCH RETRIEVAL ---
+def embed_questions(questions, embed_model=None, batch_size=EMBED_BATCH_SIZE):
+    """Embeds all questions with the query prompt, batch_size at a time. Returns a (n, dim) float32 array."""
+    embed_model = embed_model or Settings.embed_model
+    vectors = []
+    for start in tqdm(range(0, len(questions), batch_size), desc="Embedding questions"):
+        vectors.extend(embed_queries(embed_model, questions[start:start + batch_size]))
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def batch_retrieve(indexes, questions, top_k, embed_model=None, batch_size=EMBED_BATCH_SIZE):
+    """
+    Offline retrieval for a whole question set: every question is embedded once (in batches)
+    and ranked against every index in `indexes` ({name: index}). Flat indexes are searched
+    exactly with blocked matrix products (FlatVectorStore.batch_query); other stores are
+    queried one question at a time with the precomputed embeddings.
+    Returns {name: [[metadata dict, ...] per question]} in ranking order.
+    """
+    start = time.time()
+    query_embeddings = embed_questions(questions, embed_model, batch_size)
+    embedded = time.time()
+
+    rankings = {}
+    for name, index in indexes.items():
+        store = index.vector_store
+        if isinstance(store, FlatVectorStore):
+            rows, _ = store.batch_query(query_embeddings, top_k)
+            rankings[name] = [[store.row_metadata(int(row)) for row in question_rows] for question_rows in rows]
+        else:
+            retriever = index.as_retriever(similarity_top_k=top_k)
+            rankings[name] = [[node.metadata for node in retriever.retrieve(QueryBundle(question, embedding=embedding.tolist()))]
+                              for question, embedding in zip(questions, query_embeddings)]
+    print(f"Batch retrieval: embedded {len(questions)} questions in {embedded - start:.1f}s, "
+          f"ranked {len(indexes)} indexes in {time.time() - embedded:.1f}s.")
+    return rankings
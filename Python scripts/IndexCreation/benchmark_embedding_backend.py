@@ -0,0 +1,109 @@
+# benchmark_embedding_backend.py
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import numpy as np
+
+# Modules used by both IndexCreation and RAGPipelines live in ../Shared
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Shared"))
+from embedding_backend import load_embed_model, EMBEDDING_BACKENDS
+
+# --- 1. CONFIGURATION ---
+MODEL_NAME = "BAAI/bge-large-en-v1.5"
+# Lowest acceptable cosine between a backend's vector and the PyTorch vector for the same text
+PARITY_THRESHOLDS = {"onnx": 0.999, "onnx-int8": 0.98}
+# Top-k used to compare document rankings between backends
+RANKING_K = 10
+
+
+# --- 2. MEASUREMENT ---
+def load_texts(validation_file, entity_dir, n_queries, n_docs):
+    """Benchmark questions as queries and entity index texts as documents."""
+    with open(validation_file, 'r') as f:
+        queries = [item['natural_language_question'] for item in json.load(f)][:n_queries]
+    with open(f"{entity_dir}/nodes.json", 'r', encoding='utf-8') as f:
+        docs = json.load(f)["texts"][:n_docs]
+    return queries, docs
+
+
+def measure(model, queries, docs):
+    """Query vectors, per-query latencies (ms, one call each, as the search tools do) and batch document throughput."""
+    model.get_query_embedding("warm-up")
+    query_vectors, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        query_vectors.append(model.get_query_embedding(query))
+        latencies.append((time.perf_counter() - start) * 1000)
+    start = time.perf_counter()
+    doc_vectors = model.get_text_embedding_batch(docs)
+    docs_per_sec = len(docs) / max(time.perf_counter() - start, 1e-9)
+    return np.asarray(query_vectors, dtype=np.float32), np.asarray(doc_vectors, dtype=np.float32), latencies, docs_per_sec
+
+
+def row_cosines(a, b):
+    return (a * b).sum(axis=1) / np.maximum(np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1), 1e-12)
+
+
+def top_k_overlap(queries_a, docs_a, queries_b, docs_b, k):
+    """Mean overlap of each query's top-k documents under the two backends."""
+    k = min(k, docs_a.shape[0])
+    top_a = np.argsort(-(queries_a @ docs_a.T), axis=1)[:, :k]
+    top_b = np.argsort(-(queries_b @ docs_b.T), axis=1)[:, :k]
+    return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(top_a, top_b)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parity and latency of the ONNX Runtime embedding backends against PyTorch.")
+    parser.add_argument("--backends", nargs="+", choices=EMBEDDING_BACKENDS[1:], default=list(EMBEDDING_BACKENDS[1:]))
+    parser.add_argument("--model-name", default=MODEL_NAME)
+    parser.add_argument("--validation-file", default="../WitcherBenchmark/test_set.json", help="Questions used as queries.")
+    parser.add_argument("--entity-dir", default="./storage/entity_index", help="Flat entity index whose texts are used as documents.")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--docs", type=int, default=256)
+    parser.add_argument("--threads", type=int, default=None, help="ONNX Runtime intra-op threads (default: $ONNX_THREADS or one per core).")
+    parser.add_argument("--output-file", default="embedding_backend_report.json")
+    args = parser.parse_args()
+
+    queries, docs = load_texts(args.validation_file, args.entity_dir, args.queries, args.docs)
+    print(f"--- {len(queries)} queries, {len(docs)} documents ---")
+
+    results = {}
+    reference = None
+    for backend in ["torch"] + args.backends:
+        print(f"--- Measuring {backend} ---")
+        model = load_embed_model(args.model_name, backend=backend, num_threads=args.threads)
+        query_vectors, doc_vectors, latencies, docs_per_sec = measure(model, queries, docs)
+        latencies.sort()
+        results[backend] = {
+            "query_p50_ms": statistics.median(latencies),
+            "query_p95_ms": latencies[int(0.95 * (len(latencies) - 1))],
+            "docs_per_sec": docs_per_sec,
+        }
+        if reference is None:
+            reference = (query_vectors, doc_vectors)
+        else:
+            query_cosines, doc_cosines = row_cosines(query_vectors, reference[0]), row_cosines(doc_vectors, reference[1])
+            results[backend].update({
+                "min_cosine": float(min(query_cosines.min(), doc_cosines.min())),
+                "mean_query_cosine": float(query_cosines.mean()), "mean_doc_cosine": float(doc_cosines.mean()),
+                f"top{RANKING_K}_overlap": top_k_overlap(query_vectors, doc_vectors, *reference, RANKING_K),
+            })
+            results[backend]["parity_ok"] = results[backend]["min_cosine"] >= PARITY_THRESHOLDS[backend]
+        print(f"  - {backend}: {json.dumps(results[backend])}")
+
+    with open(args.output_file, 'w') as f:
+        json.dump({"model_name": args.model_name, "queries": len(queries), "docs": len(docs), "backends": results}, f, indent=2)
+    print(f"\nReport saved to {args.output_file}")
+
+    failed = [backend for backend in args.backends if not results[backend]["parity_ok"]]
+    if failed:
+        print(f"Parity check FAILED for {failed} (thresholds {PARITY_THRESHOLDS}).")
+        sys.exit(1)
+    print("Parity check passed.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# benchmark_token_batching.py
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import numpy as np
+from llama_index.core.schema import MetadataMode
+
+# Modules used by both IndexCreation and RAGPipelines live in ../Shared
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Shared"))
+from embedding_backend import load_embed_model, load_tokenizer, EMBEDDING_BACKEND, EMBEDDING_BACKENDS
+from flat_vector_store import FlatVectorStore
+from entity_partitions import PARTITION_KEY
+from token_batching import TokenBudgetEmbedder, in_process_batches, tokenize_documents, TOKEN_BUDGET
+
+# --- 1. CONFIGURATION ---
+MODEL_NAME = "BAAI/bge-large-en-v1.5"
+# Texts per batch of the length-sorted item-count strategy (the embedding pool's former default)
+SORTED_BATCH_SIZE = 32
+# Documents are shuffled with a fixed seed: the index stores them grouped by type, which would flatter item batching
+SHUFFLE_SEED = 0
+
+
+# --- 2. MEASUREMENT ---
+def load_documents(entity_dir, n_docs):
+    """The entity texts exactly as they were embedded at build time (content + embed metadata), shuffled."""
+    store = FlatVectorStore.from_persist_dir(entity_dir)
+    texts = []
+    for row in range(store.count()):
+        node = store.row_node(row)
+        node.excluded_embed_metadata_keys = [PARTITION_KEY]
+        texts.append(node.get_content(metadata_mode=MetadataMode.EMBED))
+    random.Random(SHUFFLE_SEED).shuffle(texts)
+    return texts[:n_docs]
+
+
+def padded_tokens(lengths, batches):
+    return int(sum(len(batch) * max(lengths[i] for i in batch) for batch in batches))
+
+
+def row_cosines(a, b):
+    return (a * b).sum(axis=1) / np.maximum(np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1), 1e-12)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of token-budgeted, length-bucketed document embedding against item-count batching.")
+    parser.add_argument("--model-name", default=MODEL_NAME)
+    parser.add_argument("--embedding-backend", choices=EMBEDDING_BACKENDS, default=EMBEDDING_BACKEND)
+    parser.add_argument("--entity-dir", default="./storage/entity_index", help="Flat entity index whose documents are embedded.")
+    parser.add_argument("--docs", type=int, default=2000)
+    parser.add_argument("--token-budgets", type=int, nargs="+", default=[4096, TOKEN_BUDGET, 32768])
+    parser.add_argument("--output-file", default="token_batching_report.json")
+    args = parser.parse_args()
+
+    texts = load_documents(args.entity_dir, args.docs)
+    model = load_embed_model(args.model_name, backend=args.embedding_backend)
+    tokenizer = load_tokenizer(args.model_name, args.embedding_backend)
+    max_length = getattr(model, "max_length", None) or tokenizer.model_max_length
+    segments, _, stats = tokenize_documents(texts, tokenizer, max_length)
+    lengths = [len(segment) for segment in segments]
+    print(f"--- {len(texts)} documents, {sum(lengths)} tokens (median {int(np.median(lengths))}, max {max(lengths)}), "
+          f"{stats['truncated']} over {max_length} tokens ---")
+    model.get_text_embedding("warm-up")
+
+    results = {}
+    # LlamaIndex's default: documents in input order, embed_batch_size at a time
+    start = time.perf_counter()
+    reference = np.asarray(model.get_text_embedding_batch(texts), dtype=np.float32)
+    elapsed = time.perf_counter() - start
+    batches = [list(range(i, min(i + model.embed_batch_size, len(texts)))) for i in range(0, len(texts), model.embed_batch_size)]
+    results["items"] = {"docs_per_sec": len(texts) / elapsed, "batches": len(batches), "padded_tokens": padded_tokens(lengths, batches)}
+
+    # Sorted by character length, fixed batch size
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    batches = [order[i:i + SORTED_BATCH_SIZE] for i in range(0, len(order), SORTED_BATCH_SIZE)]
+    vectors = np.empty_like(reference)
+    start = time.perf_counter()
+    for batch in batches:
+        vectors[batch] = np.asarray(model._get_text_embeddings([texts[i] for i in batch]), dtype=np.float32)
+    elapsed = time.perf_counter() - start
+    results["items_sorted"] = {"docs_per_sec": len(texts) / elapsed, "batches": len(batches), "padded_tokens": padded_tokens(lengths, batches),
+                               "min_cosine_to_items": float(row_cosines(vectors, reference).min())}
+
+    for budget in args.token_budgets:
+        embedder = TokenBudgetEmbedder(args.model_name, in_process_batches(model), args.embedding_backend, budget,
+                                       normalize=getattr(model, "normalize", True), max_length=max_length)
+        vectors = embedder.embed_texts(texts, desc=f"Token budget {budget}")
+        results[f"tokens_{budget}"] = {"docs_per_sec": embedder.stats["docs_per_sec"], "batches": embedder.stats["batches"],
+                                       "padded_tokens": embedder.stats["padded_tokens"],
+                                       "min_cosine_to_items": float(row_cosines(vectors, reference).min())}
+
+    for name, result in results.items():
+        result["padding_efficiency"] = sum(lengths) / max(result["padded_tokens"], 1)
+        result["speedup_vs_items"] = result["docs_per_sec"] / results["items"]["docs_per_sec"]
+        print(f"  - {name}: {json.dumps(result)}")
+
+    with open(args.output_file, 'w') as f:
+        json.dump({"model_name": args.model_name, "backend": args.embedding_backend, "docs": len(texts),
+                   "tokens": sum(lengths), "max_length": max_length, "strategies": results}, f, indent=2)
+    print(f"\nReport saved to {args.output_file}")
+
+
+if __name__ == "__main__":
+    main()
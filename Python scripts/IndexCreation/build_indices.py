@@ -1,23 +1,83 @@
 # build_indices.py
+import json
+import os
+import sys
+import argparse
 import warnings
-from llama_index.core import VectorStoreIndex, Settings
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+from llama_index.core import Settings
 
+# Modules used by both IndexCreation and RAGPipelines live in ../Shared
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Shared"))
 # Import your new, enriched data preparation function
-from prepare_data import extract_and_format_enriched_data
+from prepare_data import extract_and_format_enriched_data, extract_term_dictionary, extract_name_index_entries
+from query_log import export_query_stats
+from lexical_index import lexical_entries
+from incremental_index import build_or_update_index, STORE_FORMATS
+from flat_vector_store import SUPPORTED_DTYPES, QUANTIZATION_MODES, INDEX_TYPES, REDUCTION_METHODS
+from hnsw_vector_store import DEFAULT_M, DEFAULT_EF_CONSTRUCTION
+from embedding_pool import EmbeddingPool
+from embedding_cache import with_embedding_cache, CachedEmbedding
+from embedding_backend import load_embed_model, EMBEDDING_BACKEND, EMBEDDING_BACKENDS
+from cascade_retriever import CASCADE_INDEX_DIR
+from entity_partitions import assign_partitions
+from token_batching import TokenBudgetEmbedder, in_process_batches, TOKEN_BUDGET, LONG_DOCUMENTS, LONG_DOCUMENT_MODES
 
 # Suppress a harmless warning from the sentence-transformers library
 warnings.filterwarnings("ignore", category=FutureWarning, module="sentence_transformers.SentenceTransformer")
 
-def build_and_persist_indexes():
-    """Builds and saves the three specialized indexes from the enriched data."""
+def build_and_persist_indexes(offline=False, full_rebuild=False, embed_workers=0, embed_threads=None,
+                              store_format="flat", dtype="float32", quantize=(), index_type="exact",
+                              hnsw_m=DEFAULT_M, hnsw_ef_construction=DEFAULT_EF_CONSTRUCTION, cascade_model=None,
+                              reduce_dim=None, reduction="pca", embedding_backend=EMBEDDING_BACKEND,
+                              token_budget=TOKEN_BUDGET, long_documents=LONG_DOCUMENTS):
+    """
+    Builds and saves the three specialized indexes from the enriched data.
+    With offline=True the documents are read from the KG files instead of GraphDB.
+    Existing indexes are updated incrementally (only new/changed documents are embedded)
+    unless full_rebuild=True. With embed_workers > 0, documents are embedded by a pool of
+    model replicas (see embedding_pool.py) instead of the in-process model. Either way,
+    texts already in the embedding cache (see embedding_cache.py) are not embedded again.
+    store_format "flat" persists a memory-mapped embedding matrix (see flat_vector_store.py);
+    "simple" keeps LlamaIndex's JSON vector store and docstore. `quantize` lists the
+    compressed first-pass codes ("int8", "binary") written for the flat entity index.
+    index_type "hnsw" also builds an HNSW graph (see hnsw_vector_store.py) over the flat
+    entity and class matrices, which the pipelines then search instead of scanning.
+    With cascade_model, the entities are also embedded with that (small) model into
+    CASCADE_INDEX_DIR, the first stage of the cascade retriever (see cascade_retriever.py).
+    With reduce_dim, the flat entity matrix is stored with that many dimensions, by PCA
+    fitted on the entity vectors or, for Matryoshka-trained models, reduction="truncate".
+    embedding_backend "onnx"/"onnx-int8" embeds with ONNX Runtime (see embedding_backend.py).
+    Entity documents are tagged with a coarse type partition (see entity_partitions.py),
+    which the flat store uses to group its rows for partition-filtered searches.
+    With token_budget > 0, documents are tokenized once and embedded in length-bucketed
+    batches of at most that many padded tokens; documents over the model's max sequence
+    length are truncated or, with long_documents="split", embedded in windows and averaged
+    (see token_batching.py). token_budget=0 keeps LlamaIndex's fixed-size batches.
+    """
+    if index_type == "hnsw" and store_format != "flat":
+        print("Error: --index-type hnsw needs --store-format flat.")
+        return
+    if cascade_model and store_format != "flat":
+        print("Error: --cascade-model needs --store-format flat.")
+        return
+    if reduce_dim and store_format != "flat":
+        print("Error: --reduce-dim needs --store-format flat.")
+        return
+    entity_reduction = {"method": reduction, "dim": reduce_dim} if reduce_dim else None
+    hnsw = {"M": hnsw_m, "ef_construction": hnsw_ef_construction} if index_type == "hnsw" else None
+    if offline:
+        from prepare_data_offline import (extract_and_format_enriched_data_offline as extract_documents,
+                                          extract_term_dictionary_offline as extract_terms,
+                                          extract_name_index_entries_offline as extract_names)
+    else:
+        extract_documents, extract_terms, extract_names = extract_and_format_enriched_data, extract_term_dictionary, extract_name_index_entries
     
     print("--- Setting up LlamaIndex embedding model ---")
     # For indexing, we ONLY need the embedding model. This is efficient.
     try:
-        Settings.embed_model = HuggingFaceEmbedding(model_name="BAAI/bge-large-en-v1.5")
+        Settings.embed_model = with_embedding_cache(load_embed_model("BAAI/bge-large-en-v1.5", backend=embedding_backend))
     except Exception as e:
-        print(f"Error initializing embedding model. Is sentence-transformers installed? Error: {e}")
+        print(f"Error initializing embedding model. Is sentence-transformers (or onnxruntime) installed? Error: {e}")
         return
     
     # We explicitly set the LLM to None for this script.
@@ -25,25 +85,103 @@ def build_and_persist_indexes():
     print("LLM is not required for indexing. Proceeding with embedding model only.")
 
     # 1. Get the enriched data
-    entity_docs, class_docs, prop_docs = extract_and_format_enriched_data()
+    entity_docs, class_docs, prop_docs = extract_documents()
+    partition_counts = assign_partitions(entity_docs)
+    print(f"Entity partitions: {dict(partition_counts.most_common())}")
+
+    def token_embed_nodes(embed_model):
+        """embed_nodes running `embed_model` in this process on token-budgeted batches (None with token_budget=0)."""
+        if token_budget <= 0:
+            return None
+        inner = getattr(embed_model, "inner", embed_model)
+        embedder = TokenBudgetEmbedder(inner.model_name, in_process_batches(inner), embedding_backend, token_budget, long_documents,
+                                       cache=embed_model if isinstance(embed_model, CachedEmbedding) else None,
+                                       normalize=getattr(inner, "normalize", True), max_length=getattr(inner, "max_length", None))
+        return embedder.embed_nodes
+
+    cache = Settings.embed_model if isinstance(Settings.embed_model, CachedEmbedding) else None
+    pool = EmbeddingPool("BAAI/bge-large-en-v1.5", embed_workers, embed_threads, cache=cache, backend=embedding_backend,
+                         token_budget=token_budget, long_documents=long_documents) if embed_workers > 0 else None
+    embed_nodes = pool.embed_nodes if pool else token_embed_nodes(Settings.embed_model)
+    # Recorded in each manifest; without a token budget the model truncates long documents itself
+    long_documents = long_documents if token_budget > 0 else "truncate"
 
     # 2. Build and persist the ENTITY index
     print("\n--- Building Enriched Entity Index ---")
-    entity_index = VectorStoreIndex.from_documents(entity_docs, show_progress=True)
-    entity_index.storage_context.persist(persist_dir="./storage/entity_index")
+    build_or_update_index(entity_docs, "./storage/entity_index", full_rebuild=full_rebuild, embed_nodes=embed_nodes,
+                          store_format=store_format, dtype=dtype, quantize=quantize, hnsw=hnsw, reduction=entity_reduction,
+                          long_documents=long_documents)
     print("Entity Index built and saved to ./storage/entity_index")
 
+    if cascade_model:
+        print(f"\n--- Building Small-Model Entity Index ({cascade_model}) ---")
+        cascade_embed_model = with_embedding_cache(load_embed_model(cascade_model, backend=embedding_backend))
+        build_or_update_index(entity_docs, CASCADE_INDEX_DIR, full_rebuild=full_rebuild, store_format=store_format,
+                              embed_nodes=token_embed_nodes(cascade_embed_model), embed_model=cascade_embed_model,
+                              long_documents=long_documents)
+        print(f"Small-model Entity Index built and saved to {CASCADE_INDEX_DIR}")
+
     # 3. Build and persist the CLASS index
     print("\n--- Building Class Index ---")
-    class_index = VectorStoreIndex.from_documents(class_docs, show_progress=True)
-    class_index.storage_context.persist(persist_dir="./storage/class_index")
+    build_or_update_index(class_docs, "./storage/class_index", full_rebuild=full_rebuild, embed_nodes=embed_nodes,
+                          store_format=store_format, dtype=dtype, hnsw=hnsw, long_documents=long_documents)
     print("Class Index built and saved to ./storage/class_index")
 
     # 4. Build and persist the PROPERTY index
     print("\n--- Building Property Index ---")
-    prop_index = VectorStoreIndex.from_documents(prop_docs, show_progress=True)
-    prop_index.storage_context.persist(persist_dir="./storage/prop_index")
+    build_or_update_index(prop_docs, "./storage/prop_index", full_rebuild=full_rebuild, embed_nodes=embed_nodes,
+                          store_format=store_format, dtype=dtype, long_documents=long_documents)
     print("Property Index built and saved to ./storage/prop_index")
 
+    if pool:
+        pool.close()
+
+    # 5. Persist the term dictionary used by the pipelines' local query validation
+    print("\n--- Saving Term Dictionary ---")
+    terms = extract_terms()
+    os.makedirs("./storage", exist_ok=True)
+    with open("./storage/term_dictionary.json", 'w', encoding='utf-8') as f:
+        json.dump(terms, f)
+    print(f"Term dictionary with {len(terms)} URIs saved to ./storage/term_dictionary.json")
+
+    # 6. Persist the class/property names behind the agent's keyword lookups
+    print("\n--- Saving Class/Property Name Index ---")
+    name_entries = extract_names()
+    with open("./storage/name_index.json", 'w', encoding='utf-8') as f:
+        json.dump(name_entries, f)
+    print(f"Name index with {len(name_entries)} entries saved to ./storage/name_index.json")
+
+    # 7. Persist the names/aliases/types behind the search tools' BM25 lexical matching
+    print("\n--- Saving Lexical Index ---")
+    lexical = lexical_entries(entity_docs, "entity") + lexical_entries(class_docs, "class") + lexical_entries(prop_docs, "property")
+    with open("./storage/lexical_index.json", 'w', encoding='utf-8') as f:
+        json.dump(lexical, f, ensure_ascii=False)
+    print(f"Lexical index with {len(lexical)} entries saved to ./storage/lexical_index.json")
+
+    export_query_stats()
+
 if __name__ == "__main__":
-    build_and_persist_indexes()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Build and persist the entity, class and property indexes.")
+    parser.add_argument("--offline", action="store_true", help="Read the documents from RDF/Witcher3KG.n3 and RDF/Classes.ttl in the repository root instead of GraphDB.")
+    parser.add_argument("--full-rebuild", action="store_true", help="Re-embed every document instead of only the new/changed ones.")
+    parser.add_argument("--embed-workers", type=int, default=0, help="Embed with this many model replica processes (0 = in-process, as before).")
+    parser.add_argument("--embed-threads", type=int, default=None, help="Torch threads per embedding worker (default: cores / workers).")
+    parser.add_argument("--store-format", choices=STORE_FORMATS, default="flat", help="'flat': memory-mapped .npy matrix + side table; 'simple': LlamaIndex JSON stores.")
+    parser.add_argument("--dtype", choices=SUPPORTED_DTYPES, default="float32", help="Storage precision of the flat embedding matrix.")
+    parser.add_argument("--quantize", nargs="*", choices=QUANTIZATION_MODES[1:], default=[], help="Also write int8 and/or binary codes of the entity matrix for quantized first-pass search.")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="exact", help="'hnsw': also build an HNSW graph over the entity and class matrices (needs hnswlib).")
+    parser.add_argument("--hnsw-m", type=int, default=DEFAULT_M, help="HNSW graph degree M.")
+    parser.add_argument("--hnsw-ef-construction", type=int, default=DEFAULT_EF_CONSTRUCTION, help="HNSW build-time beam width.")
+    parser.add_argument("--reduce-dim", type=int, default=None, help="Store the entity matrix with this many dimensions (e.g. 128, 256, 512).")
+    parser.add_argument("--reduction", choices=REDUCTION_METHODS[1:], default="pca", help="How --reduce-dim reduces: PCA fitted on the entity vectors, or truncation for Matryoshka models.")
+    parser.add_argument("--embedding-backend", choices=EMBEDDING_BACKENDS, default=EMBEDDING_BACKEND, help="Run the embedding model with PyTorch or ONNX Runtime (default: $EMBEDDING_BACKEND or torch).")
+    parser.add_argument("--token-budget", type=int, default=TOKEN_BUDGET, help="Padded tokens per embedding batch, texts bucketed by token length (0 = fixed-size batches; default: $EMBED_TOKEN_BUDGET or 16384).")
+    parser.add_argument("--long-documents", choices=LONG_DOCUMENT_MODES, default=LONG_DOCUMENTS, help="Documents over the model's max sequence length: keep the leading tokens, or embed windows and average them (switching rebuilds the indexes).")
+    parser.add_argument("--cascade-model", default=None, help="Also embed the entities with this small model for the two-stage cascade (e.g. BAAI/bge-small-en-v1.5).")
+    args = parser.parse_args()
+    build_and_persist_indexes(offline=args.offline, full_rebuild=args.full_rebuild, embed_workers=args.embed_workers,
+                              embed_threads=args.embed_threads, store_format=args.store_format, dtype=args.dtype,
+                              quantize=args.quantize, index_type=args.index_type, hnsw_m=args.hnsw_m,
+                              hnsw_ef_construction=args.hnsw_ef_construction, cascade_model=args.cascade_model,
+                              reduce_dim=args.reduce_dim, reduction=args.reduction, embedding_backend=args.embedding_backend,
+                              token_budget=args.token_budget, long_documents=args.long_documents)
\ No newline at end of file
@@ -0,0 +1,132 @@
+# embedding_pool.py
+import os
+import time
+import numpy as np
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from llama_index.core.schema import MetadataMode
+from tqdm import tqdm
+
+from token_batching import TokenBudgetEmbedder, TOKEN_BUDGET, LONG_DOCUMENTS
+from embedding_backend import embed_token_ids
+
+# --- 1. CONFIGURATION ---
+# Texts per forward pass with token_budget=0; each task sent to a worker is one such batch
+DEFAULT_BATCH_SIZE = 32
+
+# Model replica owned by each worker process (set in _init_worker)
+_worker_model = None
+
+
+# --- 2. WORKER SIDE ---
+def _init_worker(model_name, threads_per_worker, batch_size, worker_counter, backend):
+    """
+    Runs once in every worker: pins the intra-op thread count (and, on Linux, the CPU cores)
+    so replicas do not oversubscribe the machine, then loads one model replica.
+    """
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads_per_worker)
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+    with worker_counter.get_lock():
+        worker_id = worker_counter.value
+        worker_counter.value += 1
+    if hasattr(os, "sched_setaffinity"):
+        cpu_count = os.cpu_count() or 1
+        cores = {(worker_id * threads_per_worker + i) % cpu_count for i in range(threads_per_worker)}
+        os.sched_setaffinity(0, cores)
+
+    global _worker_model
+    # Same factory and defaults as build_indices.py, so vectors match the single-process path
+    from embedding_backend import load_embed_model
+    if backend == "torch":
+        import torch
+        torch.set_num_threads(threads_per_worker)
+    _worker_model = load_embed_model(model_name, backend=backend, num_threads=threads_per_worker, embed_batch_size=batch_size, device="cpu")
+
+
+def _embed_batch(texts):
+    return np.asarray(_worker_model._get_text_embeddings(texts), dtype=np.float32)
+
+
+def _embed_token_batch(batch_ids):
+    return embed_token_ids(_worker_model, batch_ids)
+
+
+# --- 3. POOL ---
+class EmbeddingPool:
+    """
+    Shards document embedding across a process pool with one model replica per worker.
+    With token_budget > 0, texts are tokenized once in this process and the workers get
+    token-budgeted, length-bucketed batches of ids (see token_batching.py). Otherwise texts
+    are sorted by character length and cut into batch_size batches. Either way vectors are
+    put back in input order. With `cache` (a CachedEmbedding wrapping the same model),
+    embed_nodes only sends texts missing from the embedding cache to the workers.
+    """
+
+    def __init__(self, model_name, num_workers, threads_per_worker=None, batch_size=DEFAULT_BATCH_SIZE, cache=None, backend="torch",
+                 token_budget=TOKEN_BUDGET, long_documents=LONG_DOCUMENTS):
+        self.num_workers = num_workers
+        self.cache = cache
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // num_workers)
+        self.batch_size = batch_size
+        ctx = mp.get_context("spawn")
+        self.executor = ProcessPoolExecutor(
+            max_workers=num_workers, mp_context=ctx, initializer=_init_worker,
+            initargs=(model_name, self.threads_per_worker, batch_size, ctx.Value('i', 0), backend),
+        )
+        self.token_embedder = None
+        if token_budget > 0:
+            self.token_embedder = TokenBudgetEmbedder(model_name, self._map_token_batches, backend, token_budget, long_documents, cache)
+        batching = f"token budget {token_budget}" if token_budget > 0 else f"batch size {batch_size}"
+        print(f"Started embedding pool: {num_workers} workers x {self.threads_per_worker} threads, {batching}.")
+
+    def _map_token_batches(self, batch_ids):
+        futures = {self.executor.submit(_embed_token_batch, ids): index for index, ids in enumerate(batch_ids)}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+    def embed_texts(self, texts, desc="Embedding"):
+        """Returns a float32 array of shape (len(texts), dim) in the order of `texts`."""
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        batches = [order[i:i + self.batch_size] for i in range(0, len(order), self.batch_size)]
+
+        start = time.time()
+        vectors = None
+        futures = {self.executor.submit(_embed_batch, [texts[i] for i in batch]): batch for batch in batches}
+        with tqdm(total=len(texts), desc=desc) as progress:
+            for future in as_completed(futures):
+                batch = futures[future]
+                embeddings = future.result()
+                if vectors is None:
+                    vectors = np.empty((len(texts), embeddings.shape[1]), dtype=np.float32)
+                vectors[batch] = embeddings
+                progress.update(len(batch))
+
+        elapsed = time.time() - start
+        print(f"Embedded {len(texts)} documents in {elapsed:.1f}s ({len(texts) / max(elapsed, 1e-9):.1f} docs/sec).")
+        return vectors
+
+    def embed_nodes(self, nodes):
+        """Fills node.embedding with the same text LlamaIndex would embed (content + embed metadata)."""
+        if self.token_embedder is not None:
+            return self.token_embedder.embed_nodes(nodes)
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+        if self.cache is not None:
+            vectors = np.asarray(self.cache.cached_embeddings(texts, "text", self.embed_texts), dtype=np.float32)
+        else:
+            vectors = self.embed_texts(texts)
+        for node, vector in zip(nodes, vectors):
+            node.embedding = vector.tolist()
+        return nodes
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
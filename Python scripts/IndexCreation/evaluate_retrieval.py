@@ -1,13 +1,27 @@
+import os
+import sys
 import json
+import time
 import argparse
 import re
 import math
 from tqdm import tqdm
 from collections import defaultdict
-from llama_index.core import load_index_from_storage, StorageContext, Settings
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+from llama_index.core import Settings
+from llama_index.core.schema import QueryBundle
 import warnings
 
+# Modules used by both IndexCreation and RAGPipelines live in ../Shared
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Shared"))
+from flat_vector_store import load_vector_index, iter_index_metadata, partition_filters, QUANTIZATION_MODES, REDUCTION_METHODS, FlatVectorStore
+from llama_index.core.vector_stores.types import VectorStoreQuery
+from batch_retrieval import batch_retrieve, embed_questions
+from embedding_cache import with_embedding_cache
+from embedding_backend import load_embed_model
+from cascade_retriever import load_cascade_retriever, SHORTLIST_SIZE
+from entity_partitions import route_query, PARTITION_KEY
+from label_lookup import load_label_lookup
+
 warnings.filterwarnings("ignore", category=FutureWarning, module="sentence_transformers.SentenceTransformer")
 
 def extract_and_categorize_ground_truth(sparql_query, uri_to_type_map):
@@ -69,22 +83,349 @@ def calculate_all_metrics_at_k(retrieved_names, ground_truth_names, k):
     return {'precision': precision, 'recall': recall, 'f1': f1, 'mrr': reciprocal_rank}
 
 
+def compare_quantized_entity_retrieval(validation_set, uri_to_type_map, k_values, entity_dir="./storage/entity_index"):
+    """
+    Compares the entity index searched exactly against its int8 and binary first-pass modes.
+    Each question is embedded once and sent to every mode; a mode is scored on recall@k and
+    MRR against the ground-truth entities, on the overlap of its top-k with the exact top-k,
+    and on its mean query latency. Only questions with ground-truth entities are counted.
+    """
+    max_k = max(k_values)
+    retrievers = {mode: load_vector_index(entity_dir, quantization=mode).as_retriever(similarity_top_k=max_k)
+                  for mode in QUANTIZATION_MODES}
+    results = {mode: {"recall": defaultdict(list), "mrr": defaultdict(list), "overlap_with_exact": defaultdict(list), "latency_ms": []}
+               for mode in QUANTIZATION_MODES}
+
+    for item in tqdm(validation_set, desc="Comparing quantization modes"):
+        gt_entities = extract_and_categorize_ground_truth(item['sparql_query'], uri_to_type_map).get('entity')
+        if not gt_entities:
+            continue
+        nlq = item['natural_language_question']
+        query_bundle = QueryBundle(nlq, embedding=Settings.embed_model.get_query_embedding(nlq))
+
+        ranked = {}
+        for mode, retriever in retrievers.items():
+            start = time.perf_counter()
+            ranked[mode] = [node.metadata.get('uri') for node in retriever.retrieve(query_bundle)]
+            results[mode]["latency_ms"].append((time.perf_counter() - start) * 1000)
+
+        for mode in QUANTIZATION_MODES:
+            for k in k_values:
+                metrics = calculate_all_metrics_at_k(ranked[mode], gt_entities, k)
+                results[mode]["recall"][k].append(metrics['recall'])
+                results[mode]["mrr"][k].append(metrics['mrr'])
+                exact_top = set(ranked["none"][:k])
+                results[mode]["overlap_with_exact"][k].append(len(exact_top & set(ranked[mode][:k])) / max(len(exact_top), 1))
+
+    summary = {"k_values": k_values, "modes": {}}
+    for mode, mode_results in results.items():
+        latencies = mode_results["latency_ms"]
+        summary["modes"][mode] = {
+            metric: {k: sum(scores[k]) / len(scores[k]) if scores[k] else 0.0 for k in k_values}
+            for metric, scores in mode_results.items() if metric != "latency_ms"
+        }
+        summary["modes"][mode]["mean_latency_ms"] = sum(latencies) / len(latencies) if latencies else 0.0
+        summary["modes"][mode]["questions"] = len(latencies)
+    return summary
+
+
+def compare_cascade_retrieval(validation_set, uri_to_type_map, k_values, entity_index, shortlist_size=SHORTLIST_SIZE, margins=()):
+    """
+    Compares single-stage entity retrieval (large-model query embedding + exact search) with
+    the two-stage cascade (cascade_retriever.py), always rescoring and with each decisive
+    margin in `margins`. Latency covers the query embeddings too, since they dominate on CPU,
+    so the embedding cache is bypassed here. Each setting is scored on recall@k and MRR
+    against the ground-truth entities, on the overlap of its top-k with the single-stage
+    top-k, and on how often the large model was skipped.
+    """
+    max_k = max(k_values)
+    large_model = getattr(Settings.embed_model, "inner", Settings.embed_model)
+    cascades = {"cascade": load_cascade_retriever(entity_index, max_k, shortlist_size=shortlist_size)}
+    for margin in margins:
+        cascades[f"cascade_margin_{margin}"] = load_cascade_retriever(entity_index, max_k, shortlist_size=shortlist_size, decisive_margin=margin)
+    for cascade in cascades.values():
+        cascade.small_embed_model = getattr(cascade.small_embed_model, "inner", cascade.small_embed_model)
+        cascade.large_embed_model = large_model
+    single_stage = entity_index.as_retriever(similarity_top_k=max_k)
+    settings = ["single_stage"] + list(cascades)
+    results = {name: {"recall": defaultdict(list), "mrr": defaultdict(list), "overlap_with_single_stage": defaultdict(list), "latency_ms": []}
+               for name in settings}
+
+    for item in tqdm(validation_set, desc="Comparing cascade retrieval"):
+        gt_entities = extract_and_categorize_ground_truth(item['sparql_query'], uri_to_type_map).get('entity')
+        if not gt_entities:
+            continue
+        nlq = item['natural_language_question']
+        ranked = {}
+        start = time.perf_counter()
+        ranked["single_stage"] = [node.metadata.get('uri') for node in single_stage.retrieve(QueryBundle(nlq, embedding=large_model.get_query_embedding(nlq)))]
+        results["single_stage"]["latency_ms"].append((time.perf_counter() - start) * 1000)
+        for name, cascade in cascades.items():
+            start = time.perf_counter()
+            ranked[name] = [node.metadata.get('uri') for node in cascade.retrieve(QueryBundle(nlq))]
+            results[name]["latency_ms"].append((time.perf_counter() - start) * 1000)
+
+        for name in settings:
+            for k in k_values:
+                metrics = calculate_all_metrics_at_k(ranked[name], gt_entities, k)
+                results[name]["recall"][k].append(metrics['recall'])
+                results[name]["mrr"][k].append(metrics['mrr'])
+                single_top = set(ranked["single_stage"][:k])
+                results[name]["overlap_with_single_stage"][k].append(len(single_top & set(ranked[name][:k])) / max(len(single_top), 1))
+
+    summary = {"k_values": k_values, "shortlist_size": shortlist_size, "settings": {}}
+    for name, setting_results in results.items():
+        latencies = sorted(setting_results["latency_ms"])
+        summary["settings"][name] = {
+            metric: {k: sum(scores[k]) / len(scores[k]) if scores[k] else 0.0 for k in k_values}
+            for metric, scores in setting_results.items() if metric != "latency_ms"
+        }
+        summary["settings"][name]["mean_latency_ms"] = sum(latencies) / len(latencies) if latencies else 0.0
+        summary["settings"][name]["p95_latency_ms"] = latencies[int(0.95 * (len(latencies) - 1))] if latencies else 0.0
+        summary["settings"][name]["questions"] = len(latencies)
+        if name in cascades:
+            stats = cascades[name].stats
+            summary["settings"][name]["large_model_skip_rate"] = stats["large_model_skipped"] / max(stats["queries"], 1)
+    return summary
+
+
+def sweep_dimensions(validation_set, uri_to_type_map, dims, k, method="pca", entity_dir="./storage/entity_index"):
+    """
+    Recall and latency of the entity index per dimensionality. Reduced copies of the full
+    entity matrix are made in memory (fit_projection, as build_indices.py --reduce-dim does),
+    so one full-size build serves the whole sweep. Each setting is scored on recall@k
+    against the ground-truth entities, on the overlap of its top-k with the full-size top-k,
+    on mean exact-search latency (query projection included) and on matrix size.
+    """
+    full_store = FlatVectorStore.from_persist_dir(entity_dir, mmap=False)
+    if full_store.reduction is not None:
+        print(f"Error: {entity_dir} is already reduced ({full_store.reduction}); rebuild it without --reduce-dim first.")
+        return None
+    questions = [(item['natural_language_question'], extract_and_categorize_ground_truth(item['sparql_query'], uri_to_type_map).get('entity'))
+                 for item in validation_set]
+    query_embeddings = embed_questions([nlq for nlq, _ in questions])
+
+    def run(store):
+        ranked, latencies = [], []
+        for embedding in query_embeddings:
+            start = time.perf_counter()
+            result = store.query(VectorStoreQuery(query_embedding=embedding.tolist(), similarity_top_k=k))
+            latencies.append((time.perf_counter() - start) * 1000)
+            ranked.append([node.metadata.get('uri') for node in result.nodes])
+        return ranked, sum(latencies) / max(len(latencies), 1)
+
+    summary = {"k": k, "method": method, "dims": []}
+    full_ranked = None
+    for dim in [None] + sorted(dims, reverse=True):
+        store = full_store if dim is None else full_store.reduced_copy(method, dim)
+        ranked, latency = run(store)
+        full_ranked = full_ranked or ranked
+        gt_recalls = [calculate_all_metrics_at_k(r, gt, k)['recall'] for r, (_, gt) in zip(ranked, questions) if gt]
+        overlaps = [len(set(full) & set(r)) / max(len(full), 1) for full, r in zip(full_ranked, ranked)]
+        rows, dim = store.embedding_shape()
+        row = {
+            "dim": int(dim), "mean_latency_ms": latency, "matrix_mb": rows * dim * 4 / 2**20,
+            "recall_at_k": sum(gt_recalls) / len(gt_recalls) if gt_recalls else 0.0,
+            "overlap_with_full": sum(overlaps) / len(overlaps) if overlaps else 0.0,
+        }
+        summary["dims"].append(row)
+        print(f"  - dim={row['dim']}: recall@{k}={row['recall_at_k']:.3f}, overlap={row['overlap_with_full']:.3f}, "
+              f"{latency:.2f} ms/query, {row['matrix_mb']:.1f} MB")
+    return summary
+
+
+def compare_partition_routing(validation_set, uri_to_type_map, k_values, entity_index, all_docs):
+    """
+    Compares entity retrieval over the whole index with partition-restricted retrieval:
+    "routed" searches the partitions route_query picks from the question (everything when
+    no rule fires), "typed" the partitions of the ground-truth entities, i.e. what an agent
+    passing the right entity_type to search_for_entity gets. Each setting is scored on
+    recall@k and MRR, mean search latency and the mean share of entity rows scanned.
+    """
+    max_k = max(k_values)
+    store = entity_index.vector_store
+    if getattr(store, "partitions", None) is None:
+        print("Error: the entity index has no partitions; rebuild it with build_indices.py (flat store format).")
+        return None
+    sizes = {name: end - start for name, (start, end) in store.partitions.items()}
+    total_rows = store.count()
+    full = entity_index.as_retriever(similarity_top_k=max_k)
+    partition_retrievers = {}
+
+    def partition_retriever(partitions):
+        key = tuple(sorted(partitions))
+        if key not in partition_retrievers:
+            partition_retrievers[key] = entity_index.as_retriever(similarity_top_k=max_k, filters=partition_filters(key))
+        return partition_retrievers[key]
+
+    settings = ("full", "routed", "typed")
+    results = {name: {"recall": defaultdict(list), "mrr": defaultdict(list), "latency_ms": [], "rows_scanned": []} for name in settings}
+    routed_questions = 0
+    for item in tqdm(validation_set, desc="Comparing partition routing"):
+        gt_entities = extract_and_categorize_ground_truth(item['sparql_query'], uri_to_type_map).get('entity')
+        if not gt_entities:
+            continue
+        nlq = item['natural_language_question']
+        query_bundle = QueryBundle(nlq, embedding=Settings.embed_model.get_query_embedding(nlq))
+        routed = route_query(nlq)
+        routed_questions += routed is not None
+        typed = sorted({all_docs.get(uri, {}).get(PARTITION_KEY) for uri in gt_entities} - {None})
+        searches = {"full": None, "routed": routed, "typed": typed or None}
+
+        for name, partitions in searches.items():
+            retriever = full if partitions is None else partition_retriever(partitions)
+            start = time.perf_counter()
+            ranked = [node.metadata.get('uri') for node in retriever.retrieve(query_bundle)]
+            results[name]["latency_ms"].append((time.perf_counter() - start) * 1000)
+            results[name]["rows_scanned"].append(1.0 if partitions is None else sum(sizes.get(p, 0) for p in partitions) / max(total_rows, 1))
+            for k in k_values:
+                metrics = calculate_all_metrics_at_k(ranked, gt_entities, k)
+                results[name]["recall"][k].append(metrics['recall'])
+                results[name]["mrr"][k].append(metrics['mrr'])
+
+    summary = {"k_values": k_values, "partition_sizes": sizes, "routed_question_rate": 0.0, "settings": {}}
+    for name, setting_results in results.items():
+        latencies = setting_results["latency_ms"]
+        summary["settings"][name] = {
+            metric: {k: sum(scores[k]) / len(scores[k]) if scores[k] else 0.0 for k in k_values}
+            for metric, scores in setting_results.items() if metric in ("recall", "mrr")
+        }
+        summary["settings"][name]["mean_latency_ms"] = sum(latencies) / len(latencies) if latencies else 0.0
+        summary["settings"][name]["mean_rows_scanned"] = sum(setting_results["rows_scanned"]) / max(len(latencies), 1)
+        summary["settings"][name]["questions"] = len(latencies)
+    summary["routed_question_rate"] = routed_questions / max(len(results["full"]["latency_ms"]), 1)
+    return summary
+
+
+def sweep_hnsw_ef(validation_set, uri_to_type_map, ef_values, k, index_dirs=None):
+    """
+    Recall-versus-latency sweep of the HNSW graphs over the query beam width ef.
+    For each index (entity, class) the exact scan is the baseline; every ef setting is scored
+    on recall@k against the ground truth, on the overlap of its top-k with the exact top-k
+    (the ANN recall proper), and on mean query latency. Questions are embedded once up front.
+    """
+    index_dirs = index_dirs or {'entity': "./storage/entity_index", 'class': "./storage/class_index"}
+    questions = [(item['natural_language_question'], extract_and_categorize_ground_truth(item['sparql_query'], uri_to_type_map))
+                 for item in validation_set]
+    bundles = [QueryBundle(nlq, embedding=Settings.embed_model.get_query_embedding(nlq))
+               for nlq, _ in tqdm(questions, desc="Embedding questions")]
+
+    def run(retriever):
+        ranked, latencies = [], []
+        for bundle in bundles:
+            start = time.perf_counter()
+            ranked.append([node.metadata.get('uri') for node in retriever.retrieve(bundle)])
+            latencies.append((time.perf_counter() - start) * 1000)
+        return ranked, sum(latencies) / max(len(latencies), 1)
+
+    summary = {"k": k, "ef_values": ef_values, "indexes": {}}
+    for index_name, persist_dir in index_dirs.items():
+        exact_ranked, exact_latency = run(load_vector_index(persist_dir, index_type="exact").as_retriever(similarity_top_k=k))
+        rows = [{"ef": "exact", "ranked": exact_ranked, "mean_latency_ms": exact_latency}]
+        for ef in ef_values:
+            ranked, latency = run(load_vector_index(persist_dir, index_type="hnsw", ef_search=ef).as_retriever(similarity_top_k=k))
+            rows.append({"ef": ef, "ranked": ranked, "mean_latency_ms": latency})
+
+        results = []
+        for row in rows:
+            gt_recalls = [calculate_all_metrics_at_k(ranked, gt[index_name], k)['recall']
+                          for ranked, (_, gt) in zip(row["ranked"], questions) if gt.get(index_name)]
+            overlaps = [len(set(exact) & set(ranked)) / max(len(exact), 1) for exact, ranked in zip(exact_ranked, row["ranked"])]
+            results.append({
+                "ef": row["ef"], "mean_latency_ms": row["mean_latency_ms"],
+                "recall_at_k": sum(gt_recalls) / len(gt_recalls) if gt_recalls else 0.0,
+                "overlap_with_exact": sum(overlaps) / len(overlaps) if overlaps else 0.0,
+            })
+            print(f"  - {index_name} ef={row['ef']}: recall@{k}={results[-1]['recall_at_k']:.3f}, "
+                  f"overlap={results[-1]['overlap_with_exact']:.3f}, {row['mean_latency_ms']:.2f} ms/query")
+        summary["indexes"][index_name] = results
+    return summary
+
+
+def _typo(name):
+    """A deterministic one-edit typo: swaps two characters in the middle of the name."""
+    if len(name) < 4:
+        return name
+    i = len(name) // 2
+    return name[:i - 1] + name[i] + name[i - 1] + name[i + 1:]
+
+
+def evaluate_label_fast_path(validation_set, uri_to_type_map, all_docs):
+    """
+    Hit rate of the label fast path (label_lookup.py) on the benchmark. The agent's search
+    calls are not part of the benchmark, so three query sets stand in for them: the names
+    of each question's ground-truth entities/classes/properties (what the agent searches
+    for when it has read the name off the question), the same names with a one-edit typo,
+    and the raw questions. A hit is correct if it contains the ground-truth URI.
+    """
+    lookup = load_label_lookup()
+    if lookup is None:
+        print("Error: lexical index not found. Run build_indices.py first.")
+        return None
+
+    query_sets = defaultdict(list)
+    for item in validation_set:
+        categorized_gt_uris = extract_and_categorize_ground_truth(item['sparql_query'], uri_to_type_map)
+        for index_name in ['entity', 'class', 'property']:
+            for uri in categorized_gt_uris.get(index_name, ()):
+                name = all_docs[uri].get('name', '')
+                query_sets['ground_truth_names'].append((name, index_name, uri))
+                query_sets['ground_truth_names_with_typo'].append((_typo(name), index_name, uri))
+        query_sets['questions'].append((item['natural_language_question'], 'entity', None))
+
+    report = {}
+    for set_name, queries in query_sets.items():
+        counts = defaultdict(int)
+        start = time.perf_counter()
+        for query, kind, uri in queries:
+            result = lookup.lookup(query, kind)
+            if result is None:
+                counts['miss'] += 1
+                continue
+            entries, match_type = result
+            counts[match_type] += 1
+            if uri is not None and uri in {e['uri'] for e in entries}:
+                counts['correct'] += 1
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        hits = counts['exact'] + counts['fuzzy']
+        report[set_name] = {
+            "queries": len(queries), "exact": counts['exact'], "fuzzy": counts['fuzzy'], "miss": counts['miss'],
+            "hit_rate": hits / len(queries) if queries else 0.0,
+            "hit_precision": counts['correct'] / hits if hits and set_name != 'questions' else None,
+            "mean_lookup_ms": elapsed_ms / len(queries) if queries else 0.0,
+        }
+        print(f"  - {set_name}: hit rate {report[set_name]['hit_rate']:.1%} "
+              f"({counts['exact']} exact, {counts['fuzzy']} fuzzy of {len(queries)})")
+    return report
+
 
 def main():
     print("=== Starting Retrieval Evaluation Script ===")
     parser = argparse.ArgumentParser(description="Evaluate retrieval performance across different k values.")
     parser.add_argument("--validation-file", default="../WitcherBenchmark/test_set.json", help="The validation set to evaluate against.")
+    parser.add_argument("--compare-quantization", action="store_true", help="Compare exact entity retrieval with the int8/binary first-pass modes instead of running the k-sweep.")
+    parser.add_argument("--k-values", type=int, nargs="+", default=None, help="k values to evaluate (default: 10 for the sweep, 5 10 20 for --compare-quantization, --cascade and --partition-routing). Retrieval runs once at the largest k.")
+    parser.add_argument("--label-fast-path", action="store_true", help="Report the hit rate of the exact/fuzzy label fast path instead of running the k-sweep.")
+    parser.add_argument("--hnsw-sweep", action="store_true", help="Sweep the HNSW query beam width ef (indexes built with --index-type hnsw) instead of running the k-sweep.")
+    parser.add_argument("--ef-values", type=int, nargs="+", default=[10, 20, 40, 80, 160, 320], help="ef values for --hnsw-sweep.")
+    parser.add_argument("--dimension-sweep", action="store_true", help="Recall and latency of the entity index reduced to each of --dims dimensions instead of running the k-sweep.")
+    parser.add_argument("--dims", type=int, nargs="+", default=[128, 256, 512], help="Dimensionalities for --dimension-sweep.")
+    parser.add_argument("--reduction", choices=REDUCTION_METHODS[1:], default="pca", help="Reduction method for --dimension-sweep.")
+    parser.add_argument("--partition-routing", action="store_true", help="Compare entity retrieval over the whole index with router- and type-restricted partition searches instead of running the k-sweep.")
+    parser.add_argument("--cascade", action="store_true", help="Compare the two-stage cascade (build_indices.py --cascade-model) with single-stage entity retrieval instead of running the k-sweep.")
+    parser.add_argument("--shortlist-size", type=int, default=SHORTLIST_SIZE, help="Small-model shortlist rescored by the large model for --cascade.")
+    parser.add_argument("--cascade-margins", type=float, nargs="*", default=[0.02, 0.05, 0.1], help="Decisive top-1/top-2 margins (large model skipped) also evaluated with --cascade.")
     args = parser.parse_args()
 
     # --- 1. Setup LlamaIndex & Load Indexes ---
     print("--- Setting up LlamaIndex embedding model ---")
-    Settings.embed_model = HuggingFaceEmbedding(model_name="BAAI/bge-large-en-v1.5")
+    Settings.embed_model = with_embedding_cache(load_embed_model("BAAI/bge-large-en-v1.5"))
     Settings.llm = None
     print("--- Loading indexes from storage ---")
     try:
-        entity_index = load_index_from_storage(StorageContext.from_defaults(persist_dir="./storage/entity_index"))
-        class_index = load_index_from_storage(StorageContext.from_defaults(persist_dir="./storage/class_index"))
-        prop_index = load_index_from_storage(StorageContext.from_defaults(persist_dir="./storage/prop_index"))
+        entity_index = load_vector_index("./storage/entity_index")
+        class_index = load_vector_index("./storage/class_index")
+        prop_index = load_vector_index("./storage/prop_index")
     except FileNotFoundError:
         print("Error: Could not load indexes. Please run 'build_indexes.py' first.")
         return
@@ -93,51 +434,101 @@ def main():
     print("--- Building URI-to-Type lookup map ---")
     uri_to_type_map = {}
     all_docs = {}
-    for doc in entity_index.docstore.docs.values():
-        uri_to_type_map[doc.metadata['uri']] = 'entity'
-        all_docs[doc.metadata['uri']] = doc
-    for doc in class_index.docstore.docs.values():
-        uri_to_type_map[doc.metadata['uri']] = 'class'
-        all_docs[doc.metadata['uri']] = doc
-    for doc in prop_index.docstore.docs.values():
-        uri_to_type_map[doc.metadata['uri']] = 'property'
-        all_docs[doc.metadata['uri']] = doc
+    for index, uri_type in ((entity_index, 'entity'), (class_index, 'class'), (prop_index, 'property')):
+        for metadata in iter_index_metadata(index):
+            uri_to_type_map[metadata['uri']] = uri_type
+            all_docs[metadata['uri']] = metadata
     print(f"Lookup map created with {len(uri_to_type_map)} entries.")
 
     # --- 3. Load Validation Set ---
     print(f"--- Loading validation set from '{args.validation_file}' ---")
     with open(args.validation_file, 'r') as f:
         validation_set = json.load(f)
+
+    if args.compare_quantization:
+        print("--- Comparing entity index quantization modes ---")
+        comparison = compare_quantized_entity_retrieval(validation_set, uri_to_type_map, args.k_values or [5, 10, 20])
+        print(json.dumps(comparison, indent=2))
+        with open("retrieval_quantization_comparison.json", 'w') as f:
+            json.dump(comparison, f, indent=2)
+        print("\nQuantization comparison saved to retrieval_quantization_comparison.json")
+        return
+
+    if args.label_fast_path:
+        print("--- Evaluating the label fast path ---")
+        report = evaluate_label_fast_path(validation_set, uri_to_type_map, all_docs)
+        if report is not None:
+            with open("label_fast_path_report.json", 'w') as f:
+                json.dump(report, f, indent=2)
+            print("\nLabel fast path report saved to label_fast_path_report.json")
+        return
+
+    if args.cascade:
+        print("--- Comparing cascade and single-stage entity retrieval ---")
+        try:
+            comparison = compare_cascade_retrieval(validation_set, uri_to_type_map, args.k_values or [5, 10, 20], entity_index,
+                                                   args.shortlist_size, args.cascade_margins)
+        except FileNotFoundError as e:
+            print(f"Error: {e}")
+            return
+        print(json.dumps(comparison, indent=2))
+        with open("retrieval_cascade_comparison.json", 'w') as f:
+            json.dump(comparison, f, indent=2)
+        print("\nCascade comparison saved to retrieval_cascade_comparison.json")
+        return
+
+    if args.partition_routing:
+        print("--- Comparing full and partition-restricted entity retrieval ---")
+        comparison = compare_partition_routing(validation_set, uri_to_type_map, args.k_values or [5, 10, 20], entity_index, all_docs)
+        if comparison is not None:
+            print(json.dumps(comparison, indent=2))
+            with open("retrieval_partition_comparison.json", 'w') as f:
+                json.dump(comparison, f, indent=2)
+            print("\nPartition routing comparison saved to retrieval_partition_comparison.json")
+        return
+
+    if args.dimension_sweep:
+        print(f"--- Sweeping entity index dimensionality ({args.reduction}) ---")
+        sweep = sweep_dimensions(validation_set, uri_to_type_map, args.dims, k=10, method=args.reduction)
+        if sweep is not None:
+            with open("retrieval_dimension_sweep.json", 'w') as f:
+                json.dump(sweep, f, indent=2)
+            print("\nDimension sweep saved to retrieval_dimension_sweep.json")
+        return
+
+    if args.hnsw_sweep:
+        print("--- Sweeping HNSW ef ---")
+        sweep = sweep_hnsw_ef(validation_set, uri_to_type_map, args.ef_values, k=10)
+        with open("retrieval_hnsw_ef_sweep.json", 'w') as f:
+            json.dump(sweep, f, indent=2)
+        print("\nHNSW ef sweep saved to retrieval_hnsw_ef_sweep.json")
+        return
     
     # --- 4. K-Sweep Evaluation Loop ---
-    k_values_to_test = [10]
+    k_values_to_test = args.k_values or [10]
     sweep_results = {"k_values": k_values_to_test, "metrics": defaultdict(lambda: defaultdict(list))}
 
+    # Metrics at a smaller k only look at a prefix of the ranking, so every question is
+    # retrieved once at max(k) and all k values are scored from the cached rankings.
+    # All questions are embedded in batches and ranked against each index with blocked
+    # matrix products (see batch_retrieval.py).
+    max_k = max(k_values_to_test)
+    print(f"\n--- Retrieving once at k={max_k} for k values {k_values_to_test} ---")
+    # We still retrieve for all, as a router would not have this ground truth
+    batch_rankings = batch_retrieve({'entity': entity_index, 'class': class_index, 'property': prop_index},
+                                    [item['natural_language_question'] for item in validation_set], max_k)
+    rankings = []
+    for i, item in enumerate(validation_set):
+        retrieved_uris = {index_name: [metadata.get('uri') for metadata in batch_rankings[index_name][i]]
+                          for index_name in batch_rankings}
+        categorized_gt_uris = extract_and_categorize_ground_truth(item['sparql_query'], uri_to_type_map)
+        rankings.append((retrieved_uris, categorized_gt_uris))
+
     for k in k_values_to_test:
-        print(f"\n--- Running evaluation for k={k} ---")
-        
-        entity_retriever = entity_index.as_retriever(similarity_top_k=k)
-        class_retriever = class_index.as_retriever(similarity_top_k=k)
-        prop_retriever = prop_index.as_retriever(similarity_top_k=k)
-        
         # This dict will hold scores ONLY from relevant queries
         current_k_metrics = defaultdict(lambda: defaultdict(list))
-        
-        for item in tqdm(validation_set, desc=f"Evaluating @k={k}"):
-            nlq = item['natural_language_question']
-            sparql = item['sparql_query']
-            
-            categorized_gt_uris = extract_and_categorize_ground_truth(sparql, uri_to_type_map)
-            
-            # We still retrieve for all, as a router would not have this ground truth
-            entity_results = [node.metadata.get('uri') for node in entity_retriever.retrieve(nlq)]
-            class_results = [node.metadata.get('uri') for node in class_retriever.retrieve(nlq)]
-            prop_results = [node.metadata.get('uri') for node in prop_retriever.retrieve(nlq)]
-
-            retrieved_uris = {
-                'entity': entity_results, 'class': class_results, 'property': prop_results
-            }
 
+        for retrieved_uris, categorized_gt_uris in rankings:
             # We only calculate and append metrics for an index if the query was relevant to it.
             for index_name in ['entity', 'class', 'property']:
                 gt_for_index = categorized_gt_uris.get(index_name)
@@ -153,7 +544,7 @@ def main():
         for index_name in ['entity', 'class', 'property']:
             # Handle the case where an index had ZERO relevant queries in the entire set
             if not current_k_metrics[index_name]:
-                print(f"  - No relevant queries found for {index_name.capitalize()} Index in this run.")
+                print(f"  - No relevant queries found for {index_name.capitalize()} Index at k={k}.")
                 for metric in ['precision', 'recall', 'f1', 'mrr']:
                      sweep_results["metrics"][index_name][metric].append(0.0)
                 continue
@@ -1,13 +1,43 @@
 # prepare_data_enriched.py
 import json
-from SPARQLWrapper import SPARQLWrapper, JSON
+import os
+import sys
 from llama_index.core import Document
 from collections import defaultdict
 from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Modules used by both IndexCreation and RAGPipelines live in ../Shared
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Shared"))
+from query_log import execute_logged_query
 
 # --- 1. CONFIGURATION ---
 SPARQL_ENDPOINT_URL = "http://localhost:7200/repositories/da4dte_final"
 USER_AGENT = "RAG-Data-Prep/1.0"
+# Entities per VALUES block in the hydration queries (1 = the original one-query-per-entity loop)
+HYDRATION_BATCH_SIZE = 200
+# Hydration batches in flight at once
+HYDRATION_WORKERS = 4
+
+# Graph pattern shared by the single-entity and batched hydration queries (?s is bound by the caller)
+HYDRATION_PATTERN = """
+            OPTIONAL { ?s rdfs:label ?label . }
+            OPTIONAL { ?s witcher:aka ?aka . }
+            
+            # Get all properties and their values' labels to create descriptive text
+            OPTIONAL {
+                ?s ?prop_uri ?value_uri .
+                ?prop_uri rdfs:label ?prop_label .
+                OPTIONAL { ?value_uri rdfs:label ?value_label . }
+                # Create a single string like "Profession: Armorer"
+                BIND(CONCAT(STR(?prop_label), ": ", COALESCE(?value_label, "")) AS ?prop_info)
+                FILTER(STRSTARTS(STR(?prop_uri), STR(witcher:)))
+            }
+            
+            # This part is required to get the types
+            ?s a ?type_uri .
+            OPTIONAL { ?type_uri rdfs:label ?typeLabel . }
+"""
 
 # --- 2. THE DEFINITIVE NAMESPACES STRING ---
 namespaces = """
@@ -20,12 +50,8 @@ namespaces = """
 # --- 3. HELPER FUNCTIONS ---
 def execute_sparql_query(query):
     """Executes a SPARQL query and returns the results."""
-    sparql = SPARQLWrapper(SPARQL_ENDPOINT_URL)
-    sparql.setQuery(namespaces + query)
-    sparql.setReturnFormat(JSON)
-    sparql.agent = USER_AGENT
     try:
-        return sparql.query().convert()["results"]["bindings"]
+        return execute_logged_query(SPARQL_ENDPOINT_URL, namespaces + query, caller="data_prep", agent=USER_AGENT)["results"]["bindings"]
     except Exception as e:
         print(f"\nSPARQL query failed. Error: {e}")
         return None
@@ -38,10 +64,152 @@ def get_name(uri, label_cache):
         return uri.split('/')[-1].replace('_', ' ')
     return ""
 
-def extract_and_format_enriched_data():
+def extract_term_dictionary():
+    """
+    Returns every URI in the witcher ontology/resource namespaces that occurs anywhere in the KG
+    (subject, predicate or object position). Persisted next to the indexes, it lets the
+    pipelines reject queries that reference non-existent URIs without asking the endpoint.
+    """
+    print("Extracting term dictionary...")
+    term_query = """
+    SELECT DISTINCT ?term WHERE {
+        { ?term ?p ?o . } UNION { ?s ?term ?o . } UNION { ?s ?p ?term . }
+        FILTER(isIRI(?term) && STRSTARTS(STR(?term), "http://cgi.di.uoa.gr/witcher/"))
+    }
+    """
+    term_results = execute_sparql_query(term_query)
+    terms = sorted({res['term']['value'] for res in term_results}) if term_results else []
+    print(f"  - Found {len(terms)} distinct URIs.")
+    return terms
+
+def extract_name_index_entries():
+    """
+    Returns one entry per class and property with its URI, label and whether it is used
+    (a class with instances / a property with triples). Persisted as the keyword name index,
+    it answers the agent's `FILTER(CONTAINS(LCASE(STR(?class)), ...))` lookups locally.
+    """
+    print("Extracting class and property names...")
+    label_query = "SELECT ?s ?label WHERE { ?s rdfs:label ?label . }"
+    label_results = execute_sparql_query(label_query)
+    label_cache = {res['s']['value']: res['label']['value'] for res in label_results} if label_results else {}
+
+    entries = {}
+    declared_class_results = execute_sparql_query("SELECT DISTINCT ?c WHERE { ?c a owl:Class . }") or []
+    used_class_results = execute_sparql_query("SELECT DISTINCT ?c WHERE { ?s a ?c . }") or []
+    for results, used in ((declared_class_results, False), (used_class_results, True)):
+        for res in results:
+            uri = res['c']['value']
+            entry = entries.setdefault(("class", uri), {"uri": uri, "kind": "class", "label": label_cache.get(uri, ""), "used": False})
+            entry["used"] = entry["used"] or used
+
+    prop_results = execute_sparql_query("SELECT DISTINCT ?p WHERE { ?s ?p ?o }") or []
+    for res in prop_results:
+        uri = res['p']['value']
+        entries[("property", uri)] = {"uri": uri, "kind": "property", "label": label_cache.get(uri, ""), "used": True}
+
+    print(f"  - Found {sum(1 for kind, _ in entries if kind == 'class')} classes and {len(prop_results)} properties.")
+    return sorted(entries.values(), key=lambda e: (e["kind"], e["uri"]))
+
+def entity_hydration_query(uri):
+    """The original per-entity hydration query."""
+    # This powerful query fetches the entity's own details, its types, and its properties.
+    return f"""
+        SELECT ?label (GROUP_CONCAT(DISTINCT ?aka; SEPARATOR=", ") AS ?aliases) 
+                       (GROUP_CONCAT(DISTINCT ?typeLabel; SEPARATOR=", ") AS ?types)
+                       (GROUP_CONCAT(DISTINCT ?prop_info; SEPARATOR=" | ") AS ?properties)
+        WHERE {{
+            BIND(<{uri}> AS ?s)
+            {HYDRATION_PATTERN}
+        }}
+        GROUP BY ?label
+        LIMIT 1
+        """
+
+def batched_hydration_query(uris):
+    """
+    The same hydration for many entities at once. Grouping by ?s ?label yields, per entity,
+    one row per label, each aggregating the same aliases/types/properties as the single query.
+    """
+    values = " ".join(f"<{uri}>" for uri in uris)
+    return f"""
+        SELECT ?s ?label (GROUP_CONCAT(DISTINCT ?aka; SEPARATOR=", ") AS ?aliases) 
+                       (GROUP_CONCAT(DISTINCT ?typeLabel; SEPARATOR=", ") AS ?types)
+                       (GROUP_CONCAT(DISTINCT ?prop_info; SEPARATOR=" | ") AS ?properties)
+        WHERE {{
+            VALUES ?s {{ {values} }}
+            {HYDRATION_PATTERN}
+        }}
+        GROUP BY ?s ?label
+        """
+
+def format_entity_document(uri, res, label_cache):
+    """Builds the entity Document from one hydration result row."""
+    name = get_name(uri, label_cache)
+    
+    # --- Document Construction ---
+    text_lines = [f"This document is about the entity named {name}."]
+    
+    if res.get('aliases') and res['aliases']['value']:
+        text_lines.append(f"It is also known as: {res['aliases']['value']}.")
+    
+    if res.get('types') and res['types']['value']:
+        # Make the relationship explicit for the embedding model
+        text_lines.append(f"It is a type of: {res['types']['value']}.")
+    
+    if res.get('properties') and res['properties']['value']:
+        # Add all the "Property: Value" pairs
+        prop_list = [p.strip() for p in res['properties']['value'].split('|')]
+        text_lines.append("Its known properties and relationships include:")
+        for prop_str in prop_list:
+            # Add a simple check to avoid empty property strings
+            if ":" in prop_str and not prop_str.endswith(":"):
+                text_lines.append(f"- {prop_str}")
+    
+    text_content = "\n".join(text_lines)
+    return Document(
+        text=text_content, 
+        metadata={"uri": uri, "name": name, "type": "Entity"}
+    )
+
+def hydrate_entities_one_by_one(entity_uris, label_cache):
+    """Yields (uri, Document) pairs, one SPARQL query per entity."""
+    for uri in tqdm(entity_uris, desc="Hydrating Entities"):
+        entity_details = execute_sparql_query(entity_hydration_query(uri))
+        if not entity_details:
+            continue
+        yield uri, format_entity_document(uri, entity_details[0], label_cache)
+
+def hydrate_entities_batched(entity_uris, label_cache, batch_size=HYDRATION_BATCH_SIZE, max_workers=HYDRATION_WORKERS):
+    """
+    Yields (uri, Document) pairs as soon as each VALUES batch completes, with up to
+    max_workers batches in flight. A failed batch falls back to per-entity queries.
+    """
+    batches = [entity_uris[i:i + batch_size] for i in range(0, len(entity_uris), batch_size)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor, tqdm(total=len(entity_uris), desc="Hydrating Entities") as progress:
+        futures = {executor.submit(execute_sparql_query, batched_hydration_query(batch)): batch for batch in batches}
+        for future in as_completed(futures):
+            batch = futures[future]
+            rows = future.result()
+            if rows is None:
+                for uri in batch:
+                    entity_details = execute_sparql_query(entity_hydration_query(uri))
+                    if entity_details:
+                        yield uri, format_entity_document(uri, entity_details[0], label_cache)
+            else:
+                # Keep the first row per entity, as LIMIT 1 does in the single-entity query
+                first_rows = {}
+                for res in rows:
+                    first_rows.setdefault(res['s']['value'], res)
+                for uri in batch:
+                    if uri in first_rows:
+                        yield uri, format_entity_document(uri, first_rows[uri], label_cache)
+            progress.update(len(batch))
+
+def extract_and_format_enriched_data(batch_size=HYDRATION_BATCH_SIZE, max_workers=HYDRATION_WORKERS):
     """
     Queries GraphDB to get a rich, "de-siloed" description for each entity
     and formats the data for LlamaIndex.
+    Entities are hydrated in VALUES batches of `batch_size`; batch_size <= 1 uses one query per entity.
     """
     
     # Step 1: Build a label cache for efficiency
@@ -65,67 +233,12 @@ def extract_and_format_enriched_data():
     print(f"  - Found {len(entity_uris)} total entity URIs.")
 
     print("  - Step 2b: Hydrating each entity with de-siloed properties...")
-    for uri in tqdm(entity_uris, desc="Hydrating Entities"):
-        # This powerful query fetches the entity's own details, its types, and its properties.
-        hydration_query = f"""
-        SELECT ?label (GROUP_CONCAT(DISTINCT ?aka; SEPARATOR=", ") AS ?aliases) 
-                       (GROUP_CONCAT(DISTINCT ?typeLabel; SEPARATOR=", ") AS ?types)
-                       (GROUP_CONCAT(DISTINCT ?prop_info; SEPARATOR=" | ") AS ?properties)
-        WHERE {{
-            BIND(<{uri}> AS ?s)
-            
-            OPTIONAL {{ ?s rdfs:label ?label . }}
-            OPTIONAL {{ ?s witcher:aka ?aka . }}
-            
-            # Get all properties and their values' labels to create descriptive text
-            OPTIONAL {{
-                ?s ?prop_uri ?value_uri .
-                ?prop_uri rdfs:label ?prop_label .
-                OPTIONAL {{ ?value_uri rdfs:label ?value_label . }}
-                # Create a single string like "Profession: Armorer"
-                BIND(CONCAT(STR(?prop_label), ": ", COALESCE(?value_label, "")) AS ?prop_info)
-                FILTER(STRSTARTS(STR(?prop_uri), STR(witcher:)))
-            }}
-            
-            # This part is required to get the types
-            ?s a ?type_uri .
-            OPTIONAL {{ ?type_uri rdfs:label ?typeLabel . }}
-        }}
-        GROUP BY ?label
-        LIMIT 1
-        """
-        
-        entity_details = execute_sparql_query(hydration_query)
-        if not entity_details:
-            continue
-        
-        res = entity_details[0]
-        name = get_name(uri, label_cache)
-        
-        # --- Document Construction ---
-        text_lines = [f"This document is about the entity named {name}."]
-        
-        if res.get('aliases') and res['aliases']['value']:
-            text_lines.append(f"It is also known as: {res['aliases']['value']}.")
-        
-        if res.get('types') and res['types']['value']:
-            # Make the relationship explicit for the embedding model
-            text_lines.append(f"It is a type of: {res['types']['value']}.")
-        
-        if res.get('properties') and res['properties']['value']:
-            # Add all the "Property: Value" pairs
-            prop_list = [p.strip() for p in res['properties']['value'].split('|')]
-            text_lines.append("Its known properties and relationships include:")
-            for prop_str in prop_list:
-                # Add a simple check to avoid empty property strings
-                if ":" in prop_str and not prop_str.endswith(":"):
-                    text_lines.append(f"- {prop_str}")
-        
-        text_content = "\n".join(text_lines)
-        entity_docs.append(Document(
-            text=text_content, 
-            metadata={"uri": uri, "name": name, "type": "Entity"}
-        ))
+    if batch_size <= 1:
+        entity_docs = [doc for _, doc in hydrate_entities_one_by_one(entity_uris, label_cache)]
+    else:
+        # Batches finish out of order; restore the URI order so the index is built identically
+        docs_by_uri = dict(hydrate_entities_batched(entity_uris, label_cache, batch_size, max_workers))
+        entity_docs = [docs_by_uri[uri] for uri in entity_uris if uri in docs_by_uri]
 
     # --- Step 3: Extract CLASS Data ---
     print("Extracting class data...")
@@ -153,6 +266,34 @@ def extract_and_format_enriched_data():
     print(f"Successfully extracted and hydrated {len(entity_docs)} entities, {len(class_docs)} classes, and {len(prop_docs)} properties.")
     return entity_docs, class_docs, prop_docs
 
+def verify_batched_hydration(sample_size=500, batch_size=HYDRATION_BATCH_SIZE):
+    """
+    Hydrates the first `sample_size` entities with both query shapes and reports any
+    document whose text differs. GROUP_CONCAT order is chosen by the engine, so this is
+    the check that batching did not change what gets embedded.
+    """
+    label_results = execute_sparql_query("SELECT ?s ?label WHERE { ?s rdfs:label ?label . }")
+    label_cache = {res['s']['value']: res['label']['value'] for res in label_results} if label_results else {}
+    uri_results = execute_sparql_query("SELECT DISTINCT ?s WHERE { ?s a ?type . FILTER(STRSTARTS(STR(?s), STR(dbr:))) }") or []
+    sample = [res['s']['value'] for res in uri_results[:sample_size]]
+
+    single = {uri: doc.text for uri, doc in hydrate_entities_one_by_one(sample, label_cache)}
+    batched = {uri: doc.text for uri, doc in hydrate_entities_batched(sample, label_cache, batch_size)}
+    mismatches = [uri for uri in sample if single.get(uri) != batched.get(uri)]
+    print(f"{len(sample) - len(mismatches)}/{len(sample)} entity documents are identical in both modes.")
+    for uri in mismatches[:10]:
+        print(f"  - {uri}")
+    return not mismatches
+
 if __name__ == "__main__":
-    extract_and_format_enriched_data()
-    print("Enriched data preparation complete.")
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description="Prepare the enriched documents for the vector indexes.")
+    parser.add_argument("--batch-size", type=int, default=HYDRATION_BATCH_SIZE, help="Entities per hydration query (1 = one query per entity).")
+    parser.add_argument("--verify-batched", type=int, metavar="N", help="Only compare single vs. batched hydration on the first N entities.")
+    args = parser.parse_args()
+
+    if args.verify_batched:
+        verify_batched_hydration(args.verify_batched, max(2, args.batch_size))
+    else:
+        extract_and_format_enriched_data(batch_size=args.batch_size)
+        print("Enriched data preparation complete.")
\ No newline at end of file
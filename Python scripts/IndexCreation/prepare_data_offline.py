@@ -0,0 +1,198 @@
+# prepare_data_offline.py
+import os
+import time
+from collections import defaultdict
+from rdflib import Graph, URIRef, RDF, RDFS, OWL
+from rdflib.store import Store
+from llama_index.core import Document
+
+# Document formatting is shared with the SPARQL-based preparation, so both paths emit the same text
+from prepare_data import get_name, format_entity_document
+
+# --- 1. CONFIGURATION ---
+# The outputs of the KG build (see Phase 1) in <repo>/RDF, where the KG scripts write them.
+# Add os.path.join(RDF_DIR, "SpatialRelations.n3") if it is loaded into the GraphDB repository as well.
+RDF_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "RDF")
+OFFLINE_KG_PATHS = [os.path.join(RDF_DIR, "Witcher3KG.n3"), os.path.join(RDF_DIR, "Classes.ttl")]
+
+WITCHER_NS = "http://cgi.di.uoa.gr/witcher/ontology#"
+DBR_NS = "http://cgi.di.uoa.gr/witcher/resource/"
+TERM_PREFIX = "http://cgi.di.uoa.gr/witcher/"
+WITCHER_AKA = URIRef(WITCHER_NS + "aka")
+
+
+# --- 2. STREAMING PARSE ---
+class _CallbackStore(Store):
+    """
+    An rdflib store that keeps nothing: every parsed triple is handed to a callback.
+    The N3/Turtle parsers write straight into the store, so the files are read in a
+    single streaming pass without ever materializing an rdflib Graph.
+    """
+    context_aware = True
+    formula_aware = True
+    graph_aware = True
+
+    def __init__(self, on_triple):
+        super().__init__()
+        self.on_triple = on_triple
+
+    def add(self, triple, context, quoted=False):
+        if not quoted:
+            self.on_triple(*triple)
+
+    def addN(self, quads):
+        for s, p, o, _ in quads:
+            self.on_triple(s, p, o)
+
+    def add_graph(self, graph):
+        pass
+
+
+def _ordered_add(table, key, value):
+    """Appends to an insertion-ordered set stored as dict keys (duplicates across files collapse)."""
+    table[key][value] = None
+
+
+class KGTables:
+    """Hash maps filled during the streaming pass; they answer everything the SPARQL queries asked."""
+
+    def __init__(self):
+        self.labels = defaultdict(dict)          # subject -> {label: None}
+        self.akas = defaultdict(dict)            # subject -> {alias: None}
+        self.types = defaultdict(dict)           # subject -> {type: None}
+        self.edges = defaultdict(dict)           # dbr: subject -> {(witcher: predicate, object): None}
+        self.parents = defaultdict(dict)         # class -> {superclass: None}
+        self.owl_classes = {}                    # subjects typed owl:Class
+        self.predicates = {}                     # every predicate
+        self.terms = set()                       # every witcher/ IRI in any position
+        self.entity_uris = {}                    # dbr: subjects with an rdf:type
+
+    def add(self, s, p, o):
+        self.predicates[p] = None
+        for term in (s, p, o):
+            if isinstance(term, URIRef) and term.startswith(TERM_PREFIX):
+                self.terms.add(str(term))
+
+        if p == RDFS.label:
+            _ordered_add(self.labels, s, str(o))
+        elif p == RDF.type:
+            _ordered_add(self.types, s, o)
+            if isinstance(s, URIRef) and s.startswith(DBR_NS):
+                self.entity_uris[str(s)] = None
+            if o == OWL.Class:
+                self.owl_classes[s] = None
+        elif p == RDFS.subClassOf:
+            _ordered_add(self.parents, s, o)
+        if p == WITCHER_AKA:
+            _ordered_add(self.akas, s, str(o))
+        # Only the witcher: properties of dbr: subjects are ever turned into text
+        if isinstance(s, URIRef) and s.startswith(DBR_NS) and p.startswith(WITCHER_NS):
+            self.edges[s][(p, o)] = None
+
+    def label_cache(self):
+        """uri -> label, like prepare_data's label cache (the last label read wins)."""
+        return {str(s): list(labels)[-1] for s, labels in self.labels.items() if isinstance(s, URIRef)}
+
+
+_tables_cache = {}
+
+def load_kg_tables(paths=OFFLINE_KG_PATHS):
+    """Parses the KG files once, in a single streaming pass, and returns the filled KGTables."""
+    key = tuple(paths)
+    if key not in _tables_cache:
+        tables = KGTables()
+        start = time.time()
+        for path in paths:
+            print(f"Streaming triples from {path}...")
+            fmt = 'turtle' if path.endswith('.ttl') else 'n3'
+            Graph(store=_CallbackStore(tables.add)).parse(path, format=fmt)
+        print(f"  - Read {len(tables.predicates)} predicates, {len(tables.entity_uris)} entities and {len(tables.owl_classes)} classes in {time.time() - start:.1f}s.")
+        _tables_cache[key] = tables
+    return _tables_cache[key]
+
+
+# --- 3. DOCUMENT EXTRACTION ---
+def _hydrate_entity(tables, uri):
+    """
+    The in-memory equivalent of the hydration query in prepare_data.py: the GROUP_CONCATs of
+    aliases, type labels and "Property: Value" strings, returned in the SPARQL JSON row shape.
+    """
+    s = URIRef(uri)
+    type_labels = {}
+    for type_uri in tables.types.get(s, {}):
+        for label in tables.labels.get(type_uri, {}):
+            type_labels[label] = None
+
+    prop_infos = {}
+    for prop_uri, value in tables.edges.get(s, {}):
+        for prop_label in tables.labels.get(prop_uri, {}):
+            # OPTIONAL value label, COALESCEd to "" when the value has none (e.g. a literal)
+            for value_label in (tables.labels.get(value) or {"": None}):
+                prop_infos[f"{prop_label}: {value_label}"] = None
+
+    return {
+        "aliases": {"value": ", ".join(tables.akas.get(s, {}))},
+        "types": {"value": ", ".join(type_labels)},
+        "properties": {"value": " | ".join(prop_infos)},
+    }
+
+
+def extract_and_format_enriched_data_offline(paths=OFFLINE_KG_PATHS):
+    """
+    Builds the same entity/class/property Documents as prepare_data.extract_and_format_enriched_data,
+    reading the KG files instead of querying GraphDB. GraphDB inference is not reproduced:
+    the result matches a repository loaded with these files and no reasoning ruleset.
+    """
+    tables = load_kg_tables(paths)
+    label_cache = tables.label_cache()
+
+    print("Extracting enriched entity data (offline)...")
+    entity_docs = [format_entity_document(uri, _hydrate_entity(tables, uri), label_cache) for uri in tables.entity_uris]
+
+    print("Extracting class data (offline)...")
+    class_docs = []
+    for s in tables.owl_classes:
+        if not (isinstance(s, URIRef) and s.startswith(WITCHER_NS)):
+            continue
+        name = get_name(str(s), label_cache)
+        # One document per superclass, as the OPTIONAL rdfs:subClassOf join returns one row each
+        for parent_uri in (tables.parents.get(s) or {None: None}):
+            parent = get_name(str(parent_uri), label_cache) if parent_uri is not None else "Thing"
+            text_content = f"Class: {name}.\nParent Class: {parent}."
+            class_docs.append(Document(text=text_content, metadata={"uri": str(s), "name": name, "type": "Class"}))
+
+    print("Extracting property data (offline)...")
+    prop_docs = []
+    for p in tables.predicates:
+        name = get_name(str(p), label_cache)
+        text_content = f"Property: {name}."
+        prop_docs.append(Document(text=text_content, metadata={"uri": str(p), "name": name, "type": "Property"}))
+
+    print(f"Successfully extracted and hydrated {len(entity_docs)} entities, {len(class_docs)} classes, and {len(prop_docs)} properties.")
+    return entity_docs, class_docs, prop_docs
+
+
+def extract_term_dictionary_offline(paths=OFFLINE_KG_PATHS):
+    """Offline counterpart of prepare_data.extract_term_dictionary."""
+    terms = sorted(load_kg_tables(paths).terms)
+    print(f"  - Found {len(terms)} distinct URIs.")
+    return terms
+
+
+def extract_name_index_entries_offline(paths=OFFLINE_KG_PATHS):
+    """Offline counterpart of prepare_data.extract_name_index_entries."""
+    tables = load_kg_tables(paths)
+    label_cache = tables.label_cache()
+
+    entries = {}
+    used_classes = {o for types in tables.types.values() for o in types}
+    for uri in [c for c in list(tables.owl_classes) + list(used_classes) if isinstance(c, URIRef)]:
+        entries[("class", str(uri))] = {"uri": str(uri), "kind": "class", "label": label_cache.get(str(uri), ""), "used": uri in used_classes}
+    for p in tables.predicates:
+        entries[("property", str(p))] = {"uri": str(p), "kind": "property", "label": label_cache.get(str(p), ""), "used": True}
+    return sorted(entries.values(), key=lambda e: (e["kind"], e["uri"]))
+
+
+if __name__ == "__main__":
+    extract_and_format_enriched_data_offline()
+    print("Offline data preparation complete.")
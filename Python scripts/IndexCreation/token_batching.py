@@ -0,0 +1,156 @@
+# token_batching.py
+import os
+import time
+import numpy as np
+from tqdm import tqdm
+from llama_index.core.schema import MetadataMode
+
+from embedding_backend import load_tokenizer, text_instruction, embed_token_ids, EMBEDDING_BACKEND, MAX_SEQUENCE_LENGTH
+
+# --- 1. CONFIGURATION ---
+# Padded tokens (texts x longest input) per forward pass; 0 = fixed item-count batches as before
+TOKEN_BUDGET = int(os.environ.get("EMBED_TOKEN_BUDGET", "16384"))
+# Upper bound on texts per batch, for long runs of one-line documents (bare map pins)
+MAX_BATCH_ITEMS = 256
+# Documents over the model's max sequence length: "truncate" keeps the leading tokens (what the
+# model does on its own), "split" embeds consecutive windows and averages them, weighted by length
+LONG_DOCUMENT_MODES = ("truncate", "split")
+LONG_DOCUMENTS = os.environ.get("EMBED_LONG_DOCUMENTS", "truncate")
+
+
+# --- 2. TOKENIZATION AND PLANNING ---
+def tokenize_documents(texts, tokenizer, max_length, long_documents="truncate", instruction=""):
+    """
+    Tokenizes every text once. Returns (segments, owners, stats): each segment is a list of
+    token ids with the special tokens and instruction prefix, at most max_length long, and
+    owners[i] is the index of the text segment i belongs to. A text over max_length keeps
+    its first tokens ("truncate") or becomes consecutive non-overlapping windows ("split").
+    """
+    if long_documents not in LONG_DOCUMENT_MODES:
+        raise ValueError(f"Unsupported long document mode '{long_documents}'. Expected one of {LONG_DOCUMENT_MODES}.")
+    prefix = tokenizer(instruction, add_special_tokens=False)["input_ids"] if instruction else []
+    capacity = max_length - tokenizer.num_special_tokens_to_add() - len(prefix)
+    encoded = tokenizer(list(texts), add_special_tokens=False, truncation=False, verbose=False)["input_ids"]
+
+    segments, owners = [], []
+    stats = {"documents": len(texts), "segments": 0, "truncated": 0, "split": 0}
+    for owner, ids in enumerate(encoded):
+        if len(ids) <= capacity:
+            windows = [ids]
+        elif long_documents == "split":
+            windows = [ids[start:start + capacity] for start in range(0, len(ids), capacity)]
+            stats["split"] += 1
+        else:
+            windows = [ids[:capacity]]
+            stats["truncated"] += 1
+        for window in windows:
+            segments.append(tokenizer.build_inputs_with_special_tokens(prefix + window))
+            owners.append(owner)
+    stats["segments"] = len(segments)
+    return segments, np.asarray(owners, dtype=np.int64), stats
+
+
+def plan_batches(lengths, token_budget, max_items=MAX_BATCH_ITEMS):
+    """
+    Groups segment indices into batches whose padded size (texts x longest length) stays
+    within token_budget. Segments are taken shortest first (ties in input order), so every
+    batch is a bucket of near-equal lengths and the plan depends only on the lengths.
+    A segment longer than the whole budget gets a batch to itself.
+    """
+    batches, batch = [], []
+    for index in np.argsort(np.asarray(lengths), kind="stable"):
+        # Ascending order: the newcomer is the longest member of the batch
+        if batch and ((len(batch) + 1) * lengths[index] > token_budget or len(batch) >= max_items):
+            batches.append(batch)
+            batch = []
+        batch.append(int(index))
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def combine_segments(vectors, owners, lengths, n_texts, normalize=True):
+    """One vector per text: the segment's own, or the length-weighted mean of a split text's windows."""
+    combined = np.empty((n_texts, vectors.shape[1]), dtype=np.float32)
+    combined[owners] = vectors
+    split_owners = np.flatnonzero(np.bincount(owners, minlength=n_texts) > 1)
+    for owner in split_owners:
+        rows = np.flatnonzero(owners == owner)
+        mean = np.average(vectors[rows], axis=0, weights=np.asarray(lengths)[rows])
+        combined[owner] = mean / max(np.linalg.norm(mean), 1e-12) if normalize else mean
+    return combined
+
+
+def in_process_batches(embed_model):
+    """map_batches for TokenBudgetEmbedder that runs every batch on `embed_model`, in order."""
+    def map_batches(batch_ids):
+        for index, ids in enumerate(batch_ids):
+            yield index, embed_token_ids(embed_model, ids)
+    return map_batches
+
+
+# --- 3. EMBEDDER ---
+class TokenBudgetEmbedder:
+    """
+    Document embedding for the indexing path. The texts are tokenized once; the token ids
+    are cut to the model's max sequence length (see tokenize_documents), grouped into
+    length-sorted batches under a padded-token budget (see plan_batches) and sent to the
+    model as ids, so a batch of one-line map pins is no longer padded to a character page.
+    `map_batches(list of batches of token ids)` yields (batch index, vectors) in any order:
+    in_process_batches for a local model, EmbeddingPool for its worker processes.
+    With `cache` (a CachedEmbedding of the same model), only cache misses are embedded.
+    """
+
+    def __init__(self, model_name, map_batches, backend=EMBEDDING_BACKEND, token_budget=TOKEN_BUDGET,
+                 long_documents=LONG_DOCUMENTS, cache=None, normalize=True, max_length=None):
+        self.map_batches = map_batches
+        self.token_budget = token_budget
+        self.long_documents = long_documents
+        self.cache = cache
+        self.normalize = normalize
+        self.tokenizer = load_tokenizer(model_name, backend)
+        self.instruction = text_instruction(model_name)
+        self.max_length = max_length or min(self.tokenizer.model_max_length, MAX_SEQUENCE_LENGTH)
+        self.stats = {}
+
+    def embed_texts(self, texts, desc="Embedding"):
+        """Returns a float32 array of shape (len(texts), dim) in the order of `texts`."""
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        start = time.time()
+        segments, owners, stats = tokenize_documents(texts, self.tokenizer, self.max_length, self.long_documents, self.instruction)
+        lengths = [len(segment) for segment in segments]
+        batches = plan_batches(lengths, self.token_budget)
+
+        vectors = None
+        with tqdm(total=len(segments), desc=desc) as progress:
+            for index, embeddings in self.map_batches([[segments[i] for i in batch] for batch in batches]):
+                if vectors is None:
+                    vectors = np.empty((len(segments), embeddings.shape[1]), dtype=np.float32)
+                vectors[batches[index]] = embeddings
+                progress.update(len(batches[index]))
+        vectors = combine_segments(vectors, owners, lengths, len(texts), self.normalize)
+
+        elapsed = time.time() - start
+        padded = sum(len(batch) * max(lengths[i] for i in batch) for batch in batches)
+        stats.update({"batches": len(batches), "tokens": sum(lengths), "padded_tokens": padded,
+                      "padding_efficiency": sum(lengths) / max(padded, 1), "seconds": elapsed,
+                      "docs_per_sec": len(texts) / max(elapsed, 1e-9)})
+        self.stats = stats
+        print(f"Embedded {len(texts)} documents ({stats['segments']} segments, {stats['truncated']} truncated, "
+              f"{stats['split']} split) in {len(batches)} batches and {elapsed:.1f}s ({stats['docs_per_sec']:.1f} docs/sec, "
+              f"{stats['padding_efficiency']:.0%} of padded tokens are real).")
+        return vectors
+
+    def embed_nodes(self, nodes):
+        """Fills node.embedding with the same text LlamaIndex would embed (content + embed metadata)."""
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+        if self.cache is not None:
+            # Averaged windows differ from the model's own (truncated) vector, so they are cached apart
+            prompt = "text" if self.long_documents == "truncate" else f"text|{self.long_documents}"
+            vectors = np.asarray(self.cache.cached_embeddings(texts, prompt, self.embed_texts), dtype=np.float32)
+        else:
+            vectors = self.embed_texts(texts)
+        for node, vector in zip(nodes, vectors):
+            node.embedding = vector.tolist()
+        return nodes
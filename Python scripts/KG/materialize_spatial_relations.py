@@ -0,0 +1,117 @@
+# materialize_spatial_relations.py
+
+import json
+import os
+from collections import defaultdict
+from shapely import wkt as shapely_wkt
+from shapely.geometry import Polygon, MultiPolygon
+from shapely.strtree import STRtree
+from rdflib import Graph, Namespace, URIRef
+
+# --- Configuration ---
+# <repo>/RDF, resolved from this file so the rewriter (run from another directory) finds the same files
+RDF_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'RDF')
+# The final knowledge graph (output of Define_Properties.py)
+FINAL_GRAPH_PATH = os.path.join(RDF_DIR, 'Witcher3KG.n3')
+# Precomputed sfWithin triples, to be loaded into GraphDB next to the KG
+RELATIONS_OUTPUT_PATH = os.path.join(RDF_DIR, 'SpatialRelations.n3')
+# Bounding boxes + list of materialized containers, read by RAGPipelines/spatial_rewriter.py
+SPATIAL_INDEX_OUTPUT_PATH = os.path.join(RDF_DIR, 'spatial_index.json')
+
+witcher = Namespace("http://cgi.di.uoa.gr/witcher/ontology#")
+GEO = Namespace("http://www.opengis.net/ont/geosparql#")
+
+# The materialized relation. A separate predicate (instead of geo:sfWithin) keeps it from
+# being confused with the GeoSPARQL plugin's own property functions.
+WITHIN_RELATION = witcher.sfWithinMaterialized
+
+
+def load_feature_geometries(graph_path):
+    """
+    Returns {feature_uri: [shapely geometries]} for every feature reachable through
+    geo:hasGeometry/geo:asWKT, exactly the path used by the benchmark templates.
+    """
+    g = Graph()
+    print(f"Loading knowledge graph from {graph_path}...")
+    g.parse(graph_path, format='n3')
+
+    geometries = defaultdict(list)
+    skipped = 0
+    for feature, geometry_node in g.subject_objects(GEO.hasGeometry):
+        for wkt_literal in g.objects(geometry_node, GEO.asWKT):
+            try:
+                geometries[str(feature)].append(shapely_wkt.loads(str(wkt_literal)))
+            except Exception:
+                skipped += 1
+    print(f"Loaded geometries for {len(geometries)} features ({skipped} unparseable WKT literals skipped).")
+    return geometries
+
+
+def materialize_within_relations(geometries):
+    """
+    Computes every (feature, container) pair where some geometry of the feature is
+    within some polygonal geometry of the container, using an STR-tree so each
+    container only tests the features whose envelopes it can contain.
+    """
+    flat_uris, flat_geoms = [], []
+    for uri, geoms in geometries.items():
+        for geom in geoms:
+            flat_uris.append(uri)
+            flat_geoms.append(geom)
+    tree = STRtree(flat_geoms)
+
+    relations = set()
+    containers = []
+    for container_uri, geoms in geometries.items():
+        polygons = [geom for geom in geoms if isinstance(geom, (Polygon, MultiPolygon))]
+        # Only fully polygonal containers are materialized; anything else is left to the
+        # bounding-box strategy of the rewriter.
+        if not polygons or len(polygons) != len(geoms):
+            continue
+        containers.append(container_uri)
+        for polygon in polygons:
+            # A geometry is within itself, so the container relates to itself too,
+            # matching what FILTER(geof:sfWithin(...)) returns for the same feature.
+            for idx in tree.query(polygon, predicate="contains"):
+                relations.add((flat_uris[idx], container_uri))
+    return relations, containers
+
+
+def build_spatial_index(graph_path=FINAL_GRAPH_PATH):
+    """Writes the materialized relation triples and the bounding-box index used for query rewriting."""
+    if not os.path.exists(graph_path):
+        print(f"!!! FATAL ERROR: Knowledge graph file not found at {graph_path} !!!")
+        return
+
+    geometries = load_feature_geometries(graph_path)
+    relations, containers = materialize_within_relations(geometries)
+    print(f"Materialized {len(relations)} sfWithin relations over {len(containers)} polygonal containers.")
+
+    out = Graph()
+    out.bind("witcher", witcher)
+    for feature_uri, container_uri in relations:
+        out.add((URIRef(feature_uri), WITHIN_RELATION, URIRef(container_uri)))
+    out.serialize(RELATIONS_OUTPUT_PATH, format='n3')
+    print(f"Saved relation triples to {RELATIONS_OUTPUT_PATH} (load them into the same GraphDB repository).")
+
+    # The union of a feature's geometry envelopes: a necessary condition for both
+    # sfWithin and sfIntersects, so pruning with it never drops a true result.
+    bboxes = {}
+    for uri, geoms in geometries.items():
+        bounds = [geom.bounds for geom in geoms if not geom.is_empty]
+        if bounds:
+            bboxes[uri] = [min(b[0] for b in bounds), min(b[1] for b in bounds),
+                           max(b[2] for b in bounds), max(b[3] for b in bounds)]
+
+    spatial_index = {
+        "within_relation": str(WITHIN_RELATION),
+        "materialized_containers": sorted(containers),
+        "bboxes": bboxes,
+    }
+    with open(SPATIAL_INDEX_OUTPUT_PATH, 'w', encoding='utf-8') as f:
+        json.dump(spatial_index, f)
+    print(f"Saved bounding-box index for {len(bboxes)} features to {SPATIAL_INDEX_OUTPUT_PATH}")
+
+
+if __name__ == '__main__':
+    build_spatial_index()
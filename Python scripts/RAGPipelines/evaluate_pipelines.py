@@ -5,11 +5,14 @@ import argparse
 import re
 from tqdm import tqdm
 from collections import defaultdict
-from SPARQLWrapper import SPARQLWrapper, JSON
 import time
 
 # Import your pipeline classes from pipelines.py
-from pipelines import SimpleRAGPipeline, AgenticRAGPipeline, ExecutionGuidedAgent
+from pipelines import SimpleRAGPipeline, AgenticRAGPipeline, ExecutionGuidedAgent, preload_retrieval_context
+from spatial_rewriter import execute_with_pushdown, PUSHDOWN_MODES
+from sparql_validator import validate_sparql
+from query_log import execute_logged_query, query_tags, export_query_stats
+from label_lookup import fast_path_stats
 10
 # --- 1. SETUP ---
 SPARQL_ENDPOINT_URL = "http://localhost:7200/repositories/da4dte_final"
@@ -22,6 +25,7 @@ NAMESPACES = """
     PREFIX owl: <http://www.w3.org/2002/07/owl#>
     PREFIX dbr: <http://cgi.di.uoa.gr/witcher/resource/>
 """
+SPATIAL_PUSHDOWN_MODE = "off" # Set from --spatial-pushdown in main()
 
 # --- 2. EVALUATION HELPER FUNCTIONS ---
 def clean_sparql_string(sparql_query: str) -> str:
@@ -61,11 +65,14 @@ def execute_and_get_results(sparql_query: str, is_superlative: bool):
     cleaned_query = clean_sparql_string(sparql_query)
     if not cleaned_query or "ERROR" in cleaned_query: return {"error": "Invalid query."}
     full_query = NAMESPACES + cleaned_query
-    sparql = SPARQLWrapper(SPARQL_ENDPOINT_URL)
-    sparql.setQuery(full_query)
-    sparql.setReturnFormat(JSON)
+    validation_error = validate_sparql(full_query, check_uris=False)
+    if validation_error: return {"error": validation_error["reason"]}
+
+    def run_query(query_text):
+        return execute_logged_query(SPARQL_ENDPOINT_URL, query_text, caller="evaluator")
+
     try:
-        results = sparql.query().convert()
+        results = execute_with_pushdown(full_query, run_query, SPATIAL_PUSHDOWN_MODE)
         if "boolean" in results: return {"boolean": results["boolean"]}
         bindings = results["results"]["bindings"]
         if is_superlative and bindings: bindings = [bindings[0]]
@@ -105,7 +112,13 @@ def main():
     parser.add_argument("--test-file", default="../WitcherBenchmark/validation_set.json", help="The test set to evaluate.")
     parser.add_argument("--output-file", default="pipeline_evaluation_results.json", help="Output file for detailed results.")
     parser.add_argument("--pipelines", nargs='+', choices=['A', 'B', 'C'], default=['A', 'B', 'C'], help="Which pipelines to test.")
+    parser.add_argument("--spatial-pushdown", choices=PUSHDOWN_MODES, default="off", help="Rewrite GeoSPARQL filters before execution; 'compare' runs both versions and logs their latencies.")
     args = parser.parse_args()
+    # Load the embedding model and indexes in the background while the rest of the set-up runs
+    preload_retrieval_context()
+
+    global SPATIAL_PUSHDOWN_MODE
+    SPATIAL_PUSHDOWN_MODE = args.spatial_pushdown
   
     # --- Load Test Set & Initialize Pipelines ---
     with open(args.test_file, 'r') as f:
@@ -131,7 +144,8 @@ def main():
         
         # Get Ground Truth results for both metrics
         gt_answer_keys = extract_answer_keys(ground_truth_sparql)
-        ground_truth_results = execute_and_get_results(ground_truth_sparql, is_superlative)
+        with query_tags(template_id=template_id, role="ground_truth"):
+            ground_truth_results = execute_and_get_results(ground_truth_sparql, is_superlative)
         
         
         result_entry = {"query_id": item['query_id'], "question": question, "ground_truth_sparql": ground_truth_sparql}
@@ -141,11 +155,14 @@ def main():
             
             try:
                 time.sleep(1) 
-                generated_sparql = pipeline.generate_query(question)
+                # Agent tool queries issued while generating are tagged with the template too
+                with query_tags(template_id=template_id, pipeline=p_name, role="generation"):
+                    generated_sparql = pipeline.generate_query(question)
                 
                 # --- Evaluate both metrics ---
                 gen_answer_keys = extract_answer_keys(generated_sparql)
-                generated_results = execute_and_get_results(generated_sparql, is_superlative)
+                with query_tags(template_id=template_id, pipeline=p_name, role="generated"):
+                    generated_results = execute_and_get_results(generated_sparql, is_superlative)
                 
                 # EA: Strict comparison of canonical row sets
                 is_correct_ea = (
@@ -202,6 +219,8 @@ def main():
     print(f"\nSaving detailed results to '{args.output_file}'...")
     with open(args.output_file, 'w') as f:
         json.dump(detailed_results, f, indent=2)
+    export_query_stats()
+    print(f"Label fast path (agent search tools): {fast_path_stats()}")
     print("Done!")
 
 if __name__ == "__main__":
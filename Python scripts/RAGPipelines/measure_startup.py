@@ -0,0 +1,65 @@
+# measure_startup.py
+
+import sys
+import json
+import argparse
+import subprocess
+import statistics
+
+# --- 1. CONFIGURATION ---
+
+# Each scenario runs in a fresh interpreter, so nothing is cached between measurements
+SCENARIOS = {
+    # What `import pipelines` costs now that models and indexes load lazily
+    "import_lazy": "import pipelines",
+    # Import plus a full retrieval-context load: what `import pipelines` used to cost
+    "import_eager": "import pipelines; pipelines.get_retrieval_context()",
+    # A helper-only consumer, which no longer pays for the model
+    "import_helper_only": "from pipelines import extract_sparql_from_llm_response",
+    # Background preload overlapping one second of other start-up work (argument parsing, dataset loading)
+    "preload_overlapped": "import time, pipelines; pipelines.preload_retrieval_context(); time.sleep(1.0); pipelines.get_retrieval_context()",
+}
+
+TIMER = """
+import time
+_start = time.perf_counter()
+{code}
+print("__ELAPSED__", time.perf_counter() - _start)
+"""
+
+
+# --- 2. MEASUREMENT ---
+
+def run_scenario(code: str) -> float:
+    """Runs `code` in a fresh interpreter (from this directory) and returns its wall time in seconds."""
+    result = subprocess.run([sys.executable, "-c", TIMER.format(code=code)], capture_output=True, text=True)
+    for line in result.stdout.splitlines():
+        if line.startswith("__ELAPSED__"):
+            return float(line.split()[1])
+    raise RuntimeError(f"Scenario failed:\n{result.stderr.strip()[-2000:]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure pipelines.py start-up time with lazy vs. eager model/index loading.")
+    parser.add_argument("--repeats", type=int, default=3, help="Fresh-interpreter runs per scenario (the median is reported).")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--output-file", default="startup_times.json")
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.scenarios:
+        try:
+            times = [run_scenario(SCENARIOS[name]) for _ in range(args.repeats)]
+        except RuntimeError as e:
+            print(f"  - {name}: {e}")
+            continue
+        results[name] = {"median_s": statistics.median(times), "runs_s": times}
+        print(f"  - {name}: {results[name]['median_s']:.2f}s (median of {len(times)})")
+
+    with open(args.output_file, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Start-up measurements saved to {args.output_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+# name_index.py
+
+import os
+import re
+import json
+from collections import defaultdict
+
+# --- 1. CONFIGURATION ---
+
+# Written by IndexCreation/build_indices.py: one entry per class/property with its label
+NAME_INDEX_PATH = "./storage/name_index.json"
+# Length of the n-grams in the posting lists; shorter keywords fall back to a linear scan
+NGRAM_SIZE = 3
+# How many matches find_classes_by_keyword returns to the agent
+MAX_KEYWORD_RESULTS = 10
+
+# The agent's "last resort" debugging queries from the Pipeline C prompt, e.g.
+#   SELECT DISTINCT ?class WHERE { ?s a ?class . FILTER(CONTAINS(LCASE(STR(?class)), "keyword")) }
+#   SELECT DISTINCT ?p WHERE { ?s ?p ?o . FILTER(CONTAINS(LCASE(STR(?p)), "keyword")) }
+_CLASS_SCAN = re.compile(
+    r'^\s*SELECT\s+DISTINCT\s+\?(?P<var>\w+)\s+WHERE\s*\{\s*\?\w+\s+(?:a|rdf:type)\s+\?(?P=var)\s*\.?\s*'
+    r'FILTER\s*\(\s*CONTAINS\s*\(\s*LCASE\s*\(\s*STR\s*\(\s*\?(?P=var)\s*\)\s*\)\s*,\s*"(?P<keyword>[^"\\]*)"\s*\)\s*\)\s*\.?\s*\}\s*$',
+    re.IGNORECASE
+)
+_PROPERTY_SCAN = re.compile(
+    r'^\s*SELECT\s+DISTINCT\s+\?(?P<var>\w+)\s+WHERE\s*\{\s*\?\w+\s+\?(?P=var)\s+\?\w+\s*\.?\s*'
+    r'FILTER\s*\(\s*CONTAINS\s*\(\s*LCASE\s*\(\s*STR\s*\(\s*\?(?P=var)\s*\)\s*\)\s*,\s*"(?P<keyword>[^"\\]*)"\s*\)\s*\)\s*\.?\s*\}\s*$',
+    re.IGNORECASE
+)
+
+_name_index = None
+
+
+# --- 2. HELPER FUNCTIONS ---
+
+def _local_name(uri: str) -> str:
+    return re.split(r'[/#]', uri)[-1]
+
+
+def _ngrams(text: str) -> set:
+    return {text[i:i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)}
+
+
+class NameIndex:
+    """
+    N-gram index over the URIs and labels of the KG's classes and properties.
+    Every lowercased field is split into character trigrams; a substring search
+    intersects the posting lists of the keyword's trigrams and only verifies the
+    few surviving candidates, instead of scanning every typed triple on the endpoint.
+    """
+
+    def __init__(self, entries: list):
+        self.entries = entries
+        # Fields searched per entry: the full URI (what STR(?class) sees) and the label
+        self.fields = [(e["uri"].lower(), e.get("label", "").lower()) for e in entries]
+        self.postings = defaultdict(set)
+        for idx, fields in enumerate(self.fields):
+            for field in fields:
+                for gram in _ngrams(field):
+                    self.postings[gram].add(idx)
+
+    def _candidates(self, keyword: str):
+        grams = _ngrams(keyword)
+        if not grams:
+            return range(len(self.entries))
+        posting_lists = sorted((self.postings.get(gram, set()) for gram in grams), key=len)
+        return set.intersection(*posting_lists)
+
+    def search(self, keyword: str, kind: str = None, used_only: bool = False, uri_only: bool = False) -> list:
+        """
+        Returns the entries whose URI (or, unless uri_only, label) contains `keyword`.
+        The keyword is matched as given, so callers decide on case folding.
+        """
+        matches = []
+        for idx in self._candidates(keyword):
+            entry = self.entries[idx]
+            if kind and entry["kind"] != kind:
+                continue
+            if used_only and not entry.get("used"):
+                continue
+            uri_field, label_field = self.fields[idx]
+            if keyword in uri_field or (not uri_only and keyword in label_field):
+                matches.append(entry)
+        return matches
+
+
+def load_name_index(path: str = NAME_INDEX_PATH):
+    """Loads the persisted name index once. Returns None if it has not been built."""
+    global _name_index
+    if _name_index is None:
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                _name_index = NameIndex(json.load(f))
+        else:
+            print(f"Warning: name index not found at {path}. Run IndexCreation/build_indices.py; keyword lookups will hit the endpoint.")
+            _name_index = NameIndex([])
+    return _name_index if _name_index.entries else None
+
+
+def _rank(keyword: str):
+    """Sort key: exact local-name/label matches first, then prefixes, then shorter names."""
+    def key(entry):
+        local = _local_name(entry["uri"]).lower()
+        label = entry.get("label", "").lower()
+        return (keyword not in (local, label), not (local.startswith(keyword) or label.startswith(keyword)),
+                not entry.get("used"), len(local), entry["uri"])
+    return key
+
+
+# --- 3. LOOKUPS ---
+
+def find_by_keyword(keyword: str, kind: str = "class", limit: int = MAX_KEYWORD_RESULTS):
+    """
+    Case-insensitive substring search over class (or property) names and labels.
+    Returns a list of {"name", "uri"} dicts, or None if the index is unavailable.
+    """
+    index = load_name_index()
+    if index is None:
+        return None
+    keyword = (keyword or "").strip().lower()
+    if not keyword:
+        return []
+    matches = sorted(index.search(keyword, kind=kind), key=_rank(keyword))
+    return [{"name": e.get("label") or _local_name(e["uri"]), "uri": e["uri"]} for e in matches[:limit]]
+
+
+def answer_keyword_scan(query_body: str, limit: int = None):
+    """
+    Answers the agent's CONTAINS(LCASE(STR(?class)), "...") debugging queries from the index.
+    Mirrors the SPARQL semantics: only the lowercased URI is searched, the keyword is used
+    as written, and only classes with instances / properties with triples qualify.
+    Returns a SPARQL JSON result dict, or None if the query is not such a scan.
+    """
+    match = _CLASS_SCAN.match(query_body or "")
+    kind = "class"
+    if not match:
+        match = _PROPERTY_SCAN.match(query_body or "")
+        kind = "property"
+    if not match:
+        return None
+    index = load_name_index()
+    if index is None:
+        return None
+
+    var, keyword = match.group("var"), match.group("keyword")
+    uris = sorted(e["uri"] for e in index.search(keyword, kind=kind, used_only=True, uri_only=True))
+    if limit is not None:
+        uris = uris[:limit]
+    return {
+        "head": {"vars": [var]},
+        "results": {"bindings": [{var: {"type": "uri", "value": uri}} for uri in uris]},
+    }
@@ -4,11 +4,23 @@ import json
 import argparse
 import requests
 from typing import Optional
-from llama_index.core import load_index_from_storage, StorageContext, Settings
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 import warnings
 import re
-from SPARQLWrapper import SPARQLWrapper, JSON
+import os
+import sys
+import time
+import threading
+
+# Modules used by both IndexCreation and RAGPipelines live in ../Shared
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Shared"))
+from spatial_rewriter import execute_with_pushdown
+from sparql_validator import validate_sparql
+from name_index import find_by_keyword, answer_keyword_scan
+from lexical_index import hybrid_search
+from label_lookup import lookup_label
+from query_log import execute_logged_query
+from retrieval_client import remote_retrieve, server_available
+from entity_partitions import ENTITY_PARTITIONS, route_query
 
 warnings.filterwarnings("ignore", category=FutureWarning, module="sentence_transformers.SentenceTransformer")
 
@@ -25,39 +37,215 @@ NAMESPACES = """
     PREFIX geo: <http://www.opengis.net/ont/geosparql#>
     PREFIX geof: <http://www.opengis.net/def/function/geosparql/>
 """
+# GeoSPARQL filter pushdown for agent queries: "off", "on" or "compare" (see spatial_rewriter.py)
+SPATIAL_PUSHDOWN_MODE = os.environ.get("SPATIAL_PUSHDOWN", "off")
+# Answer the agent's CONTAINS(LCASE(STR(?class))) debugging scans from the name index: "on" or "off"
+NAME_INDEX_REWRITE = os.environ.get("NAME_INDEX_REWRITE", "on") == "on"
+# First-pass search over the entity index: "none" (exact), "int8" or "binary" (see flat_vector_store.py)
+ENTITY_QUANTIZATION = os.environ.get("ENTITY_QUANTIZATION", "none")
+# HNSW query beam width for indexes built with --index-type hnsw (unset = the store's default)
+HNSW_EF_SEARCH = int(os.environ["HNSW_EF_SEARCH"]) if os.environ.get("HNSW_EF_SEARCH") else None
+# Fuse BM25 name/alias matches into the search tools' vector results: "on" or "off" (see lexical_index.py)
+HYBRID_RETRIEVAL = os.environ.get("HYBRID_RETRIEVAL", "on") == "on"
+# Answer exact/typo'd names from the label lookup before any retrieval: "on" or "off" (see label_lookup.py)
+LABEL_FAST_PATH = os.environ.get("LABEL_FAST_PATH", "on") == "on"
+# Two-stage entity retrieval, small model then large-model rescoring: "on" or "off" (see cascade_retriever.py)
+CASCADE_RETRIEVAL = os.environ.get("CASCADE_RETRIEVAL", "off") == "on"
+# Small-model top-1/top-2 score gap above which the large model is skipped (unset = always rescore)
+CASCADE_MARGIN = float(os.environ["CASCADE_MARGIN"]) if os.environ.get("CASCADE_MARGIN") else None
+# Route untyped entity searches to the partitions their wording names: "on" or "off" (see entity_partitions.py)
+ENTITY_ROUTER = os.environ.get("ENTITY_ROUTER", "off") == "on"
+
+# Results per search tool call / per index in the Simple pipeline's context
+RETRIEVAL_TOP_K = 5
+
+
+def retrieval_settings() -> dict:
+    """
+    The settings that change vector retrieval results. The retrieval server reports its own
+    on /health, and the client only uses a server whose settings match (see retrieval_client.py).
+    """
+    from embedding_backend import EMBEDDING_BACKEND
+    return {"storage_dir": os.path.abspath("./storage"), "embedding_backend": EMBEDDING_BACKEND,
+            "entity_quantization": ENTITY_QUANTIZATION, "hnsw_ef_search": HNSW_EF_SEARCH,
+            "cascade_retrieval": CASCADE_RETRIEVAL, "cascade_margin": CASCADE_MARGIN}
 
-print("--- Setting up LlamaIndex models ---")
-Settings.embed_model = HuggingFaceEmbedding(model_name="BAAI/bge-large-en-v1.5")
-Settings.llm = None # We are using the DeepSeek API directly
 
-print("--- Loading indexes from storage ---")
-try:
-    entity_index = load_index_from_storage(StorageContext.from_defaults(persist_dir="./storage/entity_index"))
-    class_index = load_index_from_storage(StorageContext.from_defaults(persist_dir="./storage/class_index"))
-    prop_index = load_index_from_storage(StorageContext.from_defaults(persist_dir="./storage/prop_index"))
-except FileNotFoundError:
-    raise FileNotFoundError("Error: Could not load indexes. Please run 'build_indexes.py' first.")
+class RetrievalContext:
+    """
+    The embedding model, the three indexes and their retrievers, loaded on first use
+    instead of at import time, and shared by every pipeline in the process. preload()
+    starts the load in a background thread, so it overlaps argument parsing and dataset
+    loading; the first real use then only waits for whatever is left of it.
+    """
 
-# Create a retriever for each index
-entity_retriever = entity_index.as_retriever(similarity_top_k=5)
-class_retriever = class_index.as_retriever(similarity_top_k=5)
-prop_retriever = prop_index.as_retriever(similarity_top_k=5)
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._thread = None
+        self._partition_retrievers = {}
+
+    def load(self):
+        """Loads everything once (thread-safe) and returns self."""
+        with self._lock:
+            if self._loaded:
+                return self
+            start = time.time()
+            from llama_index.core import Settings
+            from embedding_backend import load_embed_model
+            from flat_vector_store import load_vector_index
+            from multi_index_retriever import MultiIndexRetriever
+            from embedding_cache import with_embedding_cache
+
+            print("--- Setting up LlamaIndex models ---")
+            # The embedding model runs on EMBEDDING_BACKEND: "torch", "onnx" or "onnx-int8" (see embedding_backend.py)
+            Settings.embed_model = with_embedding_cache(load_embed_model("BAAI/bge-large-en-v1.5"))
+            Settings.llm = None # We are using the DeepSeek API directly
+
+            print("--- Loading indexes from storage ---")
+            try:
+                self.entity_index = load_vector_index("./storage/entity_index", quantization=ENTITY_QUANTIZATION, ef_search=HNSW_EF_SEARCH)
+                self.class_index = load_vector_index("./storage/class_index", ef_search=HNSW_EF_SEARCH)
+                self.prop_index = load_vector_index("./storage/prop_index")
+            except FileNotFoundError:
+                raise FileNotFoundError("Error: Could not load indexes. Please run 'build_indexes.py' first.")
+
+            # Create a retriever for each index
+            self.entity_retriever = self.entity_index.as_retriever(similarity_top_k=RETRIEVAL_TOP_K)
+            self.class_retriever = self.class_index.as_retriever(similarity_top_k=RETRIEVAL_TOP_K)
+            self.prop_retriever = self.prop_index.as_retriever(similarity_top_k=RETRIEVAL_TOP_K)
+            # Retrieves context from all three indexes with a single question embedding
+            self.context_retriever = MultiIndexRetriever({"entity": self.entity_retriever, "class": self.class_retriever, "property": self.prop_retriever})
+            self.entity_cascade = None
+            if CASCADE_RETRIEVAL:
+                from cascade_retriever import load_cascade_retriever
+                try:
+                    self.entity_cascade = load_cascade_retriever(self.entity_index, RETRIEVAL_TOP_K, decisive_margin=CASCADE_MARGIN)
+                except FileNotFoundError as e:
+                    print(f"Warning: {e} Using single-stage entity retrieval.")
+            self._loaded = True
+            print(f"--- Retrieval context ready in {time.time() - start:.1f}s ---")
+            return self
+
+    def entity_partition_retriever(self, partitions):
+        """
+        An entity retriever that only searches the given partitions (one per partition set).
+        Entity indexes built before partitions existed are searched whole.
+        """
+        from flat_vector_store import partition_filters
+        if getattr(self.entity_index.vector_store, "partitions", None) is None:
+            return self.entity_retriever
+        key = tuple(sorted(partitions))
+        if key not in self._partition_retrievers:
+            self._partition_retrievers[key] = self.entity_index.as_retriever(similarity_top_k=RETRIEVAL_TOP_K,
+                                                                             filters=partition_filters(key))
+        return self._partition_retrievers[key]
+
+    def preload(self):
+        """Starts loading in a daemon thread; errors surface again on the first load()."""
+        if self._thread is None and not self._loaded:
+            def run():
+                try:
+                    self.load()
+                except Exception as e:
+                    print(f"Warning: background preload of the retrieval context failed: {e}")
+            self._thread = threading.Thread(target=run, name="retrieval-preload", daemon=True)
+            self._thread.start()
+        return self
+
+
+_retrieval_context = RetrievalContext()
+
+def get_retrieval_context() -> RetrievalContext:
+    """The process-wide retrieval context, loaded on first call."""
+    return _retrieval_context.load()
+
+def preload_retrieval_context():
+    """
+    Starts loading the retrieval context in the background; call it early in a script's main().
+    Nothing is loaded when a retrieval server with the same settings is running (see retrieval_server.py).
+    """
+    if not server_available(retrieval_settings()):
+        _retrieval_context.preload()
+
+def retrieve(query: str, kinds: list, entity_partitions: Optional[list] = None) -> dict:
+    """
+    Top-RETRIEVAL_TOP_K vector retrieval from the given indexes with one query embedding:
+    returns {kind: [{"name", "uri"}]}. Served by the retrieval server when one with the same
+    retrieval_settings() is reachable, otherwise from the in-process retrieval context. With CASCADE_RETRIEVAL on, entities come
+    from the cascade retriever, whose large-model query embedding (if it computed one) is
+    reused for the other indexes. `entity_partitions` restricts the entity search to those
+    partitions, scanning only their rows (this takes precedence over the cascade).
+    """
+    remote = remote_retrieve(query, kinds, RETRIEVAL_TOP_K, entity_partitions, retrieval_settings())
+    if remote is not None:
+        return {kind: [{"name": r["name"], "uri": r["uri"]} for r in results] for kind, results in remote.items()}
+    context = get_retrieval_context()
+    entity_retriever = None
+    if "entity" in kinds:
+        if entity_partitions:
+            entity_retriever = context.entity_partition_retriever(entity_partitions)
+        elif context.entity_cascade is not None:
+            entity_retriever = context.entity_cascade
+    if entity_retriever is not None:
+        from llama_index.core.schema import QueryBundle
+        query_bundle = QueryBundle(query)
+        results = {"entity": entity_retriever.retrieve(query_bundle)}
+        other_kinds = [kind for kind in kinds if kind != "entity"]
+        if other_kinds:
+            results.update(context.context_retriever.retrieve(query_bundle, names=other_kinds))
+    else:
+        results = context.context_retriever.retrieve(query, names=kinds)
+    return {kind: [{"name": n.metadata['name'], "uri": n.metadata['uri']} for n in nodes] for kind, nodes in results.items()}
 
 # --- TOOL DEFINITIONS (Python functions the agent can call) ---
-def search_for_entity(query: str):
-    """Searches the knowledge graph for specific named entities like people, places, or items."""
-    nodes = entity_retriever.retrieve(query)
-    return json.dumps([{"name": n.metadata['name'], "uri": n.metadata['uri']} for n in nodes])
+def _search(query: str, kind: str, partitions: Optional[list] = None):
+    """
+    Label fast path first (no embedding, and no model/index loading, when the query names
+    something), then vector retrieval, fused with the BM25 lexical index unless HYBRID_RETRIEVAL is off.
+    `partitions` restricts entity results to those partitions at every stage.
+    """
+    if LABEL_FAST_PATH:
+        hits = lookup_label(query, kind, limit=RETRIEVAL_TOP_K, partitions=partitions)
+        if hits is not None:
+            return hits
+    def vector_search(q):
+        return retrieve(q, [kind], entity_partitions=partitions)[kind]
+    if not HYBRID_RETRIEVAL:
+        return vector_search(query)
+    return hybrid_search(query, kind, vector_search, limit=RETRIEVAL_TOP_K, partitions=partitions)
+
+def search_for_entity(query: str, entity_type: Optional[str] = None):
+    """
+    Searches the knowledge graph for specific named entities like people, places, or items.
+    `entity_type` (one of ENTITY_PARTITIONS, e.g. "map_pin" or "quest") only returns entities
+    of that type; without it, ENTITY_ROUTER lets the query's wording pick the partitions.
+    """
+    if entity_type in ENTITY_PARTITIONS:
+        partitions = [entity_type]
+    else:
+        partitions = route_query(query) if ENTITY_ROUTER else None
+    return json.dumps(_search(query, "entity", partitions))
 
 def search_for_class(query: str):
     """Searches the knowledge graph for categories or types of things, like 'Witchers' or 'Cities'."""
-    nodes = class_retriever.retrieve(query)
-    return json.dumps([{"name": n.metadata['name'], "uri": n.metadata['uri']} for n in nodes])
+    return json.dumps(_search(query, "class"))
 
 def search_for_property(query: str):
     """Searches the knowledge graph for attributes or relationships, like 'hair color' or 'affiliations'."""
-    nodes = prop_retriever.retrieve(query)
-    return json.dumps([{"name": n.metadata['name'], "uri": n.metadata['uri']} for n in nodes])
+    return json.dumps(_search(query, "property"))
+
+def find_classes_by_keyword(query: str):
+    """
+    Finds classes whose URI or label contains a keyword (case-insensitive), using the
+    n-gram name index built with the KG instead of a CONTAINS scan on the endpoint.
+    """
+    matches = find_by_keyword(query, kind="class")
+    if matches is None:
+        # Index not built: fall back to the equivalent debugging query
+        keyword = (query or "").strip().lower().replace('"', '')
+        return execute_sparql_for_agent(f'SELECT DISTINCT ?class WHERE {{ ?s a ?class . FILTER(CONTAINS(LCASE(STR(?class)), "{keyword}")) }}')
+    return json.dumps(matches)
 
 # Define GeoSPARQL geospatial functions as context for the model
 GEOSPATIAL_FUNCTIONS = [
@@ -104,13 +292,19 @@ def execute_sparql_for_agent(query: str) -> str:
     # Use a slightly higher limit for debugging queries
     query_with_limit = NAMESPACES + query_body + " LIMIT 5"
     
-    sparql = SPARQLWrapper(SPARQL_ENDPOINT_URL)
-    sparql.setQuery(query_with_limit)
-    sparql.setReturnFormat(JSON)
-    sparql.agent = "RAG-Agent-Tool/1.0"
+    # Catch syntax errors, unknown prefixes and non-existent URIs locally instead of via GraphDB
+    validation_error = validate_sparql(query_with_limit)
+    if validation_error:
+        return json.dumps(validation_error)
+    
+    def run_query(query_text):
+        return execute_logged_query(SPARQL_ENDPOINT_URL, query_text, caller="agent_tool", agent="RAG-Agent-Tool/1.0")
     
     try:
-        results = sparql.query().convert()
+        # Keyword scans over class/property URIs are answered from the local name index
+        results = answer_keyword_scan(query_body, limit=5) if NAME_INDEX_REWRITE else None
+        if results is None:
+            results = execute_with_pushdown(query_with_limit, run_query, SPATIAL_PUSHDOWN_MODE)
         if "boolean" in results:
             return json.dumps({"status": "SUCCESS", "boolean_result": results['boolean']})
         
@@ -135,12 +329,8 @@ def find_equivalent_class(class_uri: str) -> str:
         return "Error: No class URI provided."
         
     query_body = f"SELECT ?equivalentClass WHERE {{ <{class_uri}> owl:sameAs ?equivalentClass . }}"
-    sparql = SPARQLWrapper(SPARQL_ENDPOINT_URL)
-    sparql.setQuery(NAMESPACES + query_body)
-    sparql.setReturnFormat(JSON)
-    sparql.agent = "RAG-Agent-Tool/1.0"
     try:
-        results = sparql.query().convert()["results"]["bindings"]
+        results = execute_logged_query(SPARQL_ENDPOINT_URL, NAMESPACES + query_body, caller="agent_equivalent_class", agent="RAG-Agent-Tool/1.0")["results"]["bindings"]
         if results:
             equivalent_uris = [res['equivalentClass']['value'] for res in results]
             return json.dumps({"equivalent_classes": equivalent_uris})
@@ -198,21 +388,20 @@ class SimpleRAGPipeline:
         """
 
     def generate_query(self, question: str) -> str:
-        entity_nodes = entity_retriever.retrieve(question)
-        class_nodes = class_retriever.retrieve(question)
-        prop_nodes = prop_retriever.retrieve(question)
+        retrieved = retrieve(question, ["entity", "class", "property"])
+        entity_nodes, class_nodes, prop_nodes = retrieved["entity"], retrieved["class"], retrieved["property"]
 
         context_str = "--- Retrieved Entities ---\n"
         for node in entity_nodes:
-            context_str += f"- Name: {node.metadata['name']}, URI: <{node.metadata['uri']}>\n"
+            context_str += f"- Name: {node['name']}, URI: <{node['uri']}>\n"
         
         context_str += "\n--- Retrieved Classes ---\n"
         for node in class_nodes:
-            context_str += f"- Name: {node.metadata['name']}, URI: <{node.metadata['uri']}>\n"
+            context_str += f"- Name: {node['name']}, URI: <{node['uri']}>\n"
             
         context_str += "\n--- Retrieved Properties ---\n"
         for node in prop_nodes:
-            context_str += f"- Name: {node.metadata['name']}, URI: <{node.metadata['uri']}>\n"
+            context_str += f"- Name: {node['name']}, URI: <{node['uri']}>\n"
 
         user_prompt = f"""
         User Question: "{question}"
@@ -260,7 +449,7 @@ class AgenticRAGPipeline:
         You are a reasoning agent that converts a user's question into a SPARQL/GeoSPARQL query.
         Your goal is to gather enough information to write the query.
         You have access to three tools to search a knowledge graph:
-        1. search_for_entity(query): To find specific people, places, monsters, etc.
+        1. search_for_entity(query, entity_type): To find specific people, places, monsters, etc. (entity_type optionally restricts the search, e.g. to map pins).
         2. search_for_class(query): To find types or categories of things.
         3. search_for_property(query): To find attributes or relationships.
         
@@ -276,7 +465,10 @@ class AgenticRAGPipeline:
                 "function": {
                     "name": "search_for_entity",
                     "description": "Searches for specific named entities (people, places, items).",
-                    "parameters": {"type": "object", "properties": {"query": {"type": "string", "description": "The name of the entity to search for, e.g., 'Geralt of Rivia'"}}, "required": ["query"]},
+                    "parameters": {"type": "object", "properties": {
+                        "query": {"type": "string", "description": "The name of the entity to search for, e.g., 'Geralt of Rivia'"},
+                        "entity_type": {"type": "string", "enum": list(ENTITY_PARTITIONS[:-1]), "description": "Optional: only return entities of this type, e.g. 'map_pin' for map pins/POIs"}},
+                        "required": ["query"]},
                 }
             },
             {
@@ -333,7 +525,10 @@ class AgenticRAGPipeline:
                     function_args = json.loads(tool_call['function']['arguments'])
                     
                     # Call the actual Python function
-                    function_response = self.available_tools[function_name](query=function_args.get("query"))
+                    if function_name == 'search_for_entity':
+                        function_response = self.available_tools[function_name](query=function_args.get("query"), entity_type=function_args.get("entity_type"))
+                    else:
+                        function_response = self.available_tools[function_name](query=function_args.get("query"))
                     
                     # Append the tool's response in the correct format for the next API call
                     messages.append({
@@ -369,7 +564,8 @@ class ExecutionGuidedAgent:
             "search_for_property": search_for_property,
             "search_for_geospatial_function": search_for_geospatial_function,
             "execute_sparql_query": execute_sparql_for_agent,
-            "find_equivalent_class": find_equivalent_class
+            "find_equivalent_class": find_equivalent_class,
+            "find_classes_by_keyword": find_classes_by_keyword
         }
         self.system_prompt = """
         You are a highly advanced reasoning agent that converts a user's question into a perfect SPARQL query.
@@ -406,8 +602,8 @@ class ExecutionGuidedAgent:
         - If the `"status"` is **'SUCCESS'**: You are done. Proceed to the final step.
         - If the `"status"` is **'NO_RESULTS'**: Your query failed, likely due to an incorrect class URI.
             - **Action 1 (Primary Recovery):** Call the `find_equivalent_class` tool with the class URI that just failed. If it returns a new URI, your IMMEDIATE next action is to formulate a new hypothesis using this new URI and test it with `execute_sparql_query`.
-            - **Action 2 (Last Resort Debugging):** If `find_equivalent_class` fails, run a debugging query to discover new class URIs, for example: `SELECT DISTINCT ?class WHERE {{ ?s a ?class . FILTER(CONTAINS(LCASE(STR(?class)), "keyword")) }}`.
-            - **Action 3 (Crucial):** After running a debugging query that returns a 'SUCCESS' status, you MUST **inspect the `results` field** in the JSON response. Extract a relevant URI from the results and use it to build your final hypothesis. Test this final hypothesis with `execute_sparql_query`.
+            - **Action 2 (Last Resort Debugging):** If `find_equivalent_class` fails, call the `find_classes_by_keyword` tool with a short keyword (e.g. "blacksmith") to discover class URIs whose name contains it.
+            - **Action 3 (Crucial):** After `find_classes_by_keyword` returns matches, extract a relevant URI from the results and use it to build your final hypothesis. Test this final hypothesis with `execute_sparql_query`.
         - If the `"status"` is **'EXECUTION_ERROR'**: Your query has a syntax error. Fix it and try again.
 
         **Step 5: Final Output.**
@@ -421,7 +617,10 @@ class ExecutionGuidedAgent:
                 "function": {
                     "name": "search_for_entity",
                     "description": "Searches for specific named entities (people, places, items).",
-                    "parameters": {"type": "object", "properties": {"query": {"type": "string", "description": "The name of the entity to search for, e.g., 'Geralt of Rivia'"}}, "required": ["query"]},
+                    "parameters": {"type": "object", "properties": {
+                        "query": {"type": "string", "description": "The name of the entity to search for, e.g., 'Geralt of Rivia'"},
+                        "entity_type": {"type": "string", "enum": list(ENTITY_PARTITIONS[:-1]), "description": "Optional: only return entities of this type, e.g. 'map_pin' for map pins/POIs"}},
+                        "required": ["query"]},
                 }
             },
             {
@@ -463,6 +662,14 @@ class ExecutionGuidedAgent:
                     "description": "Given a class URI, finds other classes linked by owl:sameAs. Use this to find a geospatial class from a conceptual one.",
                     "parameters": {"type": "object", "properties": {"class_uri": {"type": "string", "description": "The URI of the class that failed in a query."}}, "required": ["class_uri"]},
                 }
+            },
+            {
+                "type": "function",
+                "function": {
+                    "name": "find_classes_by_keyword",
+                    "description": "Finds class URIs whose name or label contains a keyword. Use this instead of a FILTER(CONTAINS(...)) debugging query.",
+                    "parameters": {"type": "object", "properties": {"query": {"type": "string", "description": "A keyword contained in the class name, e.g., 'blacksmith'"}}, "required": ["query"]},
+                }
             }
         ]
 
@@ -500,6 +707,8 @@ class ExecutionGuidedAgent:
                     try:
                         if function_name == 'find_equivalent_class':
                             function_response = self.available_tools[function_name](class_uri=function_args.get("class_uri"))
+                        elif function_name == 'search_for_entity':
+                            function_response = self.available_tools[function_name](query=function_args.get("query"), entity_type=function_args.get("entity_type"))
                         else:
                             function_response = self.available_tools[function_name](query=function_args.get("query"))
                     except Exception as e:
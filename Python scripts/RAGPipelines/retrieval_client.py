@@ -0,0 +1,70 @@
+# retrieval_client.py
+
+import os
+import requests
+from typing import Optional
+
+# --- 1. CONFIGURATION ---
+
+# Where retrieval_server.py listens; set RETRIEVAL_SERVER_URL=off to always retrieve in-process
+RETRIEVAL_SERVER_URL = os.environ.get("RETRIEVAL_SERVER_URL", "http://127.0.0.1:8765")
+# The health check must not slow down scripts when no server is running
+HEALTH_TIMEOUT_S = 0.2
+REQUEST_TIMEOUT_S = 30
+
+# None = not checked yet; set to False for the rest of the process after any failure
+_server_available = None
+
+
+# --- 2. CLIENT ---
+
+def server_available(settings: Optional[dict] = None) -> bool:
+    """
+    Whether a retrieval server answers on RETRIEVAL_SERVER_URL (checked once per process).
+    With `settings` (pipelines.retrieval_settings() of the caller), a server whose /health
+    reports different ones is not used: results would silently come from another index
+    directory, quantization or cascade configuration than the caller's environment asks for.
+    """
+    global _server_available
+    if _server_available is None:
+        if RETRIEVAL_SERVER_URL == "off":
+            _server_available = False
+        else:
+            try:
+                response = requests.get(f"{RETRIEVAL_SERVER_URL}/health", timeout=HEALTH_TIMEOUT_S)
+                _server_available = response.ok
+                server_settings = (response.json().get("settings") or {}) if response.ok else {}
+            except (requests.RequestException, ValueError):
+                _server_available = False
+            if _server_available and settings is not None:
+                differences = {key: {"server": server_settings.get(key), "here": value}
+                               for key, value in settings.items() if server_settings.get(key) != value}
+                if differences:
+                    print(f"Warning: the retrieval server at {RETRIEVAL_SERVER_URL} runs with different settings "
+                          f"{differences}; retrieving in-process instead.")
+                    _server_available = False
+            if _server_available:
+                print(f"--- Using the retrieval server at {RETRIEVAL_SERVER_URL} ---")
+    return _server_available
+
+
+def remote_retrieve(query: str, kinds: list, top_k: int, entity_partitions=None, settings: Optional[dict] = None):
+    """
+    Vector retrieval on the server: returns {kind: [{"name", "uri", "score"}]}, or None if
+    the server is not reachable or runs with other `settings` (callers then retrieve
+    in-process). `entity_partitions` restricts the entity search to those partitions
+    (see entity_partitions.py).
+    """
+    global _server_available
+    if not server_available(settings):
+        return None
+    try:
+        response = requests.post(f"{RETRIEVAL_SERVER_URL}/retrieve", json={"query": query, "kinds": kinds, "top_k": top_k,
+                                                                            "entity_partitions": entity_partitions},
+                                 timeout=REQUEST_TIMEOUT_S)
+        response.raise_for_status()
+        return response.json()["results"]
+    except (requests.RequestException, ValueError, KeyError) as e:
+        print(f"Warning: retrieval server request failed ({e}); retrieving in-process from now on.")
+        _server_available = False
+        return None
@@ -0,0 +1,171 @@
+# retrieval_server.py
+
+import os
+import json
+import time
+import queue
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse
+
+# The server retrieves in-process; it must never forward to itself
+os.environ["RETRIEVAL_SERVER_URL"] = "off"
+from pipelines import get_retrieval_context, retrieval_settings, RETRIEVAL_TOP_K
+from flat_vector_store import partition_filters
+
+# --- 1. CONFIGURATION ---
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+# How long the batcher waits for more requests after the first one arrives
+BATCH_WINDOW_MS = 5
+# Most queries embedded in one forward pass
+MAX_BATCH_SIZE = 32
+
+
+# --- 2. MICRO-BATCHING ---
+
+class _Request:
+    def __init__(self, query, kinds, top_k, entity_partitions=None):
+        self.query, self.kinds, self.top_k = query, kinds, top_k
+        self.entity_partitions = tuple(sorted(entity_partitions)) if entity_partitions else None
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class RetrievalBatcher:
+    """
+    Collects concurrent requests for up to BATCH_WINDOW_MS (or MAX_BATCH_SIZE requests),
+    embeds their queries in one forward pass, and scores each against the requested
+    indexes with the shared query vectors. A single worker thread owns the model and
+    the retrievers, so request threads never run them concurrently.
+    """
+
+    def __init__(self, context, batch_window_ms=BATCH_WINDOW_MS, max_batch_size=MAX_BATCH_SIZE):
+        self.context = context
+        self.batch_window_s = batch_window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.pending = queue.Queue()
+        self.retrievers = {}   # (kind, top_k, entity partitions) -> retriever
+        self.stats = {"requests": 0, "batches": 0, "max_batch": 0}
+        threading.Thread(target=self._run, name="retrieval-batcher", daemon=True).start()
+
+    def submit(self, query, kinds, top_k, entity_partitions=None):
+        request = _Request(query, kinds, top_k, entity_partitions)
+        self.pending.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _retriever(self, kind, top_k, entity_partitions=None):
+        # Entity indexes built before partitions existed are searched whole
+        partitions = entity_partitions if kind == "entity" and getattr(self.context.entity_index.vector_store, "partitions", None) else None
+        if (kind, top_k, partitions) not in self.retrievers:
+            index = {"entity": self.context.entity_index, "class": self.context.class_index, "property": self.context.prop_index}[kind]
+            filters = partition_filters(partitions) if partitions else None
+            self.retrievers[(kind, top_k, partitions)] = index.as_retriever(similarity_top_k=top_k, filters=filters)
+        return self.retrievers[(kind, top_k, partitions)]
+
+    def _run(self):
+        while True:
+            batch = [self.pending.get()]
+            deadline = time.monotonic() + self.batch_window_s
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._serve(batch)
+
+    def _serve(self, batch):
+        try:
+            queries = list(dict.fromkeys(request.query for request in batch))
+            bundles = dict(zip(queries, self.context.context_retriever.embed_batch(queries)))
+        except Exception as e:
+            for request in batch:
+                request.error = e
+                request.done.set()
+            return
+        self.stats["requests"] += len(batch)
+        self.stats["batches"] += 1
+        self.stats["max_batch"] = max(self.stats["max_batch"], len(batch))
+        for request in batch:
+            try:
+                request.result = {
+                    kind: [{"name": n.metadata.get('name'), "uri": n.metadata.get('uri'), "score": n.score}
+                           for n in self._retriever(kind, request.top_k, request.entity_partitions).retrieve(bundles[request.query])]
+                    for kind in request.kinds
+                }
+            except Exception as e:
+                request.error = e
+            request.done.set()
+
+
+# --- 3. HTTP SERVER ---
+
+def make_handler(batcher):
+    class RetrievalHandler(BaseHTTPRequestHandler):
+        def _reply(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if urlparse(self.path).path == "/health":
+                # Clients compare the settings with their own and retrieve in-process on a mismatch
+                self._reply(200, {"status": "ok", "settings": retrieval_settings(), **batcher.stats})
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            if urlparse(self.path).path != "/retrieve":
+                self._reply(404, {"error": "not found"})
+                return
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                kinds = [kind for kind in request.get("kinds", ["entity", "class", "property"]) if kind in ("entity", "class", "property")]
+                results = batcher.submit(request["query"], kinds, int(request.get("top_k", RETRIEVAL_TOP_K)), request.get("entity_partitions"))
+            except (ValueError, KeyError) as e:
+                self._reply(400, {"error": f"bad request: {e}"})
+                return
+            except Exception as e:
+                self._reply(500, {"error": str(e)})
+                return
+            self._reply(200, {"results": results})
+
+        def log_message(self, format, *args):
+            pass  # One line per request would drown the batching statistics
+
+    return RetrievalHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve vector retrieval over localhost HTTP with the model and indexes kept warm.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--batch-window-ms", type=float, default=BATCH_WINDOW_MS, help="How long to wait for concurrent requests to batch together.")
+    parser.add_argument("--max-batch-size", type=int, default=MAX_BATCH_SIZE)
+    args = parser.parse_args()
+
+    batcher = RetrievalBatcher(get_retrieval_context(), args.batch_window_ms, args.max_batch_size)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(batcher))
+    print(f"Retrieval server listening on http://{args.host}:{args.port} (batch window {args.batch_window_ms} ms, max batch {args.max_batch_size}).")
+    print(f"Clients use it when RETRIEVAL_SERVER_URL points here (default http://{DEFAULT_HOST}:{DEFAULT_PORT}).")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\nShutting down. {batcher.stats}")
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
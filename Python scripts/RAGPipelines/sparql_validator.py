@@ -0,0 +1,129 @@
+# sparql_validator.py
+
+import os
+import re
+import json
+from functools import lru_cache
+from rdflib import URIRef
+from rdflib.paths import Path
+from rdflib.plugins.sparql.parser import parseQuery
+from rdflib.plugins.sparql.algebra import translateQuery
+from rdflib.plugins.sparql.parserutils import CompValue
+
+from sparql_canonical import KNOWN_PREFIXES
+
+# --- 1. CONFIGURATION ---
+
+# Written by IndexCreation/build_indices.py: every witcher:/dbr: URI that exists in the KG
+TERM_DICTIONARY_PATH = "./storage/term_dictionary.json"
+# Only URIs in our own namespaces are checked; external vocabularies (rdfs:, geo:, ...) are not
+CHECKED_URI_PREFIX = "http://cgi.di.uoa.gr/witcher/"
+# Cap on how many undefined URIs are echoed back to the agent
+MAX_REPORTED_URIS = 5
+
+_IRI_OR_STRING = re.compile(r'<[^<>"\s]*>|"""[\s\S]*?"""|\'\'\'[\s\S]*?\'\'\'|"(?:[^"\\\n]|\\.)*"|\'(?:[^\'\\\n]|\\.)*\'')
+_COMMENT = re.compile(r'#[^\n]*')
+_PREFIXED_NAME = re.compile(r'(?<![\w?$:])([A-Za-z][\w\-]*)?:(?=[\w])')
+
+_term_dictionary = None
+
+
+# --- 2. HELPER FUNCTIONS ---
+
+def load_term_dictionary(path: str = TERM_DICTIONARY_PATH):
+    """Loads the persisted set of known URIs once. Returns None (URI check disabled) if missing."""
+    global _term_dictionary
+    if _term_dictionary is None:
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                _term_dictionary = frozenset(json.load(f))
+        else:
+            _term_dictionary = frozenset()
+    return _term_dictionary or None
+
+
+def _find_unknown_prefixes(query: str) -> list:
+    """Finds prefixed names whose prefix is neither declared in the query nor a known prefix."""
+    # Mask IRIs and literals so their colons are not mistaken for prefixed names
+    masked = _IRI_OR_STRING.sub(lambda m: '<>' if m.group(0).startswith('<') else '""', query)
+    masked = _COMMENT.sub('', masked)
+
+    declared = set(KNOWN_PREFIXES)
+    for match in re.finditer(r'PREFIX\s+([A-Za-z][\w\-.]*)?:', masked, re.IGNORECASE):
+        declared.add(match.group(1) or "")
+
+    # Declarations themselves never match: after masking they read `PREFIX p: <>`
+    unknown = []
+    for match in _PREFIXED_NAME.finditer(masked):
+        prefix = match.group(1) or ""
+        if prefix not in declared and prefix not in unknown:
+            unknown.append(prefix)
+    return unknown
+
+
+def _collect_uris(node, out: set):
+    """Collects every URIRef in an algebra tree, including the ones inside property paths."""
+    if isinstance(node, URIRef):
+        out.add(str(node))
+    elif isinstance(node, Path):
+        for attr in ("args", "arg", "path"):
+            value = getattr(node, attr, None)
+            if isinstance(value, list):
+                for item in value:
+                    _collect_uris(item, out)
+            elif value is not None:
+                _collect_uris(value, out)
+    elif isinstance(node, CompValue):
+        for key, value in node.items():
+            # rdflib stores the translated pattern of (NOT) EXISTS as an attribute, shadowing the raw key
+            _collect_uris(vars(node).get(key, value), out)
+    elif isinstance(node, (list, tuple, set, frozenset)):
+        for item in node:
+            _collect_uris(item, out)
+
+
+@lru_cache(maxsize=4096)
+def _validate(query: str, check_uris: bool) -> tuple:
+    """Returns a tuple of (error_type, message) pairs; empty when the query looks executable."""
+    unknown_prefixes = _find_unknown_prefixes(query)
+    if unknown_prefixes:
+        names = ", ".join(f"'{p}:'" for p in unknown_prefixes)
+        return (("UNKNOWN_PREFIX", f"Undeclared prefix(es) {names}. Known prefixes: {', '.join(sorted(KNOWN_PREFIXES))}."),)
+
+    try:
+        algebra = translateQuery(parseQuery(query), initNs=KNOWN_PREFIXES).algebra
+    except Exception as e:
+        return (("SYNTAX_ERROR", f"Query failed to parse: {e}"),)
+
+    term_dictionary = load_term_dictionary() if check_uris else None
+    if term_dictionary:
+        uris = set()
+        _collect_uris(algebra, uris)
+        undefined = sorted(u for u in uris if u.startswith(CHECKED_URI_PREFIX) and u not in term_dictionary)
+        if undefined:
+            shown = ", ".join(f"<{u}>" for u in undefined[:MAX_REPORTED_URIS])
+            more = f" (and {len(undefined) - MAX_REPORTED_URIS} more)" if len(undefined) > MAX_REPORTED_URIS else ""
+            return (("UNDEFINED_URI", f"URI(s) not found in the knowledge graph: {shown}{more}. Use the search tools to find valid URIs."),)
+    return ()
+
+
+# --- 3. VALIDATOR ---
+
+def validate_sparql(query: str, check_uris: bool = True):
+    """
+    Local pre-flight check run before a query is sent to the endpoint: unknown prefixes,
+    rdflib SPARQL parse errors, and (if check_uris) witcher:/dbr: URIs missing from the
+    term dictionary. The evaluator disables the URI check, since a query over a missing
+    URI is still a valid query with an empty answer.
+    Returns None for a valid query, otherwise a dict in the same shape the agent already
+    receives from execute_sparql_for_agent:
+        {"status": "EXECUTION_ERROR", "reason": "...", "errors": [{"type": ..., "message": ...}]}
+    """
+    errors = _validate(query or "", check_uris)
+    if not errors:
+        return None
+    return {
+        "status": "EXECUTION_ERROR",
+        "reason": " ".join(f"{error_type}: {message}" for error_type, message in errors),
+        "errors": [{"type": error_type, "message": message} for error_type, message in errors],
+    }
@@ -0,0 +1,315 @@
+# spatial_rewriter.py
+
+import os
+import re
+import json
+import time
+from collections import defaultdict
+from rdflib import URIRef, Variable
+from rdflib.paths import SequencePath
+from rdflib.plugins.sparql.parser import parseQuery
+from rdflib.plugins.sparql.algebra import translateQuery
+from rdflib.plugins.sparql.parserutils import CompValue
+
+from sparql_canonical import KNOWN_PREFIXES, query_fingerprint
+
+# --- 1. CONFIGURATION ---
+
+# Written by KG/materialize_spatial_relations.py to <repo>/RDF (resolved from this file, not the working directory)
+SPATIAL_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "RDF", "spatial_index.json")
+# Where "compare" mode appends one JSON line per rewritten query
+COMPARISON_LOG_PATH = "spatial_pushdown_comparison.jsonl"
+# "off": execute as-is, "on": execute the rewritten query, "compare": run both and log latencies
+PUSHDOWN_MODES = ("off", "on", "compare")
+# A VALUES block larger than this costs more to ship and join than the filter it replaces
+MAX_VALUES_CANDIDATES = 500
+
+GEO_HAS_GEOMETRY = URIRef(KNOWN_PREFIXES["geo"] + "hasGeometry")
+GEO_AS_WKT = URIRef(KNOWN_PREFIXES["geo"] + "asWKT")
+
+_FILTER_START = re.compile(r'FILTER\s*\(', re.IGNORECASE)
+_SPATIAL_CALL = re.compile(
+    r'^\s*(?:geof:|<' + re.escape(KNOWN_PREFIXES["geof"]) + r')(sfWithin|sfIntersects)>?'
+    r'\s*\(\s*\?(\w+)\s*,\s*\?(\w+)\s*\)\s*$'
+)
+
+_spatial_index = None
+# Whether the repository holds the materialized relation (None = not asked yet)
+_relation_loaded = None
+
+
+# --- 2. HELPER FUNCTIONS ---
+
+def load_spatial_index(path: str = SPATIAL_INDEX_PATH) -> dict:
+    """Loads the bounding-box index once; an empty index disables every rewrite."""
+    global _spatial_index
+    if _spatial_index is None:
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                _spatial_index = json.load(f)
+            _spatial_index["materialized_containers"] = set(_spatial_index.get("materialized_containers", []))
+        else:
+            print(f"Warning: spatial index not found at {path}. Run KG/materialize_spatial_relations.py; spatial pushdown is disabled.")
+            _spatial_index = {}
+    return _spatial_index
+
+
+def _geometry_subjects(node, direct=None, has_geometry=None, as_wkt=None):
+    """
+    Walks the query algebra and maps every WKT variable to the terms it is the geometry of,
+    for both `?x geo:hasGeometry/geo:asWKT ?w` and the two-triple `?x geo:hasGeometry ?g . ?g geo:asWKT ?w`.
+    """
+    top = direct is None
+    if top:
+        direct, has_geometry, as_wkt = defaultdict(set), defaultdict(set), defaultdict(set)
+
+    if isinstance(node, CompValue):
+        if node.name == "BGP":
+            for s, p, o in node["triples"]:
+                if not isinstance(o, Variable):
+                    continue
+                if isinstance(p, SequencePath) and list(p.args) == [GEO_HAS_GEOMETRY, GEO_AS_WKT]:
+                    direct[str(o)].add(s)
+                elif p == GEO_HAS_GEOMETRY:
+                    has_geometry[str(o)].add(s)
+                elif p == GEO_AS_WKT and isinstance(s, Variable):
+                    as_wkt[str(o)].add(str(s))
+        for key, value in node.items():
+            # rdflib stores the translated pattern of (NOT) EXISTS as an attribute, shadowing the raw key
+            _geometry_subjects(vars(node).get(key, value), direct, has_geometry, as_wkt)
+    elif isinstance(node, (list, tuple)):
+        for value in node:
+            _geometry_subjects(value, direct, has_geometry, as_wkt)
+
+    if top:
+        for wkt_var, geometry_vars in as_wkt.items():
+            for geometry_var in geometry_vars:
+                direct[wkt_var].update(has_geometry.get(geometry_var, ()))
+        return direct
+
+
+def _closing_paren(text: str, open_idx: int) -> int:
+    """Returns the index of the parenthesis closing the one at open_idx, skipping string literals."""
+    depth, i, quote = 0, open_idx, None
+    while i < len(text):
+        ch = text[i]
+        if quote:
+            if ch == '\\':
+                i += 1
+            elif ch == quote:
+                quote = None
+        elif ch in ('"', "'"):
+            quote = ch
+        elif ch == '(':
+            depth += 1
+        elif ch == ')':
+            depth -= 1
+            if depth == 0:
+                return i
+        i += 1
+    return -1
+
+
+def _split_conjuncts(expression: str) -> list:
+    """Splits a FILTER expression on top-level `&&`."""
+    parts, depth, start = [], 0, 0
+    for i, ch in enumerate(expression):
+        if ch == '(':
+            depth += 1
+        elif ch == ')':
+            depth -= 1
+        elif depth == 0 and expression.startswith('&&', i):
+            parts.append(expression[start:i])
+            start = i + 2
+    parts.append(expression[start:])
+    return parts
+
+
+def _bbox_candidates(function_name: str, fixed_bbox, fixed_is_container: bool, bboxes: dict) -> set:
+    """
+    Features whose envelope is compatible with the relation to the fixed geometry.
+    Within(a, b) implies envelope(a) inside envelope(b); Intersects implies overlapping envelopes.
+    """
+    fx0, fy0, fx1, fy1 = fixed_bbox
+    candidates = set()
+    for uri, (x0, y0, x1, y1) in bboxes.items():
+        if function_name == "sfIntersects":
+            ok = x0 <= fx1 and fx0 <= x1 and y0 <= fy1 and fy0 <= y1
+        elif fixed_is_container:
+            ok = fx0 <= x0 and x1 <= fx1 and fy0 <= y0 and y1 <= fy1
+        else:
+            ok = x0 <= fx0 and fx1 <= x1 and y0 <= fy0 and fy1 <= y1
+        if ok:
+            candidates.add(uri)
+    return candidates
+
+
+def _single(terms):
+    return next(iter(terms)) if terms and len(terms) == 1 else None
+
+
+# --- 3. REWRITER ---
+
+def rewrite_spatial_filters(query: str, spatial_index: dict = None):
+    """
+    Recognizes `FILTER(geof:sfWithin(?w, ?poly))` / `geof:sfIntersects` filters over
+    geo:hasGeometry/geo:asWKT bindings and adds a selective pattern next to each one:
+      - a lookup of the precomputed witcher:sfWithinMaterialized triples when the container
+        is a constant whose relations were materialized, or
+      - a VALUES block of the features whose bounding box is compatible with the constant side.
+    The original FILTER is always kept, and both additions are supersets of the true answer,
+    so the rewritten query returns exactly the same rows. Only FILTERs that are plain
+    conjunctions of such calls are touched.
+    Returns (rewritten_query, list_of_applied_rewrites).
+    """
+    spatial_index = load_spatial_index() if spatial_index is None else spatial_index
+    if not spatial_index or not query or ("geof:sf" not in query and KNOWN_PREFIXES["geof"] not in query):
+        return query, []
+
+    try:
+        algebra = translateQuery(parseQuery(query), initNs=KNOWN_PREFIXES).algebra
+    except Exception:
+        return query, []
+    geometry_subjects = _geometry_subjects(algebra)
+
+    relation = spatial_index.get("within_relation")
+    containers = spatial_index.get("materialized_containers", set())
+    bboxes = spatial_index.get("bboxes", {})
+
+    insertions = []  # (position, text)
+    applied = []
+    for match in _FILTER_START.finditer(query):
+        open_idx = match.end() - 1
+        close_idx = _closing_paren(query, open_idx)
+        if close_idx == -1:
+            continue
+        calls = [_SPATIAL_CALL.match(part) for part in _split_conjuncts(query[open_idx + 1:close_idx])]
+        if not all(calls):
+            continue
+
+        patterns = []
+        candidates_by_var = {}
+        for call in calls:
+            function_name, a_var, b_var = call.groups()
+            a_term = _single(geometry_subjects.get(a_var))
+            b_term = _single(geometry_subjects.get(b_var))
+            if a_term is None or b_term is None:
+                continue
+
+            if function_name == "sfWithin" and isinstance(b_term, URIRef) and str(b_term) in containers:
+                patterns.append(f"{a_term.n3()} <{relation}> {b_term.n3()} .")
+                applied.append(f"materialized sfWithin {a_term.n3()} -> {b_term.n3()}")
+                continue
+
+            if isinstance(a_term, Variable) and isinstance(b_term, URIRef) and str(b_term) in bboxes:
+                free_var, fixed, fixed_is_container = a_term, b_term, True
+            elif isinstance(b_term, Variable) and isinstance(a_term, URIRef) and str(a_term) in bboxes:
+                free_var, fixed, fixed_is_container = b_term, a_term, False
+            else:
+                continue
+            candidates = _bbox_candidates(function_name, bboxes[str(fixed)], fixed_is_container, bboxes)
+            key = str(free_var)
+            candidates_by_var[key] = candidates if key not in candidates_by_var else candidates_by_var[key] & candidates
+
+        for var_name, candidates in candidates_by_var.items():
+            if len(candidates) > MAX_VALUES_CANDIDATES:
+                continue
+            values = " ".join(f"<{uri}>" for uri in sorted(candidates))
+            patterns.append(f"VALUES ?{var_name} {{ {values} }}")
+            applied.append(f"bbox VALUES ?{var_name} ({len(candidates)} candidates)")
+
+        if patterns:
+            # Inserted after the FILTER: a triples block / VALUES may always follow a Filter
+            insertions.append((close_idx + 1, " " + " ".join(patterns) + " "))
+
+    if not insertions:
+        return query, []
+
+    rewritten = query
+    for position, text in sorted(insertions, reverse=True):
+        rewritten = rewritten[:position] + text + rewritten[position:]
+
+    try:
+        parseQuery(rewritten)
+    except Exception:
+        return query, []
+    return rewritten, applied
+
+
+# --- 4. EXECUTION WRAPPER ---
+
+def materialized_relation_loaded(execute, spatial_index: dict) -> bool:
+    """
+    Whether the repository holds any materialized sfWithin triple (ASKed once per process).
+    Without RDF/SpatialRelations.n3 loaded, a materialized pattern matches nothing and the
+    rewritten query would return 0 rows without raising.
+    """
+    global _relation_loaded
+    if _relation_loaded is None:
+        relation = spatial_index.get("within_relation")
+        try:
+            _relation_loaded = bool(relation) and bool(execute(f"ASK {{ ?feature <{relation}> ?container }}").get("boolean"))
+        except Exception:
+            _relation_loaded = False
+        if not _relation_loaded:
+            print(f"Warning: no <{relation}> triples in the repository (load RDF/SpatialRelations.n3); "
+                  f"spatial pushdown only adds bounding-box VALUES blocks.")
+    return _relation_loaded
+
+
+def _result_signature(results):
+    """Order-insensitive signature of a SPARQL JSON result, used to check that rewrites are exact."""
+    if not isinstance(results, dict):
+        return results
+    if "boolean" in results:
+        return results["boolean"]
+    bindings = results.get("results", {}).get("bindings", [])
+    return sorted(json.dumps(row, sort_keys=True) for row in bindings)
+
+
+def execute_with_pushdown(query: str, execute, mode: str = "off"):
+    """
+    Runs `execute(query)` under the requested pushdown mode:
+      - "off": the query is executed unchanged.
+      - "on": the rewritten query is executed (falls back to the original if it fails).
+    Materialized-relation rewrites are only applied once the relation is known to be loaded
+    (see materialized_relation_loaded); bounding-box VALUES rewrites need nothing in the repository.
+      - "compare": both are executed, their latencies and result equality are appended to
+        COMPARISON_LOG_PATH, and the ORIGINAL results are returned.
+    Note that rows under a LIMIT without ORDER BY may legitimately differ between the two runs.
+    """
+    if mode not in PUSHDOWN_MODES:
+        raise ValueError(f"Unknown spatial pushdown mode '{mode}'. Expected one of {PUSHDOWN_MODES}.")
+    if mode == "off":
+        return execute(query)
+
+    spatial_index = load_spatial_index()
+    rewritten, applied = rewrite_spatial_filters(query, spatial_index)
+    if any(rewrite.startswith("materialized") for rewrite in applied) and not materialized_relation_loaded(execute, spatial_index):
+        rewritten, applied = rewrite_spatial_filters(query, {**spatial_index, "materialized_containers": set()})
+    if not applied:
+        return execute(query)
+
+    if mode == "on":
+        try:
+            return execute(rewritten)
+        except Exception:
+            return execute(query)
+
+    start = time.perf_counter()
+    original_results = execute(query)
+    original_ms = (time.perf_counter() - start) * 1000
+
+    entry = {"fingerprint": query_fingerprint(query), "rewrites": applied, "original_ms": round(original_ms, 2)}
+    start = time.perf_counter()
+    try:
+        rewritten_results = execute(rewritten)
+        entry["rewritten_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        entry["speedup"] = round(original_ms / entry["rewritten_ms"], 2) if entry["rewritten_ms"] > 0 else None
+        entry["results_match"] = _result_signature(original_results) == _result_signature(rewritten_results)
+    except Exception as e:
+        entry["rewritten_error"] = str(e)
+
+    with open(COMPARISON_LOG_PATH, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(entry) + "\n")
+    return original_results
@@ -7,7 +7,7 @@ from SPARQLWrapper import SPARQLWrapper, JSON
 import time
 
 # Import your final, definitive pipeline class
-from pipelines import ExecutionGuidedAgent
+from pipelines import ExecutionGuidedAgent, preload_retrieval_context
 
 # --- 1. SETUP & HELPER FUNCTIONS ---
 
@@ -206,6 +206,8 @@ def main():
     parser = argparse.ArgumentParser(description="Test and evaluate the Execution-Guided Agent.")
     parser.add_argument("--api-key", required=True, help="Your DeepSeek API key.")
     args = parser.parse_args()
+    # Load the embedding model and indexes in the background while the rest of the set-up runs
+    preload_retrieval_context()
 
     print("Initializing pipeline...")
     pipeline_c = ExecutionGuidedAgent(api_key=args.api_key)
@@ -8,7 +8,7 @@ from tqdm import tqdm
 from SPARQLWrapper import SPARQLWrapper, JSON
 
 # Import your final, definitive pipeline class
-from pipelines import ExecutionGuidedAgent
+from pipelines import ExecutionGuidedAgent, preload_retrieval_context
 
 # --- 1. TEST CASES ---
 # Add the specific, challenging queries you want to analyze, including their ground truth.
@@ -382,6 +382,8 @@ def main():
     parser = argparse.ArgumentParser(description="Analyze Agent performance (time and accuracy) across different max_steps values.")
     parser.add_argument("--api-key", required=True, help="Your DeepSeek API key.")
     args = parser.parse_args()
+    # Load the embedding model and indexes in the background while the rest of the set-up runs
+    preload_retrieval_context()
 
     print("Initializing pipeline... (This may take a moment)")
     pipeline_c = ExecutionGuidedAgent(api_key=args.api_key)
@@ -0,0 +1,85 @@
+# cascade_retriever.py
+import numpy as np
+from typing import List, Optional
+from llama_index.core import Settings
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+
+from flat_vector_store import FlatVectorStore, load_vector_index
+from incremental_index import load_manifest
+from embedding_cache import with_embedding_cache
+from embedding_backend import load_embed_model
+
+# --- 1. CONFIGURATION ---
+# Small, fast model behind the first stage (build_indices.py --cascade-model)
+CASCADE_MODEL_NAME = "BAAI/bge-small-en-v1.5"
+# Entity index embedded with the small model, next to ./storage/entity_index
+CASCADE_INDEX_DIR = "./storage/entity_index_small"
+# Candidates the small model hands to the large model for rescoring
+SHORTLIST_SIZE = 100
+
+
+# --- 2. CASCADE RETRIEVER ---
+class CascadeRetriever(BaseRetriever):
+    """
+    Two-stage entity retrieval. The small model embeds the query and ranks its own flat
+    index; only the best shortlist_size rows are rescored exactly with one large-model query
+    embedding against the large index's stored document vectors. With decisive_margin set,
+    the large model is skipped altogether when the small model's top-1 score beats its
+    top-2 by at least that margin. Both indexes must be flat and built from the same
+    documents; rows are matched on (document id, chunk text).
+    A query bundle that already carries a large-model embedding is rescored with it, and one
+    computed here is stored on the bundle, so callers can reuse it for the other indexes.
+    """
+
+    def __init__(self, small_index, large_index, small_embed_model, large_embed_model=None, similarity_top_k: int = 5,
+                 shortlist_size: int = SHORTLIST_SIZE, decisive_margin: Optional[float] = None):
+        self.small_store = small_index.vector_store
+        self.large_store = large_index.vector_store
+        if not isinstance(self.small_store, FlatVectorStore) or not isinstance(self.large_store, FlatVectorStore):
+            raise ValueError("CascadeRetriever needs both indexes in the flat store format.")
+        self.small_embed_model = small_embed_model
+        self.large_embed_model = large_embed_model or Settings.embed_model
+        self.similarity_top_k = similarity_top_k
+        self.shortlist_size = shortlist_size
+        self.decisive_margin = decisive_margin
+        self.stats = {"queries": 0, "large_model_skipped": 0, "unmatched_rows": 0}
+
+        large_rows = {key: row for row, key in enumerate(self.large_store.row_keys())}
+        self.small_to_large = np.array([large_rows.get(key, -1) for key in self.small_store.row_keys()], dtype=np.int64)
+        self.stats["unmatched_rows"] = int((self.small_to_large < 0).sum())
+        if self.stats["unmatched_rows"]:
+            print(f"Warning: {self.stats['unmatched_rows']} rows of the small-model index are not in the large index; "
+                  f"rebuild both with build_indices.py.")
+        super().__init__()
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        self.stats["queries"] += 1
+        small_q = self.small_embed_model.get_query_embedding(query_bundle.query_str)
+        rows, scores = self.small_store.batch_query([small_q], max(self.shortlist_size, self.similarity_top_k))
+        rows, scores = rows[0], scores[0]
+
+        if self.decisive_margin is not None and (len(scores) < 2 or scores[0] - scores[1] >= self.decisive_margin):
+            self.stats["large_model_skipped"] += 1
+            return [NodeWithScore(node=self.small_store.row_node(int(row)), score=float(score))
+                    for row, score in zip(rows[:self.similarity_top_k], scores[:self.similarity_top_k])]
+
+        shortlist = self.small_to_large[rows]
+        shortlist = shortlist[shortlist >= 0]
+        if query_bundle.embedding is None:
+            query_bundle.embedding = self.large_embed_model.get_query_embedding(query_bundle.query_str)
+        large_scores = self.large_store.score_rows(query_bundle.embedding, shortlist)
+        top = np.argsort(-large_scores, kind="stable")[:self.similarity_top_k]
+        return [NodeWithScore(node=self.large_store.row_node(int(shortlist[i])), score=float(large_scores[i])) for i in top]
+
+
+def load_cascade_retriever(large_index, similarity_top_k: int = 5, persist_dir: str = CASCADE_INDEX_DIR,
+                           shortlist_size: int = SHORTLIST_SIZE, decisive_margin: Optional[float] = None) -> CascadeRetriever:
+    """Loads the small-model index and its model (the one recorded in the index manifest) around `large_index`."""
+    manifest = load_manifest(persist_dir)
+    if manifest is None:
+        raise FileNotFoundError(f"No small-model index in {persist_dir}. Run 'build_indices.py --cascade-model {CASCADE_MODEL_NAME}' first.")
+    small_embed_model = with_embedding_cache(load_embed_model(manifest.get("model") or CASCADE_MODEL_NAME))
+    small_index = load_vector_index(persist_dir, index_type="exact")
+    return CascadeRetriever(small_index, large_index, small_embed_model, similarity_top_k=similarity_top_k,
+                            shortlist_size=shortlist_size, decisive_margin=decisive_margin)
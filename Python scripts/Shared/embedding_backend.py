@@ -0,0 +1,272 @@
+# embedding_backend.py
+import os
+import json
+import numpy as np
+from typing import Any, List, Optional
+from pydantic import PrivateAttr
+from llama_index.core.base.embeddings.base import BaseEmbedding
+
+# --- 1. CONFIGURATION ---
+# "torch": HuggingFaceEmbedding (sentence-transformers); "onnx": ONNX Runtime; "onnx-int8": ONNX Runtime
+# with dynamically int8-quantized weights. Needs `pip install onnxruntime` for the onnx backends.
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "torch")
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx-int8")
+# Exported models, one directory per model name (relative to the "Python scripts" directory)
+ONNX_MODEL_DIR = "./storage/onnx_models"
+# ONNX Runtime intra-op threads (0 = one per physical core, ONNX Runtime's default)
+ONNX_THREADS = int(os.environ.get("ONNX_THREADS", "0"))
+ONNX_FILENAME = "model.onnx"
+ONNX_INT8_FILENAME = "model_int8.onnx"
+EXPORT_INFO_FILENAME = "export.json"
+MAX_SEQUENCE_LENGTH = 512
+# sentence-transformers Pooling config flags the ONNX backends reproduce ([CLS] for BGE, mean for MiniLM-class models)
+POOLING_MODES = {"pooling_mode_cls_token": "cls", "pooling_mode_mean_tokens": "mean"}
+
+
+# --- 2. EXPORT ---
+def onnx_model_dir(model_name: str) -> str:
+    return os.path.join(ONNX_MODEL_DIR, model_name.replace("/", "__"))
+
+
+def export_onnx_model(model_name: str, quantize: bool = False) -> str:
+    """
+    Exports the transformer behind `model_name` to ONNX once (dynamic batch and sequence
+    axes) next to its tokenizer, plus a dynamically int8-quantized copy if requested.
+    Returns the path of the requested .onnx file; existing exports are reused.
+    """
+    output_dir = onnx_model_dir(model_name)
+    fp32_path = os.path.join(output_dir, ONNX_FILENAME)
+    int8_path = os.path.join(output_dir, ONNX_INT8_FILENAME)
+    if not os.path.exists(fp32_path):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        print(f"--- Exporting {model_name} to ONNX ({output_dir}) ---")
+        os.makedirs(output_dir, exist_ok=True)
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModel.from_pretrained(model_name).eval()
+        sample = tokenizer(["An example sentence for tracing the model."], return_tensors="pt")
+        input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]}
+        with torch.no_grad():
+            torch.onnx.export(model, tuple(sample[name] for name in input_names), fp32_path, input_names=input_names,
+                              output_names=["last_hidden_state"], dynamic_axes=dynamic_axes, opset_version=17)
+        tokenizer.save_pretrained(output_dir)
+        with open(os.path.join(output_dir, EXPORT_INFO_FILENAME), 'w', encoding='utf-8') as f:
+            json.dump({"model_name": model_name, "inputs": input_names}, f)
+    if quantize and not os.path.exists(int8_path):
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        print(f"--- Quantizing {fp32_path} to int8 ---")
+        quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    return int8_path if quantize else fp32_path
+
+
+def _model_file(model_name: str, filename: str) -> Optional[str]:
+    """Local path of a file of the model (a directory or a Hugging Face Hub repo), or None if it has none."""
+    if os.path.isdir(model_name):
+        path = os.path.join(model_name, filename)
+        return path if os.path.exists(path) else None
+    from huggingface_hub import hf_hub_download
+    from huggingface_hub.utils import EntryNotFoundError
+    try:
+        return hf_hub_download(model_name, filename)
+    except EntryNotFoundError:
+        return None
+
+
+def read_pooling_mode(model_name: str) -> str:
+    """
+    The pooling sentence-transformers applies to `model_name`, from the config of the
+    model's Pooling module (usually 1_Pooling/config.json). A plain transformers model
+    without modules.json gets mean pooling, as in sentence-transformers. Raises for
+    poolings the ONNX backends do not implement.
+    """
+    modules_path = _model_file(model_name, "modules.json")
+    if modules_path is None:
+        return "mean"
+    with open(modules_path, 'r', encoding='utf-8') as f:
+        modules = json.load(f)
+    pooling_module = next((module for module in modules if module["type"].endswith(".Pooling")), None)
+    config_path = pooling_module and _model_file(model_name, f"{pooling_module['path']}/config.json".lstrip("/"))
+    if config_path is None:
+        return "mean"
+    with open(config_path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    enabled = [key for key, value in config.items() if key.startswith("pooling_mode_") and value is True]
+    if len(enabled) != 1 or enabled[0] not in POOLING_MODES:
+        raise ValueError(f"{model_name} uses pooling {enabled}; the ONNX backends support one of {list(POOLING_MODES)}. "
+                         f"Use EMBEDDING_BACKEND=torch for this model.")
+    return POOLING_MODES[enabled[0]]
+
+
+def onnx_pooling_mode(model_name: str) -> str:
+    """The pooling of an exported model, recorded in its export.json (added to exports that predate it)."""
+    info_path = os.path.join(onnx_model_dir(model_name), EXPORT_INFO_FILENAME)
+    with open(info_path, 'r', encoding='utf-8') as f:
+        info = json.load(f)
+    if "pooling" not in info:
+        info["pooling"] = read_pooling_mode(model_name)
+        with open(info_path, 'w', encoding='utf-8') as f:
+            json.dump(info, f)
+    return info["pooling"]
+
+
+# --- 3. ONNX RUNTIME EMBEDDING ---
+class OnnxEmbedding(BaseEmbedding):
+    """
+    The same embeddings as HuggingFaceEmbedding (query instruction prefix, the model's
+    sentence-transformers pooling, L2 normalization), computed with ONNX Runtime instead
+    of PyTorch. [CLS] pooling (the BGE family) and mean pooling (MiniLM-class models such
+    as the cascade's small model) are supported; other poolings raise on load (see
+    read_pooling_mode). The model is exported on first use (see export_onnx_model). The session runs with a fixed intra-op thread pool and spinning
+    disabled, so idle threads do not burn CPU between the agent's sporadic search calls.
+    """
+
+    quantized: bool = False
+    pooling: str = "cls"
+    normalize: bool = True
+    max_length: int = MAX_SEQUENCE_LENGTH
+
+    _session: Any = PrivateAttr()
+    _tokenizer: Any = PrivateAttr()
+    _input_names: List[str] = PrivateAttr()
+    _query_instruction: str = PrivateAttr()
+    _text_instruction: str = PrivateAttr()
+
+    def __init__(self, model_name: str, quantized: bool = False, num_threads: Optional[int] = None,
+                 embed_batch_size: int = 32, **kwargs: Any):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+        from llama_index.embeddings.huggingface.utils import get_query_instruct_for_model_name, get_text_instruct_for_model_name
+
+        super().__init__(model_name=model_name, quantized=quantized, embed_batch_size=embed_batch_size, **kwargs)
+        model_path = export_onnx_model(model_name, quantize=quantized)
+        self.pooling = onnx_pooling_mode(model_name)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = ONNX_THREADS if num_threads is None else num_threads
+        options.inter_op_num_threads = 1
+        options.add_session_config_entry("session.intra_op.allow_spinning", "0")
+        self._session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self._input_names = [i.name for i in self._session.get_inputs()]
+        self._tokenizer = AutoTokenizer.from_pretrained(onnx_model_dir(model_name))
+        self._query_instruction = get_query_instruct_for_model_name(model_name) or ""
+        self._text_instruction = get_text_instruct_for_model_name(model_name) or ""
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "OnnxEmbedding"
+
+    def _embed(self, sentences: List[str], prompt_name: str = "text") -> List[List[float]]:
+        """Same signature as HuggingFaceEmbedding._embed, so multi_index_retriever.embed_queries can batch queries."""
+        instruction = self._query_instruction if prompt_name == "query" else self._text_instruction
+        vectors = []
+        for start in range(0, len(sentences), self.embed_batch_size):
+            batch = [instruction + sentence for sentence in sentences[start:start + self.embed_batch_size]]
+            encoded = self._tokenizer(batch, padding=True, truncation=True, max_length=self.max_length, return_tensors="np")
+            vectors.extend(self._run(dict(encoded)).tolist())
+        return vectors
+
+    def _embed_ids(self, batch_ids: List[List[int]]) -> np.ndarray:
+        """Embeds already tokenized inputs (see embed_token_ids)."""
+        input_ids, attention_mask = pad_token_ids(batch_ids, self._tokenizer.pad_token_id)
+        inputs = {"input_ids": input_ids, "attention_mask": attention_mask, "token_type_ids": np.zeros_like(input_ids)}
+        return self._run(inputs)
+
+    def _run(self, inputs: dict) -> np.ndarray:
+        """Pooled (and normalized) vectors for tokenizer-style inputs; the session gets the inputs its graph declares."""
+        feed = {name: np.asarray(inputs[name]).astype(np.int64) for name in self._input_names}
+        hidden = self._session.run(["last_hidden_state"], feed)[0]
+        if self.pooling == "cls":
+            pooled = hidden[:, 0]
+        else:
+            # Mean over the real tokens only, as sentence-transformers' Pooling does
+            mask = inputs["attention_mask"].astype(np.float32)[:, :, None]
+            pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        if self.normalize:
+            pooled = pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+        return pooled.astype(np.float32)
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embed([query], prompt_name="query")[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._embed([text], prompt_name="text")[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts, prompt_name="text")
+
+
+# --- 4. FACTORY ---
+def load_embed_model(model_name: str, backend: Optional[str] = None, num_threads: Optional[int] = None,
+                     embed_batch_size: Optional[int] = None, device: Optional[str] = None) -> BaseEmbedding:
+    """
+    The embedding model for `model_name` on the configured backend (EMBEDDING_BACKEND).
+    Every script builds its models through here, so one flag switches indexing, evaluation
+    and the pipelines together. `num_threads` only applies to ONNX Runtime (PyTorch threads
+    are set by the caller); `device` only to PyTorch.
+    """
+    backend = backend or EMBEDDING_BACKEND
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unsupported embedding backend '{backend}'. Expected one of {EMBEDDING_BACKENDS}.")
+    batch_kwargs = {"embed_batch_size": embed_batch_size} if embed_batch_size else {}
+    if backend == "torch":
+        from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+        return HuggingFaceEmbedding(model_name=model_name, **({"device": device} if device else {}), **batch_kwargs)
+    return OnnxEmbedding(model_name, quantized=backend == "onnx-int8", num_threads=num_threads, **batch_kwargs)
+
+
+# --- 5. PRE-TOKENIZED INPUT ---
+def load_tokenizer(model_name: str, backend: Optional[str] = None):
+    """The tokenizer the model on `backend` uses (the exported copy for the ONNX backends)."""
+    from transformers import AutoTokenizer
+    if (backend or EMBEDDING_BACKEND) != "torch":
+        export_onnx_model(model_name)
+        return AutoTokenizer.from_pretrained(onnx_model_dir(model_name))
+    return AutoTokenizer.from_pretrained(model_name)
+
+
+def text_instruction(model_name: str) -> str:
+    """The prefix both backends put in front of document texts (empty for the BGE models)."""
+    from llama_index.embeddings.huggingface.utils import get_text_instruct_for_model_name
+    return get_text_instruct_for_model_name(model_name) or ""
+
+
+def pad_token_ids(batch_ids: List[List[int]], pad_id: int):
+    """Right-pads token id lists to the longest one: (input_ids, attention_mask) int64 arrays."""
+    width = max(len(ids) for ids in batch_ids)
+    input_ids = np.full((len(batch_ids), width), pad_id, dtype=np.int64)
+    attention_mask = np.zeros((len(batch_ids), width), dtype=np.int64)
+    for row, ids in enumerate(batch_ids):
+        input_ids[row, :len(ids)] = ids
+        attention_mask[row, :len(ids)] = 1
+    return input_ids, attention_mask
+
+
+def embed_token_ids(embed_model: BaseEmbedding, batch_ids: List[List[int]]) -> np.ndarray:
+    """
+    Document vectors for inputs that were tokenized beforehand (special tokens included,
+    at most the model's max length): one forward pass over the batch padded to its longest
+    input, with the same pooling and normalization as the model's own text embedding.
+    """
+    model = getattr(embed_model, "inner", embed_model)
+    if isinstance(model, OnnxEmbedding):
+        return model._embed_ids(batch_ids)
+    if model.class_name() != "HuggingFaceEmbedding":
+        raise ValueError(f"Cannot embed token ids with {model.class_name()}.")
+    import torch
+    sentence_transformer = model._model
+    input_ids, attention_mask = pad_token_ids(batch_ids, sentence_transformer.tokenizer.pad_token_id)
+    features = {"input_ids": torch.from_numpy(input_ids), "attention_mask": torch.from_numpy(attention_mask)}
+    if "token_type_ids" in sentence_transformer.tokenizer.model_input_names:
+        features["token_type_ids"] = torch.zeros_like(features["input_ids"])
+    features = {name: tensor.to(sentence_transformer.device) for name, tensor in features.items()}
+    with torch.no_grad():
+        vectors = sentence_transformer(features)["sentence_embedding"]
+    if model.normalize:
+        vectors = torch.nn.functional.normalize(vectors, p=2, dim=1)
+    return vectors.float().cpu().numpy()
@@ -0,0 +1,331 @@
+# embedding_cache.py
+import os
+import json
+import atexit
+import hashlib
+import numpy as np
+from contextlib import contextmanager
+from typing import Any, List
+from pydantic import PrivateAttr
+from llama_index.core.base.embeddings.base import BaseEmbedding
+
+from multi_index_retriever import embed_queries
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# --- 1. CONFIGURATION ---
+# Relative to the "Python scripts" directory, next to the indexes
+EMBEDDING_CACHE_DIR = os.environ.get("EMBEDDING_CACHE_DIR", "./storage/embedding_cache")
+# "off" makes with_embedding_cache() a no-op
+EMBEDDING_CACHE = os.environ.get("EMBEDDING_CACHE", "on")
+# Vectors kept per namespace (model x prompt x normalization); ~800 MB at 1024-d float32
+MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+# Fraction of a full namespace evicted (least recently used first) to make room
+EVICT_FRACTION = 0.1
+# The journal is folded into the index file after this many new vectors (and always at exit)
+FLUSH_EVERY = 1024
+INITIAL_CAPACITY = 1024
+
+VECTORS_FILENAME = "vectors.npy"
+INDEX_FILENAME = "index.json"
+JOURNAL_FILENAME = "journal.jsonl"
+LOCK_FILENAME = "cache.lock"
+
+
+def text_key(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+# --- 2. ON-DISK STORE ---
+def _file_stamp(path: str):
+    """Identity of a file's current contents (None if missing); os.replace gives a new inode."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+class CacheNamespace:
+    """
+    One memory-mapped (capacity, dim) float32 slab plus a JSON index mapping
+    sha256(text) -> [slot, last-use tick]. The slab doubles in size up to max_entries;
+    beyond that the least recently used slots are reused.
+
+    Several processes may share a directory (build_indices.py, evaluate_retrieval.py and
+    the retrieval server at the same time). Every read and write holds a lock on
+    cache.lock (shared for reads, exclusive for writes) and first catches up with the
+    other processes: a replaced index.json or vectors.npy is reloaded, and new
+    assignments and evictions are replayed from journal.jsonl, which writers append to
+    before releasing the lock. flush() folds the journal back into index.json.
+    """
+
+    def __init__(self, directory: str, namespace: str, max_entries: int = MAX_ENTRIES):
+        self.directory = directory
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.vectors = None
+        self.entries = {}
+        self.free = []
+        self.tick = 0
+        # Journal lines not yet folded into index.json, and local last-use ticks not yet written
+        self.unflushed = 0
+        self.dirty = False
+        self._index_stamp = None
+        self._vectors_stamp = None
+        self._journal_offset = 0
+        if os.path.isdir(directory):
+            with self._locked(shared=True):
+                self._refresh()
+
+    def _path(self, filename: str) -> str:
+        return os.path.join(self.directory, filename)
+
+    @contextmanager
+    def _locked(self, shared: bool = False):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path(LOCK_FILENAME), 'a+b') as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            else:
+                # msvcrt has no shared locks: readers are exclusive too on Windows
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _refresh(self) -> None:
+        """Catches up with writes by other processes. Call with the lock held."""
+        changed = False
+        index_stamp = _file_stamp(self._path(INDEX_FILENAME))
+        if index_stamp != self._index_stamp:
+            entries, tick = {}, 0
+            if index_stamp is not None:
+                with open(self._path(INDEX_FILENAME), 'r', encoding='utf-8') as f:
+                    index = json.load(f)
+                entries, tick = index["entries"], index["tick"]
+            # Keep this process's more recent last-use ticks for slots that did not change
+            for key, entry in entries.items():
+                local = self.entries.get(key)
+                if local is not None and local[0] == entry[0]:
+                    entry[1] = max(entry[1], local[1])
+            self.entries, self.tick = entries, max(self.tick, tick)
+            self._index_stamp, self._journal_offset, self.unflushed = index_stamp, 0, 0
+            changed = True
+
+        journal_path = self._path(JOURNAL_FILENAME)
+        if os.path.exists(journal_path):
+            with open(journal_path, 'rb') as f:
+                f.seek(self._journal_offset)
+                data = f.read()
+            # A line is only complete once its newline is written
+            data = data[:data.rfind(b"\n") + 1]
+            for line in data.splitlines():
+                key, slot, tick = json.loads(line)
+                if slot is None:
+                    self.entries.pop(key, None)
+                else:
+                    self.entries[key] = [slot, tick]
+                    self.tick = max(self.tick, tick)
+                self.unflushed += 1
+                changed = True
+            self._journal_offset += len(data)
+
+        vectors_stamp = _file_stamp(self._path(VECTORS_FILENAME))
+        if vectors_stamp != self._vectors_stamp:
+            self.vectors = None if vectors_stamp is None else np.load(self._path(VECTORS_FILENAME), mmap_mode='r+')
+            self._vectors_stamp = vectors_stamp
+            changed = True
+
+        if changed:
+            used = {slot for slot, _ in self.entries.values()}
+            capacity = 0 if self.vectors is None else self.vectors.shape[0]
+            self.free = sorted(set(range(capacity)) - used, reverse=True)
+
+    def get(self, keys: list) -> dict:
+        """key -> vector (float32 copy) for the keys present; marks them as recently used."""
+        found = {}
+        if not os.path.isdir(self.directory):
+            return found
+        with self._locked(shared=True):
+            self._refresh()
+            for key in keys:
+                entry = self.entries.get(key)
+                if entry is not None:
+                    self.tick += 1
+                    entry[1] = self.tick
+                    found[key] = np.array(self.vectors[entry[0]], dtype=np.float32)
+        self.dirty = self.dirty or bool(found)
+        return found
+
+    def put(self, keys: list, vectors) -> None:
+        with self._locked():
+            self._refresh()
+            journal = []
+            for key, vector in zip(keys, vectors):
+                if key in self.entries:
+                    continue
+                vector = np.asarray(vector, dtype=np.float32)
+                slot = self._allocate(vector.shape[0], journal)
+                self.vectors[slot] = vector
+                self.tick += 1
+                self.entries[key] = [slot, self.tick]
+                journal.append([key, slot, self.tick])
+            if journal:
+                # The vectors reach the file before the journal points other processes at them
+                self.vectors.flush()
+                with open(self._path(JOURNAL_FILENAME), 'ab') as f:
+                    f.write("".join(json.dumps(line) + "\n" for line in journal).encode("utf-8"))
+                    self._journal_offset = f.tell()
+                self.unflushed += len(journal)
+            if self.unflushed >= FLUSH_EVERY:
+                self._write_index()
+
+    def _allocate(self, dim: int, journal: list) -> int:
+        if self.vectors is None:
+            self._resize(min(INITIAL_CAPACITY, self.max_entries), dim)
+        if not self.free:
+            if self.vectors.shape[0] < self.max_entries:
+                self._resize(min(self.vectors.shape[0] * 2, self.max_entries), dim)
+            else:
+                self._evict(journal)
+        return self.free.pop()
+
+    def _resize(self, capacity: int, dim: int) -> None:
+        # Under the exclusive lock: other processes remap the new file on their next _refresh
+        path = self._path(VECTORS_FILENAME)
+        old_capacity = 0 if self.vectors is None else self.vectors.shape[0]
+        resized = np.lib.format.open_memmap(path + ".tmp", mode='w+', dtype=np.float32, shape=(capacity, dim))
+        if self.vectors is not None:
+            resized[:old_capacity] = self.vectors
+        resized.flush()
+        del resized
+        self.vectors = None
+        os.replace(path + ".tmp", path)
+        self.vectors = np.load(path, mmap_mode='r+')
+        self._vectors_stamp = _file_stamp(path)
+        self.free = sorted(set(self.free) | set(range(old_capacity, capacity)), reverse=True)
+
+    def _evict(self, journal: list) -> None:
+        count = max(1, int(self.max_entries * EVICT_FRACTION))
+        for key, (slot, _) in sorted(self.entries.items(), key=lambda item: item[1][1])[:count]:
+            del self.entries[key]
+            self.free.append(slot)
+            journal.append([key, None, None])
+        self.free.sort(reverse=True)
+
+    def _write_index(self) -> None:
+        """Rewrites index.json from the current entries and empties the journal. Call with the exclusive lock held."""
+        index_path = self._path(INDEX_FILENAME)
+        with open(index_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump({"namespace": self.namespace, "tick": self.tick, "entries": self.entries}, f)
+        os.replace(index_path + ".tmp", index_path)
+        if os.path.exists(self._path(JOURNAL_FILENAME)):
+            os.remove(self._path(JOURNAL_FILENAME))
+        self._index_stamp, self._journal_offset = _file_stamp(index_path), 0
+        self.unflushed, self.dirty = 0, False
+
+    def flush(self) -> None:
+        if not self.unflushed and not self.dirty or not os.path.isdir(self.directory):
+            return
+        with self._locked():
+            self._refresh()
+            if self.vectors is not None:
+                self._write_index()
+
+
+_namespaces = {}
+
+def get_namespace(namespace: str, cache_dir: str = EMBEDDING_CACHE_DIR, max_entries: int = MAX_ENTRIES) -> CacheNamespace:
+    """One CacheNamespace per (directory, namespace) per process, flushed at exit."""
+    directory = os.path.join(cache_dir, hashlib.sha1(namespace.encode("utf-8")).hexdigest()[:16])
+    if directory not in _namespaces:
+        _namespaces[directory] = CacheNamespace(directory, namespace, max_entries)
+    return _namespaces[directory]
+
+@atexit.register
+def flush_all():
+    for namespace in _namespaces.values():
+        namespace.flush()
+
+
+# --- 3. EMBEDDING WRAPPER ---
+class CachedEmbedding(BaseEmbedding):
+    """
+    Wraps an embedding model so every query/text embedding is looked up in the on-disk
+    cache first, keyed by (model name, prompt, normalization, sha256 of the text); only
+    misses reach the wrapped model, in one batch.
+    """
+
+    _inner: Any = PrivateAttr()
+    _cache_dir: str = PrivateAttr()
+    _max_entries: int = PrivateAttr()
+
+    def __init__(self, inner: BaseEmbedding, cache_dir: str = EMBEDDING_CACHE_DIR, max_entries: int = MAX_ENTRIES, **kwargs: Any):
+        super().__init__(model_name=inner.model_name, embed_batch_size=inner.embed_batch_size, **kwargs)
+        self._inner = inner
+        self._cache_dir = cache_dir
+        self._max_entries = max_entries
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    @property
+    def inner(self) -> BaseEmbedding:
+        return self._inner
+
+    def _namespace(self, prompt: str) -> CacheNamespace:
+        name = f"{self._inner.class_name()}|{self._inner.model_name}|{prompt}|normalize={getattr(self._inner, 'normalize', None)}"
+        if getattr(self._inner, "quantized", False):
+            name += "|int8"
+        # ONNX models used [CLS] pooling for every model before mean pooling was supported
+        if getattr(self._inner, "pooling", "cls") != "cls":
+            name += f"|{self._inner.pooling}"
+        return get_namespace(name, self._cache_dir, self._max_entries)
+
+    def cached_embeddings(self, texts: List[str], prompt: str, compute) -> List[List[float]]:
+        """Embeddings of `texts` in order; compute(missing_texts) embeds the cache misses."""
+        namespace = self._namespace(prompt)
+        keys = [text_key(text) for text in texts]
+        found = namespace.get(list(dict.fromkeys(keys)))
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        if missing:
+            vectors = compute(list(missing.values()))
+            namespace.put(list(missing), vectors)
+            found.update({key: np.asarray(vector, dtype=np.float32) for key, vector in zip(missing, vectors)})
+        return [found[key].tolist() for key in keys]
+
+    def get_query_embedding_batch(self, queries: List[str]) -> List[List[float]]:
+        """Batched query embeddings (see multi_index_retriever.embed_queries)."""
+        return self.cached_embeddings(queries, "query", lambda missing: embed_queries(self._inner, missing))
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self.get_query_embedding_batch([query])[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self.cached_embeddings(texts, "text", self._inner._get_text_embeddings)
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embedding(text)
+
+
+def with_embedding_cache(embed_model: BaseEmbedding) -> BaseEmbedding:
+    """Wraps embed_model in CachedEmbedding unless EMBEDDING_CACHE=off."""
+    return embed_model if EMBEDDING_CACHE == "off" else CachedEmbedding(embed_model)
@@ -0,0 +1,103 @@
+# entity_partitions.py
+import re
+from collections import Counter
+from typing import List, Optional
+
+# --- 1. CONFIGURATION ---
+# Coarse entity types; every entity document lands in exactly one partition
+ENTITY_PARTITIONS = ("map_pin", "character", "location", "quest", "item", "other")
+# Metadata key holding an entity document's partition (excluded from the embedded text)
+PARTITION_KEY = "partition"
+
+# Map pin URIs carry the pin coordinates, e.g. Velen_Novigrad_Cave_Entrance_Pin_725p0_873p0
+_PIN_URI = re.compile(r'_Pin_')
+# Type label phrases per partition, checked in this order: "quest items" are items, not quests
+_TYPE_RULES = (
+    ("map_pin", ("map pin", "mappin", "points of interest")),
+    ("item", ("quest items", "items", "weapons", "swords", "armor", "gear", "ingredients", "books", "keys",
+              "trophies", "relics", "dyes", "junk", "components", "diagrams", "formula", "formulae", "food and drinks",
+              "bombs", "potions", "oils", "decoctions", "mutagens", "equipment", "gwent cards")),
+    ("quest", ("quests", "contracts", "treasure hunts")),
+    ("character", ("characters", "witchers", "mages", "sorceresses", "sorcerers", "kings", "queens", "merchants",
+                   "blacksmiths", "armorers", "bards", "innkeepers", "soldiers", "bandits", "nobility")),
+    ("location", ("locations", "cities", "towns", "villages", "castles", "caves", "islands", "regions",
+                  "kingdoms", "baronies", "taverns", "inns", "fortresses", "ruins", "places")),
+)
+# The type line written by prepare_data.format_entity_document
+_TYPES_LINE = re.compile(r'^It is a type of: (.*)\.$', re.MULTILINE)
+# Category labels that describe pages about images, not the entity itself
+_IGNORED_TYPE_LABEL = re.compile(r'\bimages?\b', re.IGNORECASE)
+
+# Query words that route a search to a partition (the router); a query matching none searches everything
+_QUERY_RULES = (
+    ("map_pin", ("map pin", "pin", "pins", "marker", "markers", "signpost", "signposts", "point of interest", "poi")),
+    ("item", ("item", "items", "weapon", "weapons", "sword", "swords", "armor", "armour", "book", "books",
+              "ingredient", "ingredients", "potion", "potions", "diagram", "diagrams", "trophy", "relic")),
+    ("quest", ("quest", "quests", "contract", "contracts", "treasure hunt", "mission")),
+    ("character", ("character", "characters", "person", "people", "npc", "npcs", "sorceress", "mage",
+                   "merchant", "innkeeper")),
+    ("location", ("location", "locations", "place", "places", "city", "cities", "town", "towns", "village",
+                  "villages", "castle", "castles", "cave", "caves", "island", "islands", "region", "regions")),
+)
+
+
+# --- 2. ASSIGNMENT ---
+def _words(text: str) -> str:
+    """Lowercased words joined by single spaces and padded, so phrases match whole words only."""
+    return " " + " ".join(re.findall(r'[a-z0-9]+', (text or "").lower())) + " "
+
+
+def _matching_partitions(text: str, rules) -> List[str]:
+    words = _words(text)
+    return [partition for partition, phrases in rules if any(f" {phrase} " in words for phrase in phrases)]
+
+
+def type_label_partition(label: str) -> Optional[str]:
+    """The partition a single type label points to, or None."""
+    if _IGNORED_TYPE_LABEL.search(label):
+        return None
+    partitions = _matching_partitions(label, _TYPE_RULES)
+    return partitions[0] if partitions else None
+
+
+def entity_partition(uri: str, type_labels: List[str]) -> str:
+    """
+    Partition of one entity: map pins by their URI, otherwise the partition most of its
+    type labels point to (ties go to the earlier partition in ENTITY_PARTITIONS), else "other".
+    """
+    if _PIN_URI.search(uri or ""):
+        return "map_pin"
+    votes = Counter(p for p in (type_label_partition(label) for label in type_labels) if p is not None)
+    if not votes:
+        return "other"
+    return max(votes, key=lambda p: (votes[p], -ENTITY_PARTITIONS.index(p)))
+
+
+def assign_partitions(docs) -> Counter:
+    """
+    Stores each entity Document's partition in its metadata, excluded from the embedded and
+    LLM text so the vectors stay the same. Returns the number of documents per partition.
+    """
+    counts = Counter()
+    for doc in docs:
+        types_line = _TYPES_LINE.search(doc.text)
+        type_labels = [t.strip() for t in types_line.group(1).split(",")] if types_line else []
+        doc.metadata[PARTITION_KEY] = entity_partition(doc.metadata.get("uri", ""), type_labels)
+        for excluded in (doc.excluded_embed_metadata_keys, doc.excluded_llm_metadata_keys):
+            if PARTITION_KEY not in excluded:
+                excluded.append(PARTITION_KEY)
+        counts[doc.metadata[PARTITION_KEY]] += 1
+    return counts
+
+
+# --- 3. ROUTING ---
+def route_query(query: str) -> Optional[List[str]]:
+    """
+    Keyword router: the partitions a search query explicitly asks for ("the cave entrance
+    map pin", "quests in Velen"), always together with "other" so untyped entities stay
+    reachable. Returns None (search every partition) when no rule matches.
+    """
+    partitions = _matching_partitions(query, _QUERY_RULES)
+    if not partitions:
+        return None
+    return partitions + ["other"]
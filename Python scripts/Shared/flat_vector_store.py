@@ -0,0 +1,565 @@
+# flat_vector_store.py
+import os
+import json
+import numpy as np
+from typing import Any, List, Optional, Sequence
+from pydantic import PrivateAttr
+from llama_index.core import VectorStoreIndex, StorageContext, load_index_from_storage
+from llama_index.core.schema import BaseNode, TextNode
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore, VectorStoreQuery, VectorStoreQueryResult, MetadataFilters, MetadataFilter, FilterOperator, FilterCondition,
+)
+
+from entity_partitions import PARTITION_KEY
+
+# --- 1. CONFIGURATION ---
+# Files written into each persist_dir
+HEADER_FILENAME = "flat_store.json"
+EMBEDDINGS_FILENAME = "embeddings.npy"
+NORMS_FILENAME = "norms.npy"
+SIDE_TABLE_FILENAME = "nodes.json"
+# float16 halves the file and page-cache footprint; scores are always computed in float32
+SUPPORTED_DTYPES = ("float32", "float16")
+
+# Optional compressed copies of the matrix for a first-pass search (see FlatVectorStore.query)
+INT8_CODES_FILENAME = "embeddings_int8.npy"
+INT8_SCALES_FILENAME = "int8_scales.npy"
+BINARY_CODES_FILENAME = "embeddings_binary.npy"
+QUANTIZATION_MODES = ("none", "int8", "binary")
+# First-pass candidates per requested result that are rescored at full precision
+RESCORE_MULTIPLIERS = {"int8": 4, "binary": 10}
+# "exact": scan every row (optionally quantized); "hnsw": walk a graph built by hnsw_vector_store.py
+INDEX_TYPES = ("exact", "hnsw")
+# Rows scored per block in the first pass, bounding the float32 temporaries
+QUANTIZED_BLOCK_ROWS = 16384
+# Set bits per byte value, for Hamming distances over packed sign bits
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+# Optional dimension reduction of the stored matrix; queries are projected the same way
+PROJECTION_FILENAME = "projection.npz"
+# "pca": fitted on the document matrix; "truncate": keep the leading dims (Matryoshka-trained models)
+REDUCTION_METHODS = ("none", "pca", "truncate")
+
+
+# --- 2. QUANTIZATION ---
+def quantize_int8(matrix):
+    """Symmetric per-dimension int8 codes: matrix ~= codes * scales."""
+    codes = np.empty(matrix.shape, dtype=np.int8)
+    if matrix.shape[0] == 0:
+        return codes, np.ones(matrix.shape[1], dtype=np.float32)
+    scales = np.zeros(matrix.shape[1], dtype=np.float32)
+    for start in range(0, matrix.shape[0], QUANTIZED_BLOCK_ROWS):
+        block = np.asarray(matrix[start:start + QUANTIZED_BLOCK_ROWS], dtype=np.float32)
+        scales = np.maximum(scales, np.abs(block).max(axis=0))
+    scales = np.where(scales > 0, scales / 127.0, 1.0).astype(np.float32)
+    for start in range(0, matrix.shape[0], QUANTIZED_BLOCK_ROWS):
+        block = np.asarray(matrix[start:start + QUANTIZED_BLOCK_ROWS], dtype=np.float32)
+        codes[start:start + block.shape[0]] = np.clip(np.rint(block / scales), -127, 127)
+    return codes, scales
+
+
+def quantize_binary(matrix):
+    """One sign bit per dimension, packed 8 per byte."""
+    return np.packbits(np.asarray(matrix) > 0, axis=1)
+
+
+# --- 3. DIMENSION REDUCTION ---
+def fit_projection(matrix, method, dim):
+    """
+    (input_dim, dim) components such that x -> x @ components maps input vectors to `dim`
+    dimensions: for "pca" the top principal directions of the (uncentered) document matrix.
+    The projection drops each vector's component outside that subspace, so it approximately
+    preserves cosine rankings (exact only for vectors inside the subspace); the dimension
+    sweep in evaluate_retrieval.py measures how much ranking overlap is lost.
+    For "truncate" the first `dim` coordinates.
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    input_dim = matrix.shape[1]
+    if method not in REDUCTION_METHODS[1:]:
+        raise ValueError(f"Unsupported reduction '{method}'. Expected one of {REDUCTION_METHODS[1:]}.")
+    if not 0 < dim < input_dim:
+        raise ValueError(f"Reduced dimension must be between 1 and {input_dim - 1}, got {dim}.")
+    if method == "truncate":
+        return np.eye(input_dim, dim, dtype=np.float32)
+    second_moment = np.zeros((input_dim, input_dim), dtype=np.float64)
+    for start in range(0, matrix.shape[0], QUANTIZED_BLOCK_ROWS):
+        block = matrix[start:start + QUANTIZED_BLOCK_ROWS].astype(np.float64)
+        second_moment += block.T @ block
+    _, eigenvectors = np.linalg.eigh(second_moment)
+    # eigh sorts eigenvalues ascending
+    return np.ascontiguousarray(eigenvectors[:, ::-1][:, :dim], dtype=np.float32)
+
+
+def project(vectors, components):
+    """Applies a fitted projection to one vector or a matrix (block by block)."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        return vectors @ components
+    projected = np.empty((vectors.shape[0], components.shape[1]), dtype=np.float32)
+    for start in range(0, vectors.shape[0], QUANTIZED_BLOCK_ROWS):
+        projected[start:start + QUANTIZED_BLOCK_ROWS] = vectors[start:start + QUANTIZED_BLOCK_ROWS] @ components
+    return projected
+
+
+# --- 4. VECTOR STORE ---
+class FlatVectorStore(BasePydanticVectorStore):
+    """
+    Exact (brute-force) vector store backed by one contiguous embedding matrix.
+    Persisted as an .npy file that is memory-mapped at load time, plus a column-oriented
+    side table with the node ids, texts and metadata. A query is a single matrix-vector
+    product followed by a partial sort, with cosine scores identical to SimpleVectorStore.
+    With quantization "int8" or "binary", only the compressed codes are held in memory:
+    they rank every row approximately, and the best rescore_multiplier * k candidates are
+    rescored exactly against the full-precision rows read from the memory-mapped matrix.
+    A store persisted with a dimension reduction keeps the reduced matrix and the fitted
+    projection; query embeddings and newly added rows are projected the same way.
+    Rows carrying a "partition" metadata value are persisted grouped by partition, so a
+    query filtered on the partition scores only those contiguous slices of the matrix.
+    """
+
+    stores_text: bool = True
+    is_embedding_query: bool = True
+    quantization: str = "none"
+    rescore_multiplier: Optional[int] = None
+
+    _matrix: Optional[np.ndarray] = PrivateAttr(default=None)
+    _norms: Optional[np.ndarray] = PrivateAttr(default=None)
+    _pending: List[List[float]] = PrivateAttr(default_factory=list)
+    _ids: List[str] = PrivateAttr(default_factory=list)
+    _ref_doc_ids: List[Optional[str]] = PrivateAttr(default_factory=list)
+    _texts: List[str] = PrivateAttr(default_factory=list)
+    _metadata: dict = PrivateAttr(default_factory=dict)
+    _deleted: set = PrivateAttr(default_factory=set)
+    _codes: Optional[np.ndarray] = PrivateAttr(default=None)
+    _scales: Optional[np.ndarray] = PrivateAttr(default=None)
+    _projection: Optional[np.ndarray] = PrivateAttr(default=None)   # (input_dim, dim) components
+    _reduction: Optional[dict] = PrivateAttr(default=None)     # {"method", "dim"}
+    _partitions: Optional[dict] = PrivateAttr(default=None)    # partition -> [start, end) rows of a loaded store
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "FlatVectorStore"
+
+    @property
+    def client(self) -> Any:
+        return None
+
+    @property
+    def reduction(self) -> Optional[dict]:
+        """{"method", "dim"} of a dimension-reduced store, else None."""
+        return self._reduction
+
+    @property
+    def partitions(self) -> Optional[dict]:
+        """partition -> (start, end) row range of a loaded store whose rows carry partitions, else None."""
+        return self._partitions
+
+    def embedding_shape(self) -> tuple:
+        matrix, _ = self._embedding_matrix()
+        return (0, 0) if matrix is None else matrix.shape
+
+    def count(self) -> int:
+        """Number of live rows. (Deliberately not __len__: an empty store must stay truthy for StorageContext.)"""
+        return len(self._ids) - len(self._deleted)
+
+    # --- Building ---
+    def add(self, nodes: Sequence[BaseNode], **kwargs: Any) -> List[str]:
+        # Appended rows fall outside the persisted partition ranges
+        self._partitions = None
+        for node in nodes:
+            row = len(self._ids)
+            self._pending.append(node.get_embedding())
+            self._ids.append(node.node_id)
+            self._ref_doc_ids.append(node.ref_doc_id)
+            self._texts.append(node.get_content())
+            for key in set(self._metadata) | set(node.metadata):
+                column = self._metadata.setdefault(key, [None] * row)
+                column.append(node.metadata.get(key))
+        return [node.node_id for node in nodes]
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        for row, doc_id in enumerate(self._ref_doc_ids):
+            if doc_id == ref_doc_id:
+                self._deleted.add(row)
+
+    def _embedding_matrix(self):
+        """The (memory-mapped) matrix, with rows added since the last load appended in memory."""
+        if self._pending:
+            pending = self._project(self._pending)
+            self._matrix = pending if self._matrix is None else np.vstack([np.asarray(self._matrix, dtype=np.float32), pending])
+            pending_norms = np.linalg.norm(pending, axis=1)
+            self._norms = pending_norms if self._norms is None else np.concatenate([self._norms, pending_norms])
+            self._pending = []
+        return self._matrix, self._norms
+
+    def _project(self, vectors):
+        if self._projection is None:
+            return np.asarray(vectors, dtype=np.float32)
+        return project(vectors, self._projection)
+
+    def _reduce(self, method: str, dim: int) -> None:
+        """Fits the projection on the live rows and replaces the matrix with its projection."""
+        matrix, _ = self._embedding_matrix()
+        live = [row for row in range(len(self._ids)) if row not in self._deleted]
+        if matrix is None or not live:
+            return
+        self._projection = fit_projection(matrix[live], method, dim)
+        self._matrix = project(matrix, self._projection)
+        self._norms = np.linalg.norm(self._matrix, axis=1).astype(np.float32)
+        self._reduction = {"method": method, "dim": dim}
+
+    def reduced_copy(self, method: str, dim: int) -> "FlatVectorStore":
+        """An in-memory copy reduced to `dim` dimensions, e.g. to compare dimensionalities without rebuilding."""
+        store = FlatVectorStore()
+        store._matrix, store._norms = self._embedding_matrix()
+        store._ids, store._ref_doc_ids, store._texts, store._metadata = self._ids, self._ref_doc_ids, self._texts, self._metadata
+        store._deleted = set(self._deleted)
+        store._partitions = self._partitions
+        store._reduce(method, dim)
+        return store
+
+    # --- Querying ---
+    def _filter_mask(self, query: VectorStoreQuery):
+        """Boolean row mask for deleted rows, doc/node id restrictions and metadata filters."""
+        mask = np.ones(len(self._ids), dtype=bool)
+        if self._deleted:
+            mask[list(self._deleted)] = False
+        # as_retriever() passes node_ids=[] for stores that keep their own text; empty means unrestricted
+        if query.doc_ids:
+            allowed = set(query.doc_ids)
+            mask &= np.fromiter((doc_id in allowed for doc_id in self._ref_doc_ids), dtype=bool, count=len(self._ids))
+        if query.node_ids:
+            allowed = set(query.node_ids)
+            mask &= np.fromiter((node_id in allowed for node_id in self._ids), dtype=bool, count=len(self._ids))
+        if query.filters is not None:
+            mask &= self._metadata_mask(query.filters)
+        return mask
+
+    def _metadata_mask(self, filters: MetadataFilters):
+        masks = []
+        for metadata_filter in filters.filters:
+            if isinstance(metadata_filter, MetadataFilters):
+                masks.append(self._metadata_mask(metadata_filter))
+                continue
+            column = self._metadata.get(metadata_filter.key, [None] * len(self._ids))
+            if metadata_filter.operator == FilterOperator.EQ:
+                values = {metadata_filter.value}
+            elif metadata_filter.operator == FilterOperator.IN:
+                values = set(metadata_filter.value)
+            else:
+                raise NotImplementedError(f"FlatVectorStore does not support the '{metadata_filter.operator}' filter operator.")
+            if metadata_filter.key == PARTITION_KEY and self._partitions is not None:
+                mask = np.zeros(len(self._ids), dtype=bool)
+                for start, end in (self._partitions[name] for name in values if name in self._partitions):
+                    mask[start:end] = True
+                masks.append(mask)
+                continue
+            masks.append(np.fromiter((value in values for value in column), dtype=bool, count=len(self._ids)))
+        if not masks:
+            return np.ones(len(self._ids), dtype=bool)
+        combined = masks[0]
+        for mask in masks[1:]:
+            combined = (combined | mask) if filters.condition == FilterCondition.OR else (combined & mask)
+        return combined
+
+    def _partition_slices(self, query: VectorStoreQuery):
+        """[start, end) row ranges when the query is restricted by nothing but a partition filter, else None."""
+        if self._partitions is None or query.doc_ids or query.node_ids or query.filters is None or len(query.filters.filters) != 1:
+            return None
+        metadata_filter = query.filters.filters[0]
+        if isinstance(metadata_filter, MetadataFilters) or metadata_filter.key != PARTITION_KEY:
+            return None
+        if metadata_filter.operator == FilterOperator.EQ:
+            names = [metadata_filter.value]
+        elif metadata_filter.operator == FilterOperator.IN:
+            names = list(dict.fromkeys(metadata_filter.value))
+        else:
+            return None
+        return [self._partitions[name] for name in names if name in self._partitions]
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        matrix, norms = self._embedding_matrix()
+        if matrix is None or query.query_embedding is None or not self.count():
+            return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+
+        q = self._project(query.query_embedding)
+        restricted = bool(self._deleted or query.doc_ids or query.node_ids or query.filters is not None)
+        slices = self._partition_slices(query) if restricted else None
+        if self._codes is not None and self._codes.shape[0] == matrix.shape[0]:
+            mask = self._filter_mask(query) if restricted else None
+            candidates = self._quantized_candidates(q, norms, mask, query.similarity_top_k)
+            scores = (np.asarray(matrix[candidates], dtype=np.float32) @ q) / np.maximum(norms[candidates] * np.linalg.norm(q), 1e-12)
+        elif slices is not None:
+            # Only the slices of the requested partitions are read and scored
+            candidates = np.concatenate([np.arange(start, end) for start, end in slices] + [np.zeros(0, dtype=np.int64)])
+            scores = np.concatenate([(np.asarray(matrix[start:end], dtype=np.float32) @ q) / np.maximum(norms[start:end] * np.linalg.norm(q), 1e-12)
+                                     for start, end in slices] + [np.zeros(0, dtype=np.float32)]).astype(np.float32)
+            if self._deleted:
+                live = ~np.isin(candidates, list(self._deleted))
+                candidates, scores = candidates[live], scores[live]
+        else:
+            scores = (matrix @ q).astype(np.float32) / np.maximum(norms * np.linalg.norm(q), 1e-12)
+            if restricted:
+                candidates = np.flatnonzero(self._filter_mask(query))
+                scores = scores[candidates]
+            else:
+                candidates = None
+
+        k = min(query.similarity_top_k, scores.shape[0])
+        if k <= 0:
+            return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        rows = top if candidates is None else candidates[top]
+
+        nodes = [self._node(int(row)) for row in rows]
+        return VectorStoreQueryResult(nodes=nodes, similarities=scores[top].tolist(), ids=[self._ids[int(row)] for row in rows])
+
+    def batch_query(self, query_embeddings, top_k: int, query_block: int = 256, doc_block: int = QUANTIZED_BLOCK_ROWS):
+        """
+        Exact top-k for many queries at once (offline evaluation): the query x document
+        cosine matrix is computed block by block with matrix-matrix products, keeping a
+        running top-k per query via argpartition, so memory stays bounded by the block sizes.
+        Returns (rows, scores), two (n_queries, k) arrays sorted by descending score.
+        """
+        matrix, norms = self._embedding_matrix()
+        queries = self._project(query_embeddings)
+        k = min(top_k, self.count())
+        if matrix is None or k <= 0 or queries.shape[0] == 0:
+            return np.zeros((queries.shape[0], 0), dtype=np.int64), np.zeros((queries.shape[0], 0), dtype=np.float32)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        inverse_norms = 1.0 / np.maximum(norms, 1e-12)
+        live = None
+        if self._deleted:
+            live = np.ones(matrix.shape[0], dtype=bool)
+            live[list(self._deleted)] = False
+
+        all_rows = np.empty((queries.shape[0], k), dtype=np.int64)
+        all_scores = np.empty((queries.shape[0], k), dtype=np.float32)
+        for q_start in range(0, queries.shape[0], query_block):
+            query_rows = queries[q_start:q_start + query_block]
+            best_rows = best_scores = None
+            for d_start in range(0, matrix.shape[0], doc_block):
+                block = np.asarray(matrix[d_start:d_start + doc_block], dtype=np.float32)
+                scores = (query_rows @ block.T) * inverse_norms[d_start:d_start + block.shape[0]]
+                if live is not None:
+                    scores[:, ~live[d_start:d_start + block.shape[0]]] = -np.inf
+                if best_rows is not None:
+                    scores = np.concatenate([best_scores, scores], axis=1)
+                    candidates = np.concatenate([best_rows, np.broadcast_to(np.arange(d_start, d_start + block.shape[0]), (query_rows.shape[0], block.shape[0]))], axis=1)
+                else:
+                    candidates = np.broadcast_to(np.arange(d_start, d_start + block.shape[0]), scores.shape)
+                keep = min(k, scores.shape[1])
+                top = np.argpartition(-scores, keep - 1, axis=1)[:, :keep]
+                best_scores = np.take_along_axis(scores, top, axis=1)
+                best_rows = np.take_along_axis(candidates, top, axis=1)
+            order = np.argsort(-best_scores, axis=1, kind="stable")
+            all_rows[q_start:q_start + query_rows.shape[0]] = np.take_along_axis(best_rows, order, axis=1)
+            all_scores[q_start:q_start + query_rows.shape[0]] = np.take_along_axis(best_scores, order, axis=1)
+        return all_rows, all_scores
+
+    def row_metadata(self, row: int) -> dict:
+        return {key: column[row] for key, column in self._metadata.items() if column[row] is not None}
+
+    def row_node(self, row: int) -> TextNode:
+        return self._node(row)
+
+    def row_keys(self) -> List[tuple]:
+        """(ref_doc_id, text) of every row: identifies the same chunk in a store built from the same documents with another model."""
+        return list(zip(self._ref_doc_ids, self._texts))
+
+    def score_rows(self, query_embedding, rows) -> np.ndarray:
+        """Exact cosine scores of the query against the given rows only (e.g. a shortlist to rescore)."""
+        matrix, norms = self._embedding_matrix()
+        rows = np.asarray(rows, dtype=np.int64)
+        q = self._project(query_embedding)
+        order = np.argsort(rows, kind="stable")
+        scores = np.empty(rows.shape[0], dtype=np.float32)
+        # Ascending row order keeps the reads from the memory-mapped matrix sequential
+        scores[order] = (np.asarray(matrix[rows[order]], dtype=np.float32) @ q) / np.maximum(norms[rows[order]] * np.linalg.norm(q), 1e-12)
+        return scores
+
+    def _quantized_candidates(self, q, norms, mask, top_k):
+        """First pass over the compressed codes; returns the sorted rows to rescore exactly."""
+        approx = np.empty(self._codes.shape[0], dtype=np.float32)
+        if self.quantization == "int8":
+            # The scales are folded into the query, so the codes are only ever widened block by block
+            scaled_q = q * self._scales
+            for start in range(0, approx.shape[0], QUANTIZED_BLOCK_ROWS):
+                block = self._codes[start:start + QUANTIZED_BLOCK_ROWS]
+                approx[start:start + block.shape[0]] = (block.astype(np.float32) @ scaled_q) / np.maximum(norms[start:start + block.shape[0]], 1e-12)
+        else:
+            q_bits = np.packbits(q > 0)
+            for start in range(0, approx.shape[0], QUANTIZED_BLOCK_ROWS):
+                block = self._codes[start:start + QUANTIZED_BLOCK_ROWS]
+                approx[start:start + block.shape[0]] = -_POPCOUNT[np.bitwise_xor(block, q_bits)].sum(axis=1, dtype=np.int32)
+        if mask is not None:
+            approx[~mask] = -np.inf
+
+        multiplier = self.rescore_multiplier or RESCORE_MULTIPLIERS[self.quantization]
+        allowed = approx.shape[0] if mask is None else int(mask.sum())
+        n_candidates = min(top_k * multiplier, allowed)
+        if n_candidates <= 0:
+            return np.zeros(0, dtype=np.int64)
+        candidates = np.argpartition(-approx, n_candidates - 1)[:n_candidates]
+        # Ascending row order keeps the reads from the memory-mapped matrix sequential
+        return np.sort(candidates)
+
+    def iter_metadata(self):
+        """Metadata dict of every live row, in row order."""
+        for row in range(len(self._ids)):
+            if row not in self._deleted:
+                yield {key: column[row] for key, column in self._metadata.items() if column[row] is not None}
+
+    def _node(self, row: int) -> TextNode:
+        metadata = {key: column[row] for key, column in self._metadata.items() if column[row] is not None}
+        return TextNode(id_=self._ids[row], text=self._texts[row], metadata=metadata)
+
+    # --- Persistence ---
+    def persist_to_dir(self, persist_dir: str, dtype: str = "float32", quantize: Sequence[str] = (),
+                       reduction: Optional[dict] = None) -> None:
+        """
+        Writes the matrix, row norms and side table, dropping deleted rows, plus the
+        compressed codes for each mode in `quantize` ("int8" and/or "binary").
+        `reduction` ({"method": "pca" | "truncate", "dim": ...}) stores the matrix reduced to
+        that many dimensions together with the projection; it is fitted on the first persist
+        and reused afterwards, so a store cannot change its reduction once persisted.
+        Rows are written grouped by their "partition" metadata value (stable within a
+        partition) and the row range of each partition is recorded in the header.
+        """
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"Unsupported dtype '{dtype}'. Expected one of {SUPPORTED_DTYPES}.")
+        for mode in quantize:
+            if mode not in QUANTIZATION_MODES[1:]:
+                raise ValueError(f"Unsupported quantization '{mode}'. Expected one of {QUANTIZATION_MODES[1:]}.")
+        if reduction is not None and self._projection is None:
+            self._reduce(reduction["method"], reduction["dim"])
+        elif reduction != self._reduction:
+            raise ValueError(f"This store is reduced with {self._reduction}; rebuild it to persist it with {reduction}.")
+        matrix, norms = self._embedding_matrix()
+        keep = [row for row in range(len(self._ids)) if row not in self._deleted]
+        partition_column = self._metadata.get(PARTITION_KEY)
+        partitions = None
+        if partition_column is not None:
+            keep.sort(key=lambda row: (partition_column[row] is None, str(partition_column[row])))
+            partitions = {}
+            for position, row in enumerate(keep):
+                if partition_column[row] is not None:
+                    partitions.setdefault(partition_column[row], [position, position])[1] = position + 1
+        os.makedirs(persist_dir, exist_ok=True)
+
+        dim = 0 if matrix is None else matrix.shape[1]
+        matrix = np.zeros((0, dim), dtype=np.float32) if matrix is None else np.asarray(matrix[keep], dtype=np.float32)
+        norms = np.zeros(0, dtype=np.float32) if norms is None else np.asarray(norms[keep], dtype=np.float32)
+        np.save(os.path.join(persist_dir, EMBEDDINGS_FILENAME), matrix.astype(dtype))
+        np.save(os.path.join(persist_dir, NORMS_FILENAME), norms)
+        if "int8" in quantize:
+            codes, scales = quantize_int8(matrix)
+            np.save(os.path.join(persist_dir, INT8_CODES_FILENAME), codes)
+            np.save(os.path.join(persist_dir, INT8_SCALES_FILENAME), scales)
+        if "binary" in quantize:
+            np.save(os.path.join(persist_dir, BINARY_CODES_FILENAME), quantize_binary(matrix))
+        # Codes left over from an earlier build would no longer match the matrix
+        for mode, filenames in (("int8", (INT8_CODES_FILENAME, INT8_SCALES_FILENAME)), ("binary", (BINARY_CODES_FILENAME,))):
+            if mode not in quantize:
+                for filename in filenames:
+                    if os.path.exists(os.path.join(persist_dir, filename)):
+                        os.remove(os.path.join(persist_dir, filename))
+        if self._projection is not None:
+            np.savez(os.path.join(persist_dir, PROJECTION_FILENAME), components=self._projection, method=self._reduction["method"])
+        elif os.path.exists(os.path.join(persist_dir, PROJECTION_FILENAME)):
+            os.remove(os.path.join(persist_dir, PROJECTION_FILENAME))
+
+        side_table = {
+            "ids": [self._ids[row] for row in keep],
+            "ref_doc_ids": [self._ref_doc_ids[row] for row in keep],
+            "texts": [self._texts[row] for row in keep],
+            "metadata": {key: [column[row] for row in keep] for key, column in self._metadata.items()},
+        }
+        with open(os.path.join(persist_dir, SIDE_TABLE_FILENAME), 'w', encoding='utf-8') as f:
+            json.dump(side_table, f, ensure_ascii=False)
+        with open(os.path.join(persist_dir, HEADER_FILENAME), 'w', encoding='utf-8') as f:
+            json.dump({"format": "flat", "count": len(keep), "dim": dim, "dtype": dtype, "quantized": sorted(quantize),
+                       "reduction": self._reduction, "partitions": partitions}, f)
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: str, mmap: bool = True, quantization: str = "none",
+                         rescore_multiplier: Optional[int] = None) -> "FlatVectorStore":
+        """
+        Loads a persisted store; with mmap=True the matrix is paged in lazily by the OS.
+        With quantization "int8" or "binary" the codes written at build time are loaded
+        (or computed from the matrix once, if the build did not write them).
+        """
+        if quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"Unsupported quantization '{quantization}'. Expected one of {QUANTIZATION_MODES}.")
+        store = cls(quantization=quantization, rescore_multiplier=rescore_multiplier)
+        store._matrix = np.load(os.path.join(persist_dir, EMBEDDINGS_FILENAME), mmap_mode='r' if mmap else None)
+        store._norms = np.load(os.path.join(persist_dir, NORMS_FILENAME))
+        if os.path.exists(os.path.join(persist_dir, PROJECTION_FILENAME)):
+            with np.load(os.path.join(persist_dir, PROJECTION_FILENAME)) as projection:
+                store._projection = projection["components"]
+                store._reduction = {"method": str(projection["method"]), "dim": int(projection["components"].shape[1])}
+        if quantization == "int8":
+            if os.path.exists(os.path.join(persist_dir, INT8_CODES_FILENAME)):
+                store._codes = np.load(os.path.join(persist_dir, INT8_CODES_FILENAME))
+                store._scales = np.load(os.path.join(persist_dir, INT8_SCALES_FILENAME))
+            else:
+                print(f"No int8 codes in {persist_dir}; quantizing the matrix at load time.")
+                store._codes, store._scales = quantize_int8(store._matrix)
+        elif quantization == "binary":
+            if os.path.exists(os.path.join(persist_dir, BINARY_CODES_FILENAME)):
+                store._codes = np.load(os.path.join(persist_dir, BINARY_CODES_FILENAME))
+            else:
+                print(f"No binary codes in {persist_dir}; quantizing the matrix at load time.")
+                store._codes = quantize_binary(store._matrix)
+        with open(os.path.join(persist_dir, SIDE_TABLE_FILENAME), 'r', encoding='utf-8') as f:
+            side_table = json.load(f)
+        store._ids = side_table["ids"]
+        store._ref_doc_ids = side_table["ref_doc_ids"]
+        store._texts = side_table["texts"]
+        store._metadata = side_table["metadata"]
+        with open(os.path.join(persist_dir, HEADER_FILENAME), 'r', encoding='utf-8') as f:
+            partitions = json.load(f).get("partitions")
+        store._partitions = {name: tuple(bounds) for name, bounds in partitions.items()} if partitions else None
+        return store
+
+
+# --- 5. LOADING ---
+def is_flat_index(persist_dir: str) -> bool:
+    return os.path.exists(os.path.join(persist_dir, HEADER_FILENAME))
+
+
+def load_vector_index(persist_dir: str, quantization: str = "none", index_type: Optional[str] = None,
+                      ef_search: Optional[int] = None):
+    """
+    Loads an index persisted by build_indices.py in either format: the memory-mapped flat
+    store, or LlamaIndex's JSON SimpleVectorStore/docstore from older builds.
+    `quantization` selects the flat store's first-pass search (see FlatVectorStore).
+    `index_type` None uses the HNSW graph whenever the build wrote one; "exact" ignores it.
+    """
+    if is_flat_index(persist_dir):
+        with open(os.path.join(persist_dir, HEADER_FILENAME), 'r', encoding='utf-8') as f:
+            header = json.load(f)
+        if index_type == "hnsw" or (index_type is None and header.get("ann")):
+            from hnsw_vector_store import HnswVectorStore, has_hnsw_graph, DEFAULT_EF_SEARCH
+            if not has_hnsw_graph(persist_dir):
+                raise FileNotFoundError(f"No HNSW graph in {persist_dir}. Rebuild with 'build_indices.py --index-type hnsw'.")
+            try:
+                store = HnswVectorStore.from_persist_dir(persist_dir, quantization=quantization, ef_search=ef_search or DEFAULT_EF_SEARCH)
+                return VectorStoreIndex.from_vector_store(store)
+            except ImportError as e:
+                print(f"Warning: {e}. Falling back to exact search over {persist_dir}.")
+        return VectorStoreIndex.from_vector_store(FlatVectorStore.from_persist_dir(persist_dir, quantization=quantization))
+    if quantization != "none" or index_type == "hnsw":
+        print(f"Warning: {persist_dir} is not a flat index; quantization and HNSW options are ignored.")
+    return load_index_from_storage(StorageContext.from_defaults(persist_dir=persist_dir))
+
+def partition_filters(partitions) -> MetadataFilters:
+    """Retriever filters restricting a flat index to the given partitions (scanned as row slices, see FlatVectorStore)."""
+    return MetadataFilters(filters=[MetadataFilter(key=PARTITION_KEY, value=list(partitions), operator=FilterOperator.IN)])
+
+def iter_index_metadata(index):
+    """Metadata of every document in an index of either format (flat indexes have no docstore)."""
+    if isinstance(index.vector_store, FlatVectorStore):
+        return index.vector_store.iter_metadata()
+    return (doc.metadata for doc in index.docstore.docs.values())
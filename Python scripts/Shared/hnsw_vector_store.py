@@ -0,0 +1,124 @@
+# hnsw_vector_store.py
+import os
+import json
+import time
+import numpy as np
+from typing import Any
+from pydantic import PrivateAttr
+from llama_index.core.vector_stores.types import VectorStoreQuery, VectorStoreQueryResult
+
+from flat_vector_store import FlatVectorStore, HEADER_FILENAME, EMBEDDINGS_FILENAME
+
+# --- 1. CONFIGURATION ---
+# Written next to the flat store's files; the flat matrix and side table stay the source of truth
+GRAPH_FILENAME = "hnsw_index.bin"
+# Graph degree and build-time beam width (higher = better recall, slower build, bigger graph)
+DEFAULT_M = 16
+DEFAULT_EF_CONSTRUCTION = 200
+# Query-time beam width; always raised to at least k
+DEFAULT_EF_SEARCH = 64
+# Rows handed to hnswlib per add_items call, bounding the float32 copy of a memory-mapped matrix
+ADD_BLOCK_ROWS = 16384
+
+
+def _import_hnswlib():
+    try:
+        import hnswlib
+    except ImportError:
+        raise ImportError("The HNSW index type needs the hnswlib package: pip install hnswlib")
+    return hnswlib
+
+
+# --- 2. BUILDING ---
+def build_hnsw_graph(persist_dir, m=DEFAULT_M, ef_construction=DEFAULT_EF_CONSTRUCTION):
+    """
+    Builds an HNSW graph over the flat matrix persisted in persist_dir (row i gets label i),
+    saves it and records its parameters in the flat header. The graph is always rebuilt from
+    the persisted matrix, because persisting compacts rows and so renumbers them.
+    """
+    hnswlib = _import_hnswlib()
+    matrix = np.load(os.path.join(persist_dir, EMBEDDINGS_FILENAME), mmap_mode='r')
+    count, dim = matrix.shape
+
+    start = time.time()
+    graph = hnswlib.Index(space='cosine', dim=dim)
+    graph.init_index(max_elements=max(count, 1), M=m, ef_construction=ef_construction, random_seed=100)
+    for block_start in range(0, count, ADD_BLOCK_ROWS):
+        block = np.asarray(matrix[block_start:block_start + ADD_BLOCK_ROWS], dtype=np.float32)
+        graph.add_items(block, np.arange(block_start, block_start + block.shape[0]))
+    graph.save_index(os.path.join(persist_dir, GRAPH_FILENAME))
+
+    header_path = os.path.join(persist_dir, HEADER_FILENAME)
+    with open(header_path, 'r', encoding='utf-8') as f:
+        header = json.load(f)
+    header["ann"] = {"type": "hnsw", "M": m, "ef_construction": ef_construction}
+    with open(header_path, 'w', encoding='utf-8') as f:
+        json.dump(header, f)
+    print(f"Built HNSW graph over {count} vectors (M={m}, ef_construction={ef_construction}) in {time.time() - start:.1f}s.")
+
+
+def remove_hnsw_graph(persist_dir):
+    """Drops a graph left over from an earlier build, so loaders do not pick up stale labels."""
+    if os.path.exists(os.path.join(persist_dir, GRAPH_FILENAME)):
+        os.remove(os.path.join(persist_dir, GRAPH_FILENAME))
+
+
+def has_hnsw_graph(persist_dir):
+    return os.path.exists(os.path.join(persist_dir, GRAPH_FILENAME))
+
+
+# --- 3. VECTOR STORE ---
+class HnswVectorStore(FlatVectorStore):
+    """
+    FlatVectorStore whose queries walk an HNSW graph instead of scanning every row.
+    The graph only returns row numbers: the k hits are rescored exactly against the
+    memory-mapped matrix, so similarities are the same cosine scores as the flat store.
+    Rows added since loading (or a graph that failed to return k hits under a filter)
+    fall back to the exact scan.
+    """
+
+    ef_search: int = DEFAULT_EF_SEARCH
+
+    _graph: Any = PrivateAttr(default=None)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "HnswVectorStore"
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: str, mmap: bool = True, quantization: str = "none",
+                         rescore_multiplier=None, ef_search: int = DEFAULT_EF_SEARCH) -> "HnswVectorStore":
+        store = super().from_persist_dir(persist_dir, mmap=mmap, quantization=quantization, rescore_multiplier=rescore_multiplier)
+        store.ef_search = ef_search
+        hnswlib = _import_hnswlib()
+        graph = hnswlib.Index(space='cosine', dim=store._matrix.shape[1])
+        graph.load_index(os.path.join(persist_dir, GRAPH_FILENAME), max_elements=max(store._matrix.shape[0], 1))
+        store._graph = graph
+        return store
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        graph = self._graph
+        if graph is None or self._pending or query.query_embedding is None or graph.get_current_count() != len(self._ids):
+            return super().query(query, **kwargs)
+
+        mask = None
+        if self._deleted or query.doc_ids or query.node_ids or query.filters is not None:
+            mask = self._filter_mask(query)
+        k = min(query.similarity_top_k, len(self._ids) if mask is None else int(mask.sum()))
+        if k <= 0:
+            return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+
+        q = self._project(query.query_embedding)
+        graph.set_ef(max(self.ef_search, k))
+        try:
+            labels, _ = graph.knn_query(q, k=k, filter=None if mask is None else (lambda label: bool(mask[label])))
+        except RuntimeError:
+            # hnswlib raises when a selective filter leaves fewer than k reachable rows
+            return super().query(query, **kwargs)
+
+        rows = np.sort(labels[0].astype(np.int64))
+        scores = (np.asarray(self._matrix[rows], dtype=np.float32) @ q) / np.maximum(self._norms[rows] * np.linalg.norm(q), 1e-12)
+        order = np.argsort(-scores, kind="stable")
+        rows, scores = rows[order], scores[order]
+        nodes = [self._node(int(row)) for row in rows]
+        return VectorStoreQueryResult(nodes=nodes, similarities=scores.tolist(), ids=[self._ids[int(row)] for row in rows])
@@ -0,0 +1,170 @@
+# incremental_index.py
+import os
+import json
+import time
+import hashlib
+from llama_index.core import VectorStoreIndex, StorageContext, Settings, load_index_from_storage
+from llama_index.core.ingestion import run_transformations
+
+from flat_vector_store import FlatVectorStore, HEADER_FILENAME
+from hnsw_vector_store import build_hnsw_graph, remove_hnsw_graph
+
+# --- 1. CONFIGURATION ---
+# Stored inside each persist_dir next to LlamaIndex's own files
+MANIFEST_FILENAME = "doc_hashes.json"
+# "flat": memory-mapped FlatVectorStore (see flat_vector_store.py), "simple": LlamaIndex's JSON stores
+STORE_FORMATS = ("flat", "simple")
+
+
+# --- 2. HELPER FUNCTIONS ---
+def document_hash(doc):
+    """Hash of everything that ends up in the embedding: the text and the metadata."""
+    payload = doc.text + "\x00" + json.dumps(doc.metadata, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def assign_stable_ids(docs):
+    """
+    Gives every document a deterministic id derived from its URI, so the same document
+    keeps its id across builds. Documents sharing a URI (e.g. one class document per
+    superclass) are numbered #2, #3, ... in order of their content hash, not extraction
+    order: the class query has no ORDER BY, and a reordered result must not swap ids
+    (which would delete and re-embed both documents).
+    """
+    by_uri = {}
+    for doc in docs:
+        by_uri.setdefault(doc.metadata.get("uri", ""), []).append(doc)
+    for uri, group in by_uri.items():
+        for number, doc in enumerate(sorted(group, key=document_hash), start=1):
+            doc.id_ = uri if number == 1 else f"{uri}#{number}"
+    return docs
+
+
+def load_manifest(persist_dir):
+    path = os.path.join(persist_dir, MANIFEST_FILENAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(persist_dir, hashes, delta, store_format, quantize=(), hnsw=None, model=None, reduction=None,
+                  long_documents="truncate"):
+    with open(os.path.join(persist_dir, MANIFEST_FILENAME), 'w', encoding='utf-8') as f:
+        json.dump({"hashes": hashes, "format": store_format, "quantized": sorted(quantize), "hnsw": hnsw,
+                   "model": model, "reduction": reduction, "long_documents": long_documents, "last_delta": delta}, f)
+
+
+def _build_index(docs, store_format, show_progress, embed_nodes, embed_model):
+    """Builds a fresh index; nodes that were embedded by embed_nodes are not re-embedded."""
+    storage_context = StorageContext.from_defaults(vector_store=FlatVectorStore()) if store_format == "flat" else None
+    if embed_nodes is None:
+        return VectorStoreIndex.from_documents(docs, storage_context=storage_context, show_progress=show_progress, embed_model=embed_model)
+    nodes = embed_nodes(run_transformations(docs, Settings.transformations, show_progress=show_progress))
+    return VectorStoreIndex(nodes, storage_context=storage_context, show_progress=show_progress, embed_model=embed_model)
+
+
+def _persist_flat_store(store, persist_dir, dtype, quantize, hnsw, reduction=None):
+    store.persist_to_dir(persist_dir, dtype=dtype, quantize=quantize, reduction=reduction)
+    if hnsw:
+        build_hnsw_graph(persist_dir, m=hnsw["M"], ef_construction=hnsw["ef_construction"])
+    else:
+        remove_hnsw_graph(persist_dir)
+
+
+def _persist(index, persist_dir, store_format, dtype, quantize=(), hnsw=None, reduction=None):
+    if store_format == "flat":
+        _persist_flat_store(index.vector_store, persist_dir, dtype, quantize, hnsw, reduction)
+    else:
+        index.storage_context.persist(persist_dir=persist_dir)
+        # A leftover flat header would make the loaders prefer the stale flat files
+        if os.path.exists(os.path.join(persist_dir, HEADER_FILENAME)):
+            os.remove(os.path.join(persist_dir, HEADER_FILENAME))
+
+
+# --- 3. INCREMENTAL BUILD ---
+def build_or_update_index(docs, persist_dir, full_rebuild=False, show_progress=True, embed_nodes=None,
+                          store_format="flat", dtype="float32", quantize=(), hnsw=None, embed_model=None, reduction=None,
+                          long_documents="truncate"):
+    """
+    Brings the index in persist_dir up to date with `docs`, embedding only what changed.
+    The manifest maps document id -> content hash. On a rebuild, new and changed documents
+    are embedded and inserted, changed and removed ones are deleted, and nothing is loaded
+    at all when there is no change. Indexes built before the manifest existed, or with
+    full_rebuild=True, or persisted in another store_format, are rebuilt from scratch.
+    `embed_nodes` (e.g. EmbeddingPool.embed_nodes) fills node embeddings up front; nodes
+    that already carry an embedding are not re-embedded by LlamaIndex.
+    `quantize` lists the compressed first-pass codes ("int8", "binary") to write next to a
+    flat matrix, and `hnsw` ({"M": ..., "ef_construction": ...}) adds an HNSW graph over it.
+    Changing either alone rewrites those files without re-embedding anything.
+    `embed_model` overrides Settings.embed_model (e.g. for the cascade's small-model index);
+    the model name is kept in the manifest, and an index built with another model is rebuilt.
+    `reduction` ({"method": "pca" | "truncate", "dim": ...}) stores a dimension-reduced flat
+    matrix; changing it rebuilds the index, since only the reduced vectors are persisted
+    (the full-size ones come back from the embedding cache rather than the model).
+    `long_documents` is how documents over the model's max sequence length were embedded
+    ("truncate" or "split", see token_batching.py); changing it rebuilds the index, since
+    the unchanged long documents would otherwise keep their old vectors.
+    Returns a dict with the added/changed/removed/unchanged counts.
+    """
+    assign_stable_ids(docs)
+    hashes = {doc.id_: document_hash(doc) for doc in docs}
+    manifest = None if full_rebuild else load_manifest(persist_dir)
+    model = (embed_model or Settings.embed_model).model_name
+    if manifest is not None and manifest.get("format", "simple") != store_format:
+        manifest = None
+    # Manifests written before the model was recorded are assumed to match
+    if manifest is not None and manifest.get("model", model) != model:
+        manifest = None
+    if manifest is not None and manifest.get("reduction") != reduction:
+        manifest = None
+    # Before the mode was recorded, long documents were always truncated
+    if manifest is not None and manifest.get("long_documents", "truncate") != long_documents:
+        manifest = None
+
+    if manifest is None:
+        start = time.time()
+        index = _build_index(docs, store_format, show_progress, embed_nodes, embed_model)
+        _persist(index, persist_dir, store_format, dtype, quantize, hnsw, reduction)
+        delta = {"added": len(docs), "changed": 0, "removed": 0, "unchanged": 0, "seconds": round(time.time() - start, 1)}
+        save_manifest(persist_dir, hashes, delta, store_format, quantize, hnsw, model, reduction, long_documents)
+        print(f"Full build: embedded {len(docs)} documents in {delta['seconds']}s.")
+        return delta
+
+    old_hashes = manifest["hashes"]
+    added = [doc for doc in docs if doc.id_ not in old_hashes]
+    changed = [doc for doc in docs if doc.id_ in old_hashes and old_hashes[doc.id_] != hashes[doc.id_]]
+    removed = [doc_id for doc_id in old_hashes if doc_id not in hashes]
+    delta = {"added": len(added), "changed": len(changed), "removed": len(removed),
+             "unchanged": len(docs) - len(added) - len(changed)}
+
+    options_changed = store_format == "flat" and (sorted(quantize) != manifest.get("quantized", []) or hnsw != manifest.get("hnsw"))
+    if not (added or changed or removed):
+        if options_changed:
+            _persist_flat_store(FlatVectorStore.from_persist_dir(persist_dir, mmap=False), persist_dir, dtype, quantize, hnsw, reduction)
+            save_manifest(persist_dir, hashes, delta, store_format, quantize, hnsw, model, reduction, long_documents)
+            print(f"No changes: {len(docs)} documents up to date; rewrote quantized codes {sorted(quantize)} and HNSW graph {hnsw} in {persist_dir}.")
+            return delta
+        print(f"No changes: {len(docs)} documents already up to date in {persist_dir}.")
+        return delta
+
+    start = time.time()
+    if store_format == "flat":
+        index = VectorStoreIndex.from_vector_store(FlatVectorStore.from_persist_dir(persist_dir, mmap=False), embed_model=embed_model)
+    else:
+        index = load_index_from_storage(StorageContext.from_defaults(persist_dir=persist_dir), embed_model=embed_model)
+    for doc_id in removed + [doc.id_ for doc in changed]:
+        index.delete_ref_doc(doc_id, delete_from_docstore=True)
+
+    # Split/parse the new documents like from_documents does, then embed only those nodes
+    nodes = run_transformations(added + changed, Settings.transformations, show_progress=show_progress)
+    if embed_nodes is not None:
+        nodes = embed_nodes(nodes)
+    index.insert_nodes(nodes)
+    _persist(index, persist_dir, store_format, dtype, quantize, hnsw, reduction)
+
+    delta["seconds"] = round(time.time() - start, 1)
+    save_manifest(persist_dir, hashes, delta, store_format, quantize, hnsw, model, reduction, long_documents)
+    print(f"Incremental update: +{delta['added']} new, ~{delta['changed']} changed, -{delta['removed']} removed "
+          f"({delta['unchanged']} unchanged) in {delta['seconds']}s.")
+    return delta
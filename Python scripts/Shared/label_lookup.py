@@ -0,0 +1,151 @@
+# label_lookup.py
+
+from collections import defaultdict, Counter
+
+from lexical_index import LEXICAL_INDEX_PATH, load_lexical_index, normalize_name, in_partitions
+
+# --- 1. CONFIGURATION ---
+
+# Length of the character n-grams used to find typo candidates
+NGRAM_SIZE = 3
+# Largest edit distance accepted as a typo, by normalized query length (shorter queries must be exact)
+MAX_EDITS_BY_LENGTH = ((4, 0), (9, 1), (None, 2))
+
+_label_lookup = None
+# Outcome counters of lookup_label, for reporting the fast-path hit rate
+_stats = Counter()
+
+
+# --- 2. HELPER FUNCTIONS ---
+
+def _ngrams(text: str) -> set:
+    padded = f" {text} "
+    return {padded[i:i + NGRAM_SIZE] for i in range(len(padded) - NGRAM_SIZE + 1)}
+
+
+def _max_edits(length: int) -> int:
+    for limit, edits in MAX_EDITS_BY_LENGTH:
+        if limit is None or length < limit:
+            return edits
+    return 0
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """
+    Edit distance counting an adjacent transposition as one edit (optimal string alignment),
+    abandoned early once a whole row exceeds `limit` (then returns limit + 1).
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before_previous, previous = None, list(range(len(b) + 1))
+    for i, char_a in enumerate(a, start=1):
+        current = [i] + [0] * len(b)
+        for j, char_b in enumerate(b, start=1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b))
+            if before_previous is not None and j > 1 and char_a == b[j - 2] and a[i - 2] == char_b:
+                current[j] = min(current[j], before_previous[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        before_previous, previous = previous, current
+    return previous[-1]
+
+
+class LabelLookup:
+    """
+    Exact and near-exact name lookup over the lexical index entries (names, aliases and
+    URI local names, normalized). Exact hits come from a hash map; typo candidates are the
+    names sharing enough of the query's character trigrams, confirmed by edit distance.
+    """
+
+    def __init__(self, entries: list):
+        self.entries = entries
+        self.exact = defaultdict(lambda: defaultdict(list))     # kind -> normalized name -> [idx]
+        self.postings = defaultdict(lambda: defaultdict(set))   # kind -> trigram -> {normalized name}
+        for idx, entry in enumerate(entries):
+            for name in entry["names"]:
+                normalized = normalize_name(name)
+                if not normalized:
+                    continue
+                if idx not in self.exact[entry["kind"]][normalized]:
+                    self.exact[entry["kind"]][normalized].append(idx)
+                for gram in _ngrams(normalized):
+                    self.postings[entry["kind"]][gram].add(normalized)
+
+    def _results(self, kind: str, normalized: str) -> list:
+        return [self.entries[idx] for idx in self.exact[kind][normalized]]
+
+    def lookup(self, query: str, kind: str):
+        """
+        Returns (entries, "exact" | "fuzzy") when the query confidently names something,
+        or None. A typo match is only accepted if it is the single closest name.
+        """
+        normalized = normalize_name(query)
+        if not normalized:
+            return None
+        if normalized in self.exact[kind]:
+            return self._results(kind, normalized), "exact"
+
+        max_edits = _max_edits(len(normalized))
+        if max_edits == 0:
+            return None
+        grams = _ngrams(normalized)
+        overlap = Counter()
+        for gram in grams:
+            for name in self.postings[kind].get(gram, ()):
+                overlap[name] += 1
+        # q-gram lemma: each edit (a transposition included) destroys at most NGRAM_SIZE + 1 n-grams
+        threshold = max(1, len(grams) - (NGRAM_SIZE + 1) * max_edits)
+        distances = defaultdict(list)
+        for name, shared in overlap.items():
+            if shared >= threshold:
+                distance = edit_distance(normalized, name, max_edits)
+                if distance <= max_edits:
+                    distances[distance].append(name)
+        if not distances:
+            return None
+        best = distances[min(distances)]
+        uris = {self.entries[idx]["uri"] for name in best for idx in self.exact[kind][name]}
+        if len(uris) != 1:
+            return None
+        return self._results(kind, best[0]), "fuzzy"
+
+
+def load_label_lookup(path: str = LEXICAL_INDEX_PATH):
+    """Builds the lookup from the persisted lexical index once. Returns None if it has not been built."""
+    global _label_lookup
+    if _label_lookup is None:
+        index = load_lexical_index(path)
+        _label_lookup = LabelLookup(index.entries if index is not None else [])
+    return _label_lookup if _label_lookup.entries else None
+
+
+# --- 3. FAST PATH ---
+
+def lookup_label(query: str, kind: str, limit: int, partitions=None):
+    """
+    Fast path in front of the retrievers: returns [{"name", "uri"}] when the query is the
+    exact (or, allowing a typo, unambiguous) name or alias of an entity/class/property,
+    and None when the caller should fall through to vector/hybrid retrieval.
+    With `partitions`, a match outside those entity partitions counts as a miss.
+    """
+    lookup = load_label_lookup()
+    result = lookup.lookup(query, kind) if lookup is not None else None
+    _stats["calls"] += 1
+    if result is None:
+        _stats["miss"] += 1
+        return None
+    entries, match_type = result
+    entries = [e for e in entries if in_partitions(e, partitions)]
+    if not entries:
+        _stats["miss"] += 1
+        return None
+    _stats[match_type] += 1
+    return [{"name": e["name"], "uri": e["uri"]} for e in entries[:limit]]
+
+
+def fast_path_stats() -> dict:
+    """Calls, exact/fuzzy hits and misses of lookup_label so far, with the hit rate."""
+    calls = _stats["calls"]
+    hits = _stats["exact"] + _stats["fuzzy"]
+    return {"calls": calls, "exact": _stats["exact"], "fuzzy": _stats["fuzzy"], "miss": _stats["miss"],
+            "hit_rate": hits / calls if calls else 0.0}
@@ -0,0 +1,164 @@
+# lexical_index.py
+
+import os
+import re
+import json
+import math
+from collections import defaultdict, Counter
+
+# --- 1. CONFIGURATION ---
+
+# Written by IndexCreation/build_indices.py: one entry per entity/class/property with its searchable names
+LEXICAL_INDEX_PATH = "./storage/lexical_index.json"
+# Standard BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Names and aliases count this many times in a document's term frequencies; types count once
+NAME_FIELD_WEIGHT = 2
+# Lexical hits fused with the vector results
+LEXICAL_CANDIDATES = 20
+# Reciprocal-rank fusion constant: score = sum over rankings of 1 / (RRF_K + rank)
+RRF_K = 60
+
+# The entity document lines written by prepare_data.format_entity_document
+_ALIASES_LINE = re.compile(r'^It is also known as: (.*)\.$', re.MULTILINE)
+_TYPES_LINE = re.compile(r'^It is a type of: (.*)\.$', re.MULTILINE)
+
+_lexical_index = None
+
+
+# --- 2. HELPER FUNCTIONS ---
+
+def tokenize(text: str) -> list:
+    """Lowercased alphanumeric tokens; apostrophes are dropped ("Crow's" -> "crows") and '_' splits like a space."""
+    return re.findall(r'[a-z0-9]+', (text or "").lower().replace("'", "").replace("’", ""))
+
+
+def normalize_name(text: str) -> str:
+    return " ".join(tokenize(text))
+
+
+def _local_name(uri: str) -> str:
+    return re.split(r'[/#]', uri)[-1]
+
+
+def lexical_entries(docs, kind: str) -> list:
+    """
+    Searchable fields of the index Documents: the name and URI local name, plus, for
+    entities, the aliases and type labels from the document text and the partition
+    assigned by entity_partitions.assign_partitions. One entry per URI.
+    """
+    entries = {}
+    for doc in docs:
+        uri = doc.metadata["uri"]
+        if uri in entries:
+            continue
+        names = [doc.metadata.get("name", ""), _local_name(uri)]
+        types = []
+        if kind == "entity":
+            aliases = _ALIASES_LINE.search(doc.text)
+            if aliases:
+                names += [alias.strip() for alias in aliases.group(1).split(",")]
+            doc_types = _TYPES_LINE.search(doc.text)
+            if doc_types:
+                types = [t.strip() for t in doc_types.group(1).split(",")]
+        entries[uri] = {"kind": kind, "uri": uri, "name": doc.metadata.get("name", ""),
+                        "names": [n for n in dict.fromkeys(names) if n], "types": types}
+        if doc.metadata.get("partition"):
+            entries[uri]["partition"] = doc.metadata["partition"]
+    return list(entries.values())
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over the names, aliases and types of the indexed documents,
+    one posting list per token and kind. Exact identifiers such as "Crow's Perch" or
+    "Velen_Novigrad_Cave_Entrance_Pin_725p0_873p0" become plain token matches.
+    """
+
+    def __init__(self, entries: list):
+        self.entries = entries
+        self.postings = defaultdict(lambda: defaultdict(list))   # kind -> token -> [(idx, tf)]
+        self.doc_lengths = {}
+        lengths_by_kind = defaultdict(list)
+        for idx, entry in enumerate(entries):
+            kind = entry["kind"]
+            tokens = []
+            for name in entry["names"]:
+                tokens += tokenize(name) * NAME_FIELD_WEIGHT
+            for type_label in entry.get("types", []):
+                tokens += tokenize(type_label)
+            for token, tf in Counter(tokens).items():
+                self.postings[kind][token].append((idx, tf))
+            self.doc_lengths[idx] = len(tokens)
+            lengths_by_kind[kind].append(len(tokens))
+        self.doc_counts = {kind: len(lengths) for kind, lengths in lengths_by_kind.items()}
+        self.avg_lengths = {kind: sum(lengths) / max(len(lengths), 1) for kind, lengths in lengths_by_kind.items()}
+
+    def search(self, query: str, kind: str, limit: int = LEXICAL_CANDIDATES) -> list:
+        """Returns [(entry, score)] by descending BM25 score."""
+        n_docs = self.doc_counts.get(kind, 0)
+        if not n_docs:
+            return []
+        avg_length = self.avg_lengths[kind]
+        scores = defaultdict(float)
+        for token in set(tokenize(query)):
+            posting = self.postings[kind].get(token)
+            if not posting:
+                continue
+            idf = math.log(1 + (n_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+            for idx, tf in posting:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[idx] / avg_length)
+                scores[idx] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], self.entries[item[0]]["uri"]))
+        return [(self.entries[idx], score) for idx, score in ranked[:limit]]
+
+
+def in_partitions(entry: dict, partitions) -> bool:
+    """Whether an entry passes a partition restriction; entries from builds without partitions always do."""
+    return not partitions or entry.get("partition") is None or entry["partition"] in partitions
+
+
+def load_lexical_index(path: str = LEXICAL_INDEX_PATH):
+    """Loads the persisted lexical index once. Returns None if it has not been built."""
+    global _lexical_index
+    if _lexical_index is None:
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                _lexical_index = LexicalIndex(json.load(f))
+        else:
+            print(f"Warning: lexical index not found at {path}. Run IndexCreation/build_indices.py; searches will be vector-only.")
+            _lexical_index = LexicalIndex([])
+    return _lexical_index if _lexical_index.entries else None
+
+
+# --- 3. HYBRID SEARCH ---
+
+def reciprocal_rank_fusion(rankings: list, k: int = RRF_K) -> list:
+    """Fuses ranked lists of URIs; ties keep the order of first appearance."""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, uri in enumerate(ranking, start=1):
+            scores[uri] += 1.0 / (k + rank)
+    return sorted(scores, key=lambda uri: -scores[uri])
+
+
+def hybrid_search(query: str, kind: str, vector_search, limit: int, partitions=None):
+    """
+    BM25 over names/aliases/types fused with the dense results by reciprocal rank.
+    `vector_search(query)` returns [{"name", "uri"}]. Queries that are exactly a name or
+    alias are meant to be answered before this by label_lookup.lookup_label, unembedded.
+    Falls back to vector_search alone if the lexical index has not been built.
+    With `partitions`, lexical hits outside those entity partitions are dropped (the
+    vector search is expected to be restricted the same way).
+    """
+    index = load_lexical_index()
+    if index is None:
+        return vector_search(query)[:limit]
+
+    lexical = [entry for entry, _ in index.search(query, kind) if in_partitions(entry, partitions)]
+    dense = vector_search(query)
+    names = {e["uri"]: e["name"] for e in lexical}
+    names.update({r["uri"]: r["name"] for r in dense})
+    fused = reciprocal_rank_fusion([[r["uri"] for r in dense], [e["uri"] for e in lexical]])
+    return [{"name": names[uri], "uri": uri} for uri in fused[:limit]]
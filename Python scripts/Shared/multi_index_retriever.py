@@ -0,0 +1,52 @@
+# multi_index_retriever.py
+from llama_index.core import Settings
+from llama_index.core.schema import QueryBundle
+
+
+def embed_queries(embed_model, queries):
+    """
+    Embeds several queries in one forward pass. HuggingFaceEmbedding only exposes batching
+    for texts, so its query-prompt encoder (or OnnxEmbedding's) is called directly; models
+    with their own get_query_embedding_batch (CachedEmbedding) use it; others embed one by one.
+    """
+    if not queries:
+        return []
+    if hasattr(embed_model, "get_query_embedding_batch"):
+        return embed_model.get_query_embedding_batch(list(queries))
+    if embed_model.class_name() in ("HuggingFaceEmbedding", "OnnxEmbedding"):
+        return embed_model._embed(list(queries), prompt_name="query")
+    return [embed_model.get_query_embedding(query) for query in queries]
+
+
+class MultiIndexRetriever:
+    """
+    Retrieves from several indexes (entity, class, property) for the same question while
+    embedding it only once. The query vector is computed up front and handed to every
+    retriever in a QueryBundle; LlamaIndex retrievers only embed bundles without one.
+    All retrievers must share the embedding model, otherwise one vector cannot serve them all.
+    """
+
+    def __init__(self, retrievers: dict, embed_model=None):
+        self.retrievers = retrievers
+        self.embed_model = embed_model or Settings.embed_model
+        model_names = {getattr(getattr(r, "_embed_model", None), "model_name", None) for r in retrievers.values()}
+        model_names.discard(None)
+        if len(model_names) > 1:
+            raise ValueError(f"MultiIndexRetriever needs one embedding model for all indexes, got {sorted(model_names)}.")
+
+    def embed(self, query) -> QueryBundle:
+        if isinstance(query, QueryBundle):
+            if query.embedding is None:
+                query.embedding = self.embed_model.get_query_embedding(query.query_str)
+            return query
+        return QueryBundle(query, embedding=self.embed_model.get_query_embedding(query))
+
+    def retrieve(self, query, names=None) -> dict:
+        """Returns {name: [NodeWithScore]} for every retriever (or those in `names`), from a single query embedding."""
+        query_bundle = self.embed(query)
+        return {name: retriever.retrieve(query_bundle) for name, retriever in self.retrievers.items()
+                if names is None or name in names}
+
+    def embed_batch(self, queries) -> list:
+        """QueryBundles for several queries, embedded together (see embed_queries)."""
+        return [QueryBundle(query, embedding=embedding) for query, embedding in zip(queries, embed_queries(self.embed_model, queries))]
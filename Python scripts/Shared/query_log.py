@@ -0,0 +1,210 @@
+# query_log.py
+
+import os
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from SPARQLWrapper import SPARQLWrapper, JSON
+
+from sparql_canonical import query_fingerprint
+
+# --- 1. CONFIGURATION ---
+
+# Queries slower than this are appended to the slow-query log
+SLOW_QUERY_THRESHOLD_MS = float(os.environ.get("SLOW_QUERY_MS", "1000"))
+SLOW_QUERY_LOG_PATH = os.environ.get("SLOW_QUERY_LOG", "slow_queries.jsonl")
+# Where export_query_stats() writes one JSON line per histogram
+QUERY_STATS_PATH = os.environ.get("QUERY_STATS_LOG", "query_latency_stats.jsonl")
+# Linear sub-buckets per power of two: 2^7 = 128 keeps every bucket within ~1.6% of its value
+SUB_BUCKET_BITS = 7
+# Percentiles reported per histogram
+REPORTED_PERCENTILES = (50, 90, 99, 99.9)
+
+_SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+_HALF_SUB_BUCKET_COUNT = _SUB_BUCKET_COUNT >> 1
+
+# Free-form tags (template_id, pipeline, ...) attached to every query issued inside query_tags()
+_current_tags = contextvars.ContextVar("query_tags", default={})
+
+
+# --- 2. STREAMING HISTOGRAM ---
+
+class LatencyHistogram:
+    """
+    HDR-style log-linear histogram of latencies in microseconds. Values below 2^SUB_BUCKET_BITS
+    get exact buckets; above that every power of two is split into 64 linear sub-buckets,
+    so memory stays constant while percentiles keep a bounded relative error.
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.total_count = 0
+        self.total_us = 0
+        self.max_us = 0
+
+    @staticmethod
+    def _bucket_index(value: int) -> int:
+        if value < _SUB_BUCKET_COUNT:
+            return value
+        shift = value.bit_length() - SUB_BUCKET_BITS
+        return shift * _HALF_SUB_BUCKET_COUNT + (value >> shift)
+
+    @staticmethod
+    def _bucket_upper(index: int) -> int:
+        if index < _SUB_BUCKET_COUNT:
+            return index
+        shift = index // _HALF_SUB_BUCKET_COUNT - 1
+        mantissa = index - shift * _HALF_SUB_BUCKET_COUNT
+        return ((mantissa + 1) << shift) - 1
+
+    def record(self, value_us: int):
+        value_us = max(0, int(value_us))
+        index = self._bucket_index(value_us)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.total_count += 1
+        self.total_us += value_us
+        self.max_us = max(self.max_us, value_us)
+
+    def percentile(self, p: float) -> int:
+        """Upper bound of the bucket holding the p-th percentile, in microseconds."""
+        if not self.total_count:
+            return 0
+        target = max(1, int(round(p / 100.0 * self.total_count)))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(self._bucket_upper(index), self.max_us)
+        return self.max_us
+
+    def summary(self) -> dict:
+        summary = {
+            "count": self.total_count,
+            "mean_ms": round(self.total_us / self.total_count / 1000, 3) if self.total_count else 0.0,
+            "max_ms": round(self.max_us / 1000, 3),
+        }
+        for p in REPORTED_PERCENTILES:
+            summary[f"p{p:g}_ms"] = round(self.percentile(p) / 1000, 3)
+        return summary
+
+
+class _GroupStats:
+    def __init__(self):
+        self.histogram = LatencyHistogram()
+        self.rows = 0
+        self.bytes = 0
+        self.errors = 0
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _record(groups: list, latency_us: int, rows: int, num_bytes: int, failed: bool):
+    with _stats_lock:
+        for group in groups:
+            stats = _stats.get(group)
+            if stats is None:
+                stats = _stats[group] = _GroupStats()
+            stats.histogram.record(latency_us)
+            stats.rows += rows
+            stats.bytes += num_bytes
+            stats.errors += 1 if failed else 0
+
+
+# --- 3. INSTRUMENTED EXECUTION ---
+
+@contextmanager
+def query_tags(**tags):
+    """Attaches tags (e.g. template_id, pipeline) to every query executed inside the block."""
+    token = _current_tags.set({**_current_tags.get(), **tags})
+    try:
+        yield
+    finally:
+        _current_tags.reset(token)
+
+
+def execute_logged_query(endpoint_url: str, query: str, caller: str, agent: str = None) -> dict:
+    """
+    Executes a SPARQL query and returns the decoded JSON result, like
+    SPARQLWrapper's query().convert(), while recording latency, rows and bytes received
+    into the per-caller / per-fingerprint / per-template histograms. Queries slower than
+    SLOW_QUERY_THRESHOLD_MS are appended to SLOW_QUERY_LOG_PATH. Exceptions are re-raised.
+    """
+    sparql = SPARQLWrapper(endpoint_url)
+    sparql.setQuery(query)
+    sparql.setReturnFormat(JSON)
+    if agent:
+        sparql.agent = agent
+
+    results, num_bytes, rows, error = None, 0, 0, None
+    start = time.perf_counter()
+    try:
+        raw = sparql.query().response.read()
+        num_bytes = len(raw)
+        results = json.loads(raw)
+    except Exception as e:
+        error = e
+    latency_us = int((time.perf_counter() - start) * 1_000_000)
+
+    if results is not None:
+        rows = 1 if "boolean" in results else len(results.get("results", {}).get("bindings", []))
+
+    # Fingerprinting parses the query, so it happens outside the timed section
+    fingerprint = query_fingerprint(query)
+    tags = _current_tags.get()
+    groups = [("all", "all"), ("caller", caller), ("fingerprint", fingerprint)]
+    if "template_id" in tags:
+        groups.append(("template", tags["template_id"]))
+    _record(groups, latency_us, rows, num_bytes, error is not None)
+
+    latency_ms = latency_us / 1000
+    if latency_ms >= SLOW_QUERY_THRESHOLD_MS:
+        entry = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "caller": caller,
+            "fingerprint": fingerprint,
+            "latency_ms": round(latency_ms, 2),
+            "rows": rows,
+            "bytes": num_bytes,
+            "tags": tags,
+            "error": str(error) if error else None,
+            "query": query,
+        }
+        with _stats_lock, open(SLOW_QUERY_LOG_PATH, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry) + "\n")
+
+    if error is not None:
+        raise error
+    return results
+
+
+# --- 4. EXPORT ---
+
+def query_stats() -> list:
+    """One summary dict per (group, key) histogram, slowest total time first."""
+    with _stats_lock:
+        rows = []
+        for (group, key), stats in _stats.items():
+            rows.append({"group": group, "key": key, **stats.histogram.summary(),
+                         "total_ms": round(stats.histogram.total_us / 1000, 3),
+                         "rows": stats.rows, "bytes": stats.bytes, "errors": stats.errors})
+    return sorted(rows, key=lambda r: r["total_ms"], reverse=True)
+
+
+def export_query_stats(path: str = QUERY_STATS_PATH, top: int = 10):
+    """Writes every histogram summary as JSONL and prints the groups that dominate endpoint time."""
+    stats = query_stats()
+    if not stats:
+        return
+    with open(path, 'w', encoding='utf-8') as f:
+        for row in stats:
+            f.write(json.dumps(row) + "\n")
+
+    print(f"\n--- SPARQL Query Latency ({path}) ---")
+    for group in ("all", "caller", "template", "fingerprint"):
+        for row in [r for r in stats if r["group"] == group][:top]:
+            print(f"  {group:<11} {str(row['key']):<40} n={row['count']:<6} total={row['total_ms']:>10.1f} ms  "
+                  f"p50={row['p50_ms']:>8.1f}  p99={row['p99_ms']:>8.1f}  max={row['max_ms']:>8.1f}  rows={row['rows']}  bytes={row['bytes']}")
@@ -0,0 +1,168 @@
+# sparql_canonical.py
+
+import json
+import re
+import hashlib
+import argparse
+from collections import defaultdict
+from functools import lru_cache
+from typing import NamedTuple
+from rdflib import Variable
+from rdflib.paths import Path
+from rdflib.plugins.sparql.parser import parseQuery
+from rdflib.plugins.sparql.algebra import translateQuery
+from rdflib.plugins.sparql.parserutils import CompValue
+
+# --- 1. CONFIGURATION ---
+
+# Union of every prefix block used across the scripts (pipelines.py, evaluate_pipelines.py,
+# prepare_data.py, ...). Queries are parsed with these as initial namespaces, so a query
+# with or without the prepended NAMESPACES string canonicalizes to the same text.
+KNOWN_PREFIXES = {
+    "witcher": "http://cgi.di.uoa.gr/witcher/ontology#",
+    "dbr": "http://cgi.di.uoa.gr/witcher/resource/",
+    "rdf": "http://www.w3.org/1999/02/22-rdf-syntax-ns#",
+    "rdfs": "http://www.w3.org/2000/01/rdf-schema#",
+    "owl": "http://www.w3.org/2002/07/owl#",
+    "xsd": "http://www.w3.org/2001/XMLSchema#",
+    "geo": "http://www.opengis.net/ont/geosparql#",
+    "geof": "http://www.opengis.net/def/function/geosparql/",
+}
+
+# Algebra keys that carry no query semantics (bookkeeping sets of in-scope variables)
+_SKIPPED_KEYS = {"_vars"}
+
+# Algebra nodes whose operands can be reordered without changing the query
+_COMMUTATIVE_EXPRESSIONS = {"ConditionalAndExpression"}
+
+
+class CanonicalQuery(NamedTuple):
+    text: str          # Canonical serialization of the query algebra
+    fingerprint: str   # 64-bit fingerprint of `text`, as 16 hex characters
+    parsed: bool       # False if the query could not be parsed and `text` is only whitespace-normalized
+
+
+# --- 2. HELPER FUNCTIONS ---
+
+def fingerprint_text(text: str) -> str:
+    """Returns a 64-bit (16 hex character) fingerprint of a string."""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def _abstract_name(variable) -> str:
+    """Variable namer used for sort keys: all variables look the same."""
+    return "?"
+
+
+def _serialize(node, namer) -> str:
+    """
+    Serializes an rdflib algebra tree into a deterministic string.
+    BGP triples and FILTER conjuncts are sorted by a key in which every variable
+    is abstracted away, so the ordering never depends on the variable names.
+    """
+    if isinstance(node, Variable):
+        return namer(node)
+    if isinstance(node, Path):
+        return node.n3()
+    if isinstance(node, CompValue):
+        if node.name == "BGP":
+            triples = sorted(node["triples"], key=lambda t: _serialize(t, _abstract_name))
+            return "BGP(" + " . ".join(_serialize(t, namer) for t in triples) + ")"
+        if node.name in _COMMUTATIVE_EXPRESSIONS:
+            operands = [node["expr"]] + list(node.get("other") or [])
+            operands.sort(key=lambda o: _serialize(o, _abstract_name))
+            return node.name + "(" + ", ".join(_serialize(o, namer) for o in operands) + ")"
+        parts = []
+        for key, value in node.items():
+            # rdflib stores the translated pattern of (NOT) EXISTS as an attribute, shadowing the raw key
+            value = vars(node).get(key, value)
+            if key in _SKIPPED_KEYS or value is None or (isinstance(value, (list, tuple)) and not value):
+                continue
+            parts.append(f"{key}={_serialize(value, namer)}")
+        return node.name + "(" + ", ".join(parts) + ")"
+    if isinstance(node, (list, tuple)):
+        return "[" + ", ".join(_serialize(item, namer) for item in node) + "]"
+    if isinstance(node, (set, frozenset)):
+        return "{" + ", ".join(sorted(_serialize(item, namer) for item in node)) + "}"
+    if hasattr(node, "n3"):
+        return node.n3()
+    return str(node)
+
+
+def _is_select_star(parsed) -> bool:
+    """True for `SELECT *` queries, whose projection order rdflib derives from a set."""
+    query = parsed[1]
+    return getattr(query, "name", "") == "SelectQuery" and "projection" not in query
+
+
+def _normalize_whitespace(query: str) -> str:
+    return re.sub(r"\s+", " ", query).strip()
+
+
+# --- 3. CANONICALIZER ---
+
+@lru_cache(maxsize=4096)
+def canonicalize_query(query: str) -> CanonicalQuery:
+    """
+    Canonicalizes a SPARQL query so that trivially different spellings of the same
+    query share an identity:
+      - prefixed names are expanded (the known prefixes need not be declared),
+      - variables are renamed positionally (?v0, ?v1, ...) in traversal order,
+      - BGP triples and FILTER conjuncts are sorted.
+    Returns the canonical text and its 64-bit fingerprint. Unparseable queries fall back
+    to a whitespace-normalized string so every query still gets a stable fingerprint.
+    """
+    # Same clean-up as clean_sparql_string in the evaluation scripts
+    cleaned = (query or "").replace('\\n', ' ').replace('\\"', '"').strip()
+
+    try:
+        parsed = parseQuery(cleaned)
+        algebra = translateQuery(parsed, initNs=KNOWN_PREFIXES).algebra
+    except Exception:
+        text = _normalize_whitespace(cleaned)
+        return CanonicalQuery(text=text, fingerprint=fingerprint_text(text), parsed=False)
+
+    if _is_select_star(parsed) or algebra.name == "AskQuery":
+        # The projection of SELECT * / ASK is an unordered set in rdflib's algebra
+        algebra = CompValue(algebra.name, **{k: v for k, v in algebra.items() if k != "PV"})
+        if "p" in algebra and isinstance(algebra["p"], CompValue) and algebra["p"].name == "Project":
+            algebra["p"] = CompValue("Project", **{k: v for k, v in algebra["p"].items() if k != "PV"})
+
+    names = {}
+    def positional_name(variable):
+        if variable not in names:
+            names[variable] = f"?v{len(names)}"
+        return names[variable]
+
+    text = _serialize(algebra, positional_name)
+    return CanonicalQuery(text=text, fingerprint=fingerprint_text(text), parsed=True)
+
+
+def query_fingerprint(query: str) -> str:
+    """Shortcut returning only the 64-bit fingerprint of a query."""
+    return canonicalize_query(query).fingerprint
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Canonicalize SPARQL queries and report duplicate groups in a benchmark file.")
+    parser.add_argument("--input-file", default="../WitcherBenchmark/test_set.json", help="Benchmark JSON file with 'sparql_query' entries.")
+    args = parser.parse_args()
+
+    with open(args.input_file, 'r') as f:
+        dataset = json.load(f)
+
+    groups = defaultdict(list)
+    unparsed = 0
+    for item in dataset:
+        canonical = canonicalize_query(item['sparql_query'])
+        unparsed += 0 if canonical.parsed else 1
+        groups[canonical.fingerprint].append(item.get('query_id'))
+
+    duplicates = {fp: ids for fp, ids in groups.items() if len(ids) > 1}
+    print(f"{len(dataset)} queries, {len(groups)} distinct fingerprints, {unparsed} unparseable.")
+    for fp, ids in duplicates.items():
+        print(f"  - {fp}: {ids}")
+
+
+if __name__ == "__main__":
+    main()